@@ -116,8 +116,7 @@ class PatrollingGuard(GuardAgent):
             self.patrol_point = self.patrol_route[self.patrol_idx]
 
         target = self.patrol_point if not self.chase else self.seen_intruder.location
-        self.path = self.map.find_path(self.location, target)
-        self.path = self.path and self.path[1:]
+        self.path = self.plan_path(target)
 
     def on_tick(self, seen_agents) -> None:
         """ Agent logic goes here """
@@ -263,8 +262,7 @@ class PathfindingIntruder(IntruderAgent):
 
     def on_vision_update(self) -> None:
         """ Called when vision is updated """
-        self.path = self.map.find_path(self.location, self.target)
-        self.path = self.path and self.path[1:]  # remove starting node
+        self.path = self.plan_path(self.target)  # without the starting node
 
     def on_tick(self, seen_agents) -> None:
         """ Agent logic goes here """
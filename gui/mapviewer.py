@@ -174,10 +174,12 @@ class MapViewer(renderer.WindowComponent):
         self.map_items.draw()
 
         # draw noises
-        for noise in self.world.noises + self.world.old_noises:
-            radius = max(0, noise.radius - (self.world.time_ticks - noise.time) * self.world.TIME_PER_TICK * 0.5 * noise.radius)
+        noises = self.world.noises
+        rows = noises.rows()
+        radii = noises.radius[rows] * (1 - (self.world.time_ticks - noises.time[rows]) * self.world.TIME_PER_TICK * 0.5)
+        for x, y, radius in zip(noises.x[rows], noises.y[rows], radii):
             if radius > 0:  # and not noise.drawn:
-                arcade.draw_ellipse_outline(noise.location.x, noise.location.y, radius, radius, arcade.color.AIR_FORCE_BLUE, border_width=0.2)
+                arcade.draw_ellipse_outline(x, y, radius, radius, arcade.color.AIR_FORCE_BLUE, border_width=0.2)
          
         # draw agent trails
         for ID, agent in self.world.agents.items():
@@ -9,10 +9,10 @@ from ai import agents
 def load_world(files, ia, sa):
     names = files.split()
     if len(names) > 1:
-        world = World.load_map(names[0])
+        world = World.load_map(names[0], sightlines=True)
         world.load_agents(names[1])
     else:
-        world = World.from_file(names[0], load_agents=True)
+        world = World.from_file(names[0], load_agents=True, sightlines=True)
         
     world.clear_agents()
     for i in range(1, ia+1):   
@@ -1,8 +1,7 @@
-from typing import NewType, List, Tuple
+from typing import NewType, List, Tuple, Optional, Sequence
 from abc import ABCMeta, abstractmethod
 import math
 import vectormath as vmath
-import random
 
 from .util import Position
 from . import vision
@@ -43,6 +42,9 @@ class Agent(metaclass=ABCMeta):
         self._sprint_rest_time = 10
         self._sprint_time = 5
         self.path = None
+        # the last path found by `plan_path` (including the starting tile) and what it depended on
+        self._planned_path = None
+        self._planned_key = None
         self.is_captured = False
         
         # Guard agents interaction with towers
@@ -91,7 +93,9 @@ class Agent(metaclass=ABCMeta):
         self._world = world
 
         # init mapview
-        self.map = vision.MapView(self._world.map)
+        self.map = vision.MapView(self._world.map, backend=self._world.vision_backend,
+                                  path_backend=self._world.path_backend, path_budget=self._world.path_budget,
+                                  path_time_budget=self._world.path_time_budget)
 
         # pick entry point
         start = self.on_pick_start()
@@ -135,6 +139,18 @@ class Agent(metaclass=ABCMeta):
         """ Turn towards absolute heading """
         self._turn_target = target_angle
 
+    def plan_path(self, target: vmath.Vector2) -> 'simulation.pathfinding.Path':
+        """
+        Finds a path from the current location to `target`, without the starting tile.
+        When nothing the search depends on has changed since the last time it just returns the same path again,
+        which is exactly what the search would have found
+        """
+        key = self.map.path_key(self.location, target)
+        if key is None or key != self._planned_key:
+            self._planned_path = self.map.find_path(self.location, target)
+            self._planned_key = key
+        return self._planned_path and self._planned_path[1:]
+
     def turn_to_point(self, target: vmath.Vector2):
         diff = target - self.location
         if diff.length > 1e-5:
@@ -295,9 +311,19 @@ class Agent(metaclass=ABCMeta):
             distance = math.copysign(min(world.World.TIME_PER_TICK * self.move_speed, abs(self._move_target)), self._move_target)
             self.location.move(distance, angle=self.heading)
             self._move_target -= distance
-        self.make_noise()
 
     def _update_vision(self, force=False) -> bool:
+        request = self._vision_request(force)
+        self._update_visibility()
+        if request is not None:
+            self.map._reveal_visible(*request)
+        return request is not None
+
+    def _vision_request(self, force=False) -> Optional[Tuple[int, int, float, float, float, bool]]:
+        """
+        Works out whether the vision needs to be updated
+        return: The arguments for `MapView._reveal_visible` if it does, `None` otherwise
+        """
         current_tile = (int(self.location.x), int(self.location.y))
         current_x, current_y = current_tile
 
@@ -321,6 +347,17 @@ class Agent(metaclass=ABCMeta):
 
         vision_modifier = self.map.get_vision_modifier(current_x, current_y)
 
+        if force or self._last_tile != current_tile or abs(self.heading - self._last_heading) > 5 or self._in_tower:
+            self._last_tile = current_tile
+            self._last_heading = self.heading
+            return (current_x, current_y, self.current_view_range*vision_modifier,
+                    self.view_angle, self.heading, self._in_tower)
+        return None
+
+    def _update_visibility(self):
+        """ Updates how far away other agents can see us """
+        vision_modifier = self.map.get_vision_modifier(int(self.location.x), int(self.location.y))
+
         # check if agent is settled in decreased vision area
         if vision_modifier < 1.0 and self._move_target != 0:
             if self._dec_vision_time * world.World.TIME_PER_TICK > 10:
@@ -330,21 +367,23 @@ class Agent(metaclass=ABCMeta):
             self._dec_vision_time = 0
             self.visibility_range = self.tower_view_range  # self.view_range
 
-        if force or self._last_tile != current_tile or abs(self.heading - self._last_heading) > 5 or self._in_tower:
-            self._last_tile = current_tile
-            self.map._reveal_visible(current_x, current_y, self.current_view_range*vision_modifier,
-                                     self.view_angle, self.heading, self._in_tower)
-            self._last_heading = self.heading
-            return True
-        return False
+    def tick(self, seen_agents: Sequence['vision.AgentView'], noises: List['world.PerceivedNoise'],
+             vision_updated: Optional[bool] = None):
+        """
+        `vision_updated`: whether the vision was already updated for this tick, e.g. in a batch by the `World`,
+                          `None` means the agent should update it itself
+        """
+        if vision_updated is None:
+            # tower interaction
+            self._update_tower_interaction()
 
-    def tick(self, seen_agents: List['vision.AgentView'], noises: List['world.PerceivedNoise']):
-        # tower interaction
-        self._update_tower_interaction()
+            # process vision
+            vision_updated = self._update_vision(force=(self.time_ticks == 0))
+        else:
+            # the rest of the vision was already taken care of
+            self._update_visibility()
 
-        # process vision
-        has_updated = self._update_vision(force=(self.time_ticks == 0))
-        if has_updated:
+        if vision_updated:
             self.on_vision_update()
 
         # noises
@@ -409,23 +448,6 @@ class Agent(metaclass=ABCMeta):
         """ Agent logic goes here """
         pass
 
-    def make_noise(self):
-        event_rate = 0.1
-        random_events_per_second = (event_rate / 60) * (self._world.map.size[0] * self._world.map.size[1] / 25)
-        chance_to_emit = random_events_per_second * self._world.TIME_PER_TICK
-        radius = 0
-        if self.move_speed > 0:
-            radius = 1 / 2
-        if self.move_speed > 0.5:
-            radius = 3 / 2
-        if self.move_speed > 1:
-            radius = 5 / 2
-        if self.move_speed > 2:
-            radius = 10 / 2
-        if random.uniform(0, 1) < chance_to_emit:
-            noise_event = world.NoiseEvent(Position(self.location.x, self.location.y), self, radius)
-            self._world.add_noise(noise_event)
-
 
 class GuardAgent(Agent):
     def __init__(self) -> None:
@@ -0,0 +1,207 @@
+from typing import Tuple
+import numpy as np
+
+from .spatial import SpatialHash
+
+
+class WallField:
+    """
+    Signed distance to the walls of a map: the distance to the closest wall (negative when inside one),
+    worked out exactly for just the points that are asked for, so there's nothing stored besides the walls.
+    Walls are the actual squares of the wall tiles, and everything outside of the map counts as wall too.
+    Only the walls within `RANGE` tiles are looked at, which is plenty for pushing agents out of walls,
+    points deeper inside a wall than that get pushed to the closest open tile on the whole map.
+    """
+
+    RANGE = 2
+
+    def __init__(self, walls: np.ndarray):
+        self.size = walls.shape
+        k = self.RANGE
+        # padded so the tiles around a point can always be looked up, even just outside of the map
+        self._walls = np.pad(walls, k + 1, mode='constant', constant_values=True)
+        # offsets of the tiles around a point that are looked at
+        dx, dy = np.meshgrid(np.arange(-k, k + 1), np.arange(-k, k + 1), indexing='ij')
+        self._dx, self._dy = dx.reshape(-1), dy.reshape(-1)
+        # all open tiles, only needed for points that are deep inside a wall
+        self._open: np.ndarray = None
+
+    @classmethod
+    def for_map(cls, map: 'simulation.environment.Map') -> 'WallField':
+        """ Returns the (cached) field for `map`, it's only made again when the map has changed """
+        if map.wall_field is None or map.wall_field[0] != map.revision:
+            map.wall_field = (map.revision, WallField(np.asarray(map.walls, dtype=bool)))
+        return map.wall_field[1]
+
+    def _closest(self, x: np.ndarray, y: np.ndarray, wall: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The closest point on a wall (or open, if `wall` is False) tile within `RANGE` tiles of every point (x, y)
+        return: The distance to it (`inf` if there isn't one in range), its x and y, and the centre of its tile
+        """
+        width, height = self.size
+        k = self.RANGE
+        # points off the map are looked up from the tiles just outside of it, which are all walls
+        tx = np.clip(np.floor(x).astype(int), -1, width)[:, None] + self._dx[None, :]
+        ty = np.clip(np.floor(y).astype(int), -1, height)[:, None] + self._dy[None, :]
+        px = np.clip(x[:, None], tx, tx + 1)
+        py = np.clip(y[:, None], ty, ty + 1)
+        distance = np.sqrt((x[:, None] - px)**2 + (y[:, None] - py)**2)
+        distance[self._walls[tx + k + 1, ty + k + 1] != wall] = np.inf
+
+        closest = np.argmin(distance, axis=1)
+        rows = np.arange(len(x))
+        return (distance[rows, closest], px[rows, closest], py[rows, closest],
+                tx[rows, closest] + 0.5, ty[rows, closest] + 0.5)
+
+    def _closest_open(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """ Same as `_closest` for open tiles, but when there's none in range it looks at the whole map """
+        distance, px, py, cx, cy = self._closest(x, y, wall=False)
+        far = np.flatnonzero(np.isinf(distance))
+        if len(far):
+            k = self.RANGE
+            if self._open is None:
+                self._open = np.argwhere(~self._walls[k + 1:-k - 1, k + 1:-k - 1])
+            if len(self._open):
+                ox, oy = self._open[:, 0][None, :], self._open[:, 1][None, :]
+                fx = np.clip(x[far][:, None], ox, ox + 1)
+                fy = np.clip(y[far][:, None], oy, oy + 1)
+                d = np.sqrt((x[far][:, None] - fx)**2 + (y[far][:, None] - fy)**2)
+                closest = np.argmin(d, axis=1)
+                rows = np.arange(len(far))
+                distance[far], px[far], py[far] = d[rows, closest], fx[rows, closest], fy[rows, closest]
+                cx[far], cy[far] = self._open[closest, 0] + 0.5, self._open[closest, 1] + 0.5
+        return distance, px, py, cx, cy
+
+    def _inside(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """ Whether the points are inside (not just on the edge of) a wall """
+        k = self.RANGE
+        width, height = self.size
+        tx = np.clip(np.floor(x).astype(int), -1, width)
+        ty = np.clip(np.floor(y).astype(int), -1, height)
+        # on the edge of a wall tile, it's only inside if the tile on the other side is a wall too
+        inside = self._walls[tx + k + 1, ty + k + 1]
+        on_x, on_y = x == tx, y == ty
+        inside &= ~on_x | self._walls[tx + k, ty + k + 1]
+        inside &= ~on_y | self._walls[tx + k + 1, ty + k]
+        inside &= ~(on_x & on_y) | self._walls[tx + k, ty + k]
+        return inside
+
+    def distance_at(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        x, y = np.atleast_1d(np.asarray(x, dtype=float)), np.atleast_1d(np.asarray(y, dtype=float))
+        distance = self._closest(x, y, wall=True)[0]
+        inside = self._inside(x, y)
+        if inside.any():
+            distance[inside] = -self._closest_open(x[inside], y[inside])[0]
+        return distance
+
+    def resolve(self, x: np.ndarray, y: np.ndarray, radius: np.ndarray,
+                passes: int = 3, tolerance: float = 1e-3) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Pushes circles at (x, y) out of the walls, straight away from the closest wall
+        (or to the closest open space when they're inside one), more than one pass is needed when they're in a corner
+        return: The new x and y, and which of the circles were overlapping a wall
+        """
+        x, y = np.array(x, dtype=float), np.array(y, dtype=float)
+        radius = np.broadcast_to(np.asarray(radius, dtype=float), x.shape)
+        collided = np.zeros(x.shape, dtype=bool)
+        active = np.arange(len(x))
+        for _ in range(passes):
+            d, px, py, cx, cy = self._closest(x[active], y[active], wall=True)
+            inside = self._inside(x[active], y[active])
+            overlap = inside | (d < radius[active] - tolerance)
+            if not overlap.any():
+                break
+            active, px, py, cx, cy, inside = \
+                active[overlap], px[overlap], py[overlap], cx[overlap], cy[overlap], inside[overlap]
+            collided[active] = True
+
+            # away from the closest point on a wall
+            nx, ny = x[active] - px, y[active] - py
+            # right on the edge of a wall that's no direction at all, so away from the middle of that wall instead
+            edge = np.sqrt(nx**2 + ny**2) < 1e-9
+            nx[edge], ny[edge] = x[active][edge] - cx[edge], y[active][edge] - cy[edge]
+            if inside.any():
+                # or towards the closest point that's open, or the middle of that tile if we're right next to it
+                rows = np.flatnonzero(inside)
+                d, px[rows], py[rows], cx, cy = self._closest_open(x[active][rows], y[active][rows])
+                nx[rows], ny[rows] = px[rows] - x[active][rows], py[rows] - y[active][rows]
+                edge = np.sqrt(nx[rows]**2 + ny[rows]**2) < 1e-9
+                nx[rows[edge]], ny[rows[edge]] = cx[edge] - x[active][rows[edge]], cy[edge] - y[active][rows[edge]]
+                nx[rows[np.isinf(d)]] = ny[rows[np.isinf(d)]] = 0
+            length = np.sqrt(nx**2 + ny**2)
+            # no open space anywhere, leave them be
+            ok = length > 1e-9
+            active, px, py, nx, ny, length = active[ok], px[ok], py[ok], nx[ok], ny[ok], length[ok]
+            x[active] = px + nx / length * radius[active]
+            y[active] = py + ny / length * radius[active]
+        return x, y, collided
+
+
+class AgentSeparation:
+    """
+    Pushes overlapping agents apart, both of them by half of the overlap along the line between them.
+    A spatial hash finds the agents that are close enough to be touching, so this only has to look at
+    the agents nearby instead of at every pair, and all those pairs are then pushed apart at once.
+    """
+
+    # how much further than touching to look for pairs, so the pairs found still hold after a push
+    MARGIN = 0.5
+
+    def __init__(self, cell_size: float = 1.0):
+        self.hash = SpatialHash(cell_size)
+
+    def pairs(self, x: np.ndarray, y: np.ndarray, radius: np.ndarray,
+              groups: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds all pairs of agents that might be touching (and then some), only agents in the same group
+        can touch and agents in group -1 don't touch anything
+        return: The indices of the first and second agent of every pair
+        """
+        self.hash.clear()
+        largest = float(radius.max()) if len(radius) else 0
+        first, second = [], []
+        for i in range(len(x)):
+            if groups[i] < 0:
+                continue
+            # only look at the agents that are in already, so every pair is only found once
+            for j in self.hash.query(x[i], y[i], radius[i] + largest + self.MARGIN):
+                if groups[j] == groups[i]:
+                    first.append(j)
+                    second.append(i)
+            self.hash.insert(i, x[i], y[i])
+        return np.array(first, dtype=int), np.array(second, dtype=int)
+
+    def resolve(self, x: np.ndarray, y: np.ndarray, radius: np.ndarray, groups: np.ndarray,
+                passes: int = 2, tolerance: float = 1e-3) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Pushes apart the circles at (x, y) that overlap, see `pairs` for which of them can overlap.
+        Pushing a pair apart can push one of them into another, so this takes a few passes.
+        return: The new x and y, and which of the circles were overlapping another one
+        """
+        x, y = np.array(x, dtype=float), np.array(y, dtype=float)
+        radius = np.broadcast_to(np.asarray(radius, dtype=float), x.shape)
+        collided = np.zeros(x.shape, dtype=bool)
+        first, second = self.pairs(x, y, radius, np.asarray(groups))
+        for _ in range(passes):
+            if not len(first):
+                break
+            dx, dy = x[second] - x[first], y[second] - y[first]
+            distance = np.sqrt(dx**2 + dy**2)
+            overlap = radius[first] + radius[second] - distance
+            touching = overlap > tolerance
+            if not touching.any():
+                break
+            i, j = first[touching], second[touching]
+            dx, dy, distance, overlap = dx[touching], dy[touching], distance[touching], overlap[touching]
+            collided[i] = True
+            collided[j] = True
+
+            # agents right on top of each other get pushed apart along x
+            same = distance < 1e-9
+            nx = np.where(same, 1, dx / np.where(same, 1, distance))
+            ny = np.where(same, 0, dy / np.where(same, 1, distance))
+            np.add.at(x, i, -nx * overlap / 2)
+            np.add.at(y, i, -ny * overlap / 2)
+            np.add.at(x, j, nx * overlap / 2)
+            np.add.at(y, j, ny * overlap / 2)
+        return x, y, collided
@@ -0,0 +1,178 @@
+from typing import Dict, Optional, Tuple
+import os
+import hashlib
+import tempfile
+import concurrent.futures
+import numpy as np
+
+from .pathfinding import GridAStar
+
+
+def _neighbours(walls: np.ndarray, tiles: np.ndarray) -> np.ndarray:
+    """
+    For every one of the passable `tiles` and every move in `GridAStar.MOVES`: the index into `tiles` of the tile
+    that move gets to, -1 if it can't be made
+    """
+    index = np.full(walls.shape, -1, dtype=np.int64)
+    index[tiles[:, 0], tiles[:, 1]] = np.arange(len(tiles))
+    moves = GridAStar.moves(~walls)[tiles[:, 0], tiles[:, 1]]
+
+    neighbours = np.full((len(tiles), len(GridAStar.MOVES)), -1, dtype=np.int64)
+    for bit, (dx, dy) in enumerate(GridAStar.MOVES):
+        possible = (moves & (1 << bit)) != 0
+        neighbours[possible, bit] = index[tiles[possible, 0] + dx, tiles[possible, 1] + dy]
+    return neighbours
+
+
+def _build_rows(walls: np.ndarray, sources: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the distances from each of the `sources` (indices into the passable tiles of `walls`, in the order of
+    `np.argwhere`) to every passable tile, and from every tile the move (index into `GridAStar.MOVES`) to take to get
+    closer to the source.
+    This is a breadth-first search from every source at once: each round only the tiles that got closer in the round
+    before are expanded, until none do, so every (source, tile) pair is only touched a handful of times.
+    return: distances of shape (sources, passable tiles), `inf` where it can't be reached,
+            and moves of the same shape (255 where there is none)
+    """
+    tiles = np.argwhere(~walls)
+    neighbours = _neighbours(walls, tiles)
+    costs = [2**0.5 if dx and dy else 1.0 for dx, dy in GridAStar.MOVES]
+    n = len(tiles)
+
+    # flat (source, tile) -> distance, with the pairs that got closer in the last round as the frontier
+    distance = np.full(len(sources) * n, np.inf)
+    frontier = np.arange(len(sources)) * n + sources
+    distance[frontier] = 0
+    while len(frontier):
+        rows, tile = np.divmod(frontier, n)
+        reached, through = [], []
+        for move, cost in enumerate(costs):
+            other = neighbours[tile, move]
+            possible = other >= 0
+            pairs = rows[possible] * n + other[possible]
+            d = distance[frontier[possible]] + cost
+            closer = d < distance[pairs]
+            reached.append(pairs[closer])
+            through.append(d[closer])
+        reached = np.concatenate(reached)
+        np.minimum.at(distance, reached, np.concatenate(through))
+        frontier = np.unique(reached)
+    distance = distance.reshape(len(sources), n)
+
+    # moves go both ways, so the move to take from a tile is the one to the neighbour closest to the source
+    best = np.full(distance.shape, np.inf)
+    next_moves = np.full(distance.shape, 255, dtype=np.uint8)
+    for move, cost in enumerate(costs):
+        possible = neighbours[:, move] >= 0
+        via = np.full(distance.shape, np.inf)
+        via[:, possible] = distance[:, neighbours[possible, move]] + cost
+        better = via < best
+        best[better] = via[better]
+        next_moves[better] = move
+    next_moves[distance == 0] = 255
+    return distance.astype(np.float32), next_moves
+
+
+class DistanceTable:
+    """
+    Precomputed shortest walking distances between all pairs of passable tiles of a map (ignoring fog),
+    along with the first move to make to get from one to the other.
+    The tables are stored on disk and memory-mapped, so every process working on the same map shares them,
+    they take 3 bytes per pair of tiles so they're meant for maps up to about 100x100,
+    maps with more than `MAX_TILES` passable tiles don't get a table at all.
+    """
+
+    # distances are stored in steps of 1/SCALE tile
+    SCALE = 8
+    UNREACHABLE = 65535
+    # the most passable tiles a map can have to get a table, that's 300 MB of tables on disk
+    MAX_TILES = 100 * 100
+    # where the tables are kept, by hash of the walls
+    DIRECTORY = os.path.join(tempfile.gettempdir(), 'surveillance-distances')
+
+    # tables that have already been loaded, by hash of the walls
+    _cache: Dict[str, 'DistanceTable'] = {}
+
+    def __init__(self, walls: np.ndarray, path: str, workers: Optional[int] = None):
+        """ Loads the tables from `path` (without extension), building them first if they aren't there yet """
+        self.size = walls.shape
+        # tile -> row in the tables, -1 for walls
+        self.index = np.full(self.size, -1, dtype=np.int64)
+        self.tiles = np.argwhere(~walls)
+        self.index[self.tiles[:, 0], self.tiles[:, 1]] = np.arange(len(self.tiles))
+
+        if not (os.path.exists(path + '.distance.npy') and os.path.exists(path + '.next.npy')):
+            self._build(walls, path, workers)
+        # (to, from) -> distance in 1/SCALE tiles, and (to, from) -> index of the move to make
+        self._distance = np.load(path + '.distance.npy', mmap_mode='r')
+        self._next = np.load(path + '.next.npy', mmap_mode='r')
+
+    def _build(self, walls: np.ndarray, path: str, workers: Optional[int]):
+        n = len(self.tiles)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written to temporary files first, so other processes never see half a table
+        suffix = f'.{os.getpid()}.tmp.npy'
+        distance = np.lib.format.open_memmap(path + '.distance' + suffix, mode='w+', dtype=np.uint16, shape=(n, n))
+        next_move = np.lib.format.open_memmap(path + '.next' + suffix, mode='w+', dtype=np.uint8, shape=(n, n))
+
+        # split the sources up in chunks so we can build them in parallel
+        chunk = 128
+        bounds = [(start, min(start + chunk, n)) for start in range(0, n, chunk)]
+
+        def store(start, stop, rows):
+            d, m = rows
+            unreachable = ~np.isfinite(d)
+            d = np.round(np.where(unreachable, 0, d) * self.SCALE)
+            if (d >= self.UNREACHABLE).any():
+                raise ValueError(f'map is too big for a distance table ({n} passable tiles)')
+            distance[start:stop] = np.where(unreachable, self.UNREACHABLE, d)
+            next_move[start:stop] = m
+
+        if workers is not None and workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [(start, stop, executor.submit(_build_rows, walls, np.arange(start, stop)))
+                           for start, stop in bounds]
+                for start, stop, future in futures:
+                    store(start, stop, future.result())
+        else:
+            for start, stop in bounds:
+                store(start, stop, _build_rows(walls, np.arange(start, stop)))
+
+        distance.flush()
+        next_move.flush()
+        del distance, next_move
+        os.replace(path + '.distance' + suffix, path + '.distance.npy')
+        os.replace(path + '.next' + suffix, path + '.next.npy')
+
+    @classmethod
+    def for_map(cls, map: 'simulation.environment.Map', workers: Optional[int] = None,
+                directory: Optional[str] = None) -> Optional['DistanceTable']:
+        """
+        Returns the table for the walls of `map`, building it only if it isn't on disk yet,
+        or `None` if the map has too many passable tiles for one (see `MAX_TILES`)
+        """
+        walls = np.array(map.walls, dtype=bool)
+        if np.count_nonzero(~walls) > cls.MAX_TILES:
+            return None
+        key = hashlib.sha1(walls.tobytes() + repr(map.size).encode()).hexdigest()
+        path = os.path.join(directory or cls.DIRECTORY, key)
+        if path not in cls._cache:
+            cls._cache[path] = DistanceTable(walls, path, workers=workers)
+        return cls._cache[path]
+
+    def covers(self, x: int, y: int) -> bool:
+        """ Whether tile (x, y) is a passable tile on the map """
+        return 0 <= x < self.size[0] and 0 <= y < self.size[1] and self.index[x, y] >= 0
+
+    def distance(self, x0: int, y0: int, x: int, y: int) -> float:
+        """ Walking distance between two tiles that are `covered`, `inf` if one can't be reached from the other """
+        d = int(self._distance[self.index[x, y], self.index[x0, y0]])
+        return float('inf') if d == self.UNREACHABLE else d / self.SCALE
+
+    def next_tile(self, x0: int, y0: int, x: int, y: int) -> Optional[Tuple[int, int]]:
+        """ The tile to go to next to get from (x0, y0) to (x, y), `None` if already there or it can't be reached """
+        move = int(self._next[self.index[x, y], self.index[x0, y0]])
+        if move == 255:
+            return None
+        dx, dy = GridAStar.MOVES[move]
+        return x0 + dx, y0 + dy
@@ -49,6 +49,20 @@ class Map:
         self.gates: List[Gate] = gates if gates else []
         self.markers: List['world.Marker'] = markers if markers else []
 
+        # optional precomputed line-of-sight table, only valid as long as the walls don't change
+        self.sightlines: 'simulation.sightlines.SightLines' = None
+        # optional precomputed walking distances between all tiles, same deal
+        self.distances: 'simulation.distances.DistanceTable' = None
+        # distance field of the walls for collisions, along with the revision it was made for
+        self.wall_field: Tuple[int, 'simulation.collision.WallField'] = None
+        # what can be seen from the towers, by (x, y, radius, method), worked out when it's first needed
+        self.viewsheds: Dict[Tuple, 'simulation.vision.TowerViewshed'] = {}
+        # distances to target tiles (x, y) over the full map, shared by all agents (see `MapView.flow_field`),
+        # along with the revision they were made for
+        self.flow_fields: Dict[Tuple[int, int], Tuple[int, 'simulation.pathfinding.FlowField']] = {}
+        # bumped every time the map is edited, so anything derived from it knows when to update
+        self.revision = 0
+
     def to_dict(self) -> Dict:
         return {
             'size': self.size,
@@ -97,9 +111,11 @@ class Map:
     def add_tower(self, x: int, y: int):
         self.towers.append(Position(x, y))
         self.tower_map[x, y] = True
+        self.revision += 1
 
     def remove_tower(self, x: int, y: int):
         self.tower_map[x, y] = False
+        self.revision += 1
         for i, tower in enumerate(self.towers):
             if abs(tower.x - x) + abs(tower.y - y) <= 2:
                 del self.towers[i]
@@ -113,6 +129,10 @@ class Map:
     def set_wall(self, x: int, y: int, value=True):
         if self.in_bounds(x, y):
             self.walls[x][y] = True if value else False
+            # walls changed, so the line-of-sight and distance tables are no longer valid
+            self.sightlines = None
+            self.distances = None
+            self.revision += 1
 
     def is_wall(self, x: int, y: int) -> bool:
         if self.in_bounds(x, y):
@@ -144,6 +164,7 @@ class Map:
     def set_vision(self, x: int, y: int, value=0.5):
         if self.in_bounds(x, y):
             self.vision_modifier[x][y] = max(0, min(value, 1.0))
+            self.revision += 1
 
     def set_vision_area(self, x0, y0, x1, y1, value=0.5):
         # make sure values are in the right order
@@ -152,6 +173,7 @@ class Map:
         if y0 > y1:
             y0, y1 = y1, y0
         self.vision_modifier[x0:x1 + 1, y0:y1 + 1] = max(0, min(value, 1.0))
+        self.revision += 1
 
 
 class MapGenerator:
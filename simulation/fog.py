@@ -0,0 +1,184 @@
+from typing import Dict, Tuple, Iterable
+import numpy as np
+
+
+class FogOfWar:
+    """
+    Sparse, bit-packed fog-of-war.
+    The map is split up in square chunks which are only allocated once something in them is revealed,
+    every chunk stores one bit per tile.
+    Supports `fog[x][y]` and `fog[x, y]` like the plain `np.bool` array it replaces.
+    """
+
+    # size of a chunk in tiles, along both axes
+    CHUNK = 32
+    CHUNK_BITS = 5
+
+    def __init__(self, size: Tuple[int, int]):
+        self.size = (int(size[0]), int(size[1]))
+        # chunk coordinates -> packed bits, indexed by `local_x * CHUNK + local_y`
+        # (`bytearray`s are a lot faster to read one tile at a time than numpy arrays)
+        self._chunks: Dict[Tuple[int, int], bytearray] = {}
+        # bumped every time something is revealed
+        self.revision = 0
+
+    @property
+    def shape(self):
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._chunks) * self.CHUNK**2 // 8
+
+    def is_revealed(self, x: int, y: int) -> bool:
+        chunk = self._chunks.get((x >> self.CHUNK_BITS, y >> self.CHUNK_BITS))
+        if chunk is None:
+            return False
+        i = ((x & (self.CHUNK - 1)) << self.CHUNK_BITS) | (y & (self.CHUNK - 1))
+        return bool(chunk[i >> 3] & (0x80 >> (i & 7)))
+
+    def __getitem__(self, item):
+        # fog[x, y]
+        if isinstance(item, tuple):
+            if all(isinstance(i, (int, np.integer)) for i in item):
+                return self.is_revealed(*self._wrap(*item))
+            return self.to_array()[item]
+        # fog[x][y]
+        if isinstance(item, (int, np.integer)):
+            return _Column(self, self._wrap(item, 0)[0])
+        return self.to_array()[item]
+
+    def __setitem__(self, item, value):
+        # fog is only ever revealed, so clearing tiles isn't supported
+        if isinstance(item, tuple) and all(isinstance(i, (int, np.integer)) for i in item):
+            x, y = self._wrap(*item)
+            self.reveal(x, y, np.full((1, 1), bool(value)))
+        else:
+            visible = np.zeros(self.size, dtype=bool)
+            visible[item] = value
+            self.reveal(0, 0, visible)
+
+    def _wrap(self, x: int, y: int) -> Tuple[int, int]:
+        """ Negative indices count from the end, just like numpy """
+        if not -self.size[0] <= x < self.size[0] or not -self.size[1] <= y < self.size[1]:
+            raise IndexError(f'index ({x}, {y}) is out of bounds for fog of size {self.size}')
+        return int(x) % self.size[0], int(y) % self.size[1]
+
+    def _chunk_array(self, chunk: bytearray) -> np.ndarray:
+        return np.unpackbits(np.frombuffer(chunk, dtype=np.uint8)).reshape(self.CHUNK, self.CHUNK).view(bool)
+
+    def reveal(self, x_lo: int, y_lo: int, visible: np.ndarray) -> np.ndarray:
+        """
+        Reveals every tile that's set in `visible`, a window whose corner is at (x_lo, y_lo)
+        Parts of the window outside of the map are ignored.
+        return: The tiles in the window that weren't revealed before
+        """
+        newly = np.zeros(visible.shape, dtype=bool)
+        x0, x1 = max(x_lo, 0), min(x_lo + visible.shape[0], self.size[0])
+        y0, y1 = max(y_lo, 0), min(y_lo + visible.shape[1], self.size[1])
+        if x0 >= x1 or y0 >= y1:
+            return newly
+
+        for cx in range(x0 >> self.CHUNK_BITS, ((x1 - 1) >> self.CHUNK_BITS) + 1):
+            for cy in range(y0 >> self.CHUNK_BITS, ((y1 - 1) >> self.CHUNK_BITS) + 1):
+                # overlap between the window and the chunk, in map coordinates
+                ox0, ox1 = max(x0, cx * self.CHUNK), min(x1, (cx + 1) * self.CHUNK)
+                oy0, oy1 = max(y0, cy * self.CHUNK), min(y1, (cy + 1) * self.CHUNK)
+                window = np.s_[ox0 - x_lo:ox1 - x_lo, oy0 - y_lo:oy1 - y_lo]
+                if not visible[window].any():
+                    continue
+
+                chunk = self._chunks.get((cx, cy))
+                if chunk is None:
+                    chunk = self._chunks[cx, cy] = bytearray(self.CHUNK**2 // 8)
+                tiles = self._chunk_array(chunk)
+                local = np.s_[ox0 - cx * self.CHUNK:ox1 - cx * self.CHUNK, oy0 - cy * self.CHUNK:oy1 - cy * self.CHUNK]
+
+                newly[window] = visible[window] & ~tiles[local]
+                if newly[window].any():
+                    tiles[local] |= visible[window]
+                    chunk[:] = np.packbits(tiles).tobytes()
+                    self.revision += 1
+
+        return newly
+
+    def reveal_all(self):
+        self.reveal(0, 0, np.ones(self.size, dtype=bool))
+
+    def count(self) -> int:
+        """ Number of revealed tiles """
+        return sum(int(np.unpackbits(np.frombuffer(chunk, dtype=np.uint8)).sum()) for chunk in self._chunks.values())
+
+    def to_array(self) -> np.ndarray:
+        """ Returns the fog as a plain (dense) boolean array """
+        tiles = np.zeros(self.size, dtype=bool)
+        for (cx, cy), chunk in self._chunks.items():
+            x0, y0 = cx * self.CHUNK, cy * self.CHUNK
+            x1, y1 = min(x0 + self.CHUNK, self.size[0]), min(y0 + self.CHUNK, self.size[1])
+            tiles[x0:x1, y0:y1] = self._chunk_array(chunk)[:x1 - x0, :y1 - y0]
+        return tiles
+
+    def __array__(self, dtype=None):
+        tiles = self.to_array()
+        return tiles if dtype is None else tiles.astype(dtype)
+
+    def copy(self) -> 'FogOfWar':
+        fog = FogOfWar(self.size)
+        fog._chunks = {key: bytearray(chunk) for key, chunk in self._chunks.items()}
+        return fog
+
+    # vvvv team-wide operations, these work directly on the packed bits vvvv
+
+    def __or__(self, other: 'FogOfWar') -> 'FogOfWar':
+        fog = self.copy()
+        fog |= other
+        return fog
+
+    def __ior__(self, other: 'FogOfWar') -> 'FogOfWar':
+        self.revision += 1
+        for key, chunk in other._chunks.items():
+            if key in self._chunks:
+                mine = np.frombuffer(self._chunks[key], dtype=np.uint8)
+                mine |= np.frombuffer(chunk, dtype=np.uint8)
+            else:
+                self._chunks[key] = bytearray(chunk)
+        return self
+
+    def __and__(self, other: 'FogOfWar') -> 'FogOfWar':
+        fog = FogOfWar(self.size)
+        for key in self._chunks.keys() & other._chunks.keys():
+            chunk = np.frombuffer(self._chunks[key], dtype=np.uint8) & np.frombuffer(other._chunks[key], dtype=np.uint8)
+            if chunk.any():
+                fog._chunks[key] = bytearray(chunk.tobytes())
+        return fog
+
+    @classmethod
+    def union(cls, fogs: Iterable['FogOfWar']) -> 'FogOfWar':
+        """ Tiles revealed by any of the fogs, e.g. what a whole team has seen """
+        fogs = list(fogs)
+        fog = fogs[0].copy()
+        for other in fogs[1:]:
+            fog |= other
+        return fog
+
+    @classmethod
+    def intersection(cls, fogs: Iterable['FogOfWar']) -> 'FogOfWar':
+        """ Tiles revealed by all of the fogs """
+        fogs = list(fogs)
+        fog = fogs[0].copy()
+        for other in fogs[1:]:
+            fog = fog & other
+        return fog
+
+
+class _Column:
+    """ Helper so `fog[x][y]` keeps working """
+
+    def __init__(self, fog: FogOfWar, x: int):
+        self._fog = fog
+        self._x = x
+
+    def __getitem__(self, y):
+        if isinstance(y, (int, np.integer)):
+            return self._fog.is_revealed(self._x, self._fog._wrap(self._x, y)[1])
+        return self._fog.to_array()[self._x][y]
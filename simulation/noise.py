@@ -0,0 +1,78 @@
+from typing import Tuple
+import numpy as np
+
+
+class NoiseBuffer:
+    """
+    The noise events of the last `lifetime` ticks, kept in a ring buffer of columns (x, y, radius, time, source),
+    so memory use stays the same however long the simulation runs.
+    Events are numbered in the order they were added, `total` is the number of the next one,
+    and once there are more than `capacity` events that haven't expired yet the oldest ones are dropped.
+    """
+
+    def __init__(self, lifetime: int, capacity: int = 1024):
+        self.lifetime = lifetime
+        self.capacity = capacity
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.radius = np.zeros(capacity)
+        self.time = np.zeros(capacity, dtype=np.int64)
+        # ID of the agent that made the noise, 0 if it didn't come from an agent
+        self.source = np.zeros(capacity, dtype=np.int64)
+
+        # numbers of the oldest event that's still in here and of the next one to be added
+        self.first = 0
+        self.total = 0
+
+    def __len__(self):
+        return self.total - self.first
+
+    def clear(self):
+        self.first = self.total
+
+    def add(self, x: float, y: float, radius: float, time: int, source: int = 0):
+        i = self.total % self.capacity
+        self.x[i], self.y[i], self.radius[i], self.time[i], self.source[i] = x, y, radius, time, source
+        self.total += 1
+        # full, so the oldest one has just been overwritten
+        self.first = max(self.first, self.total - self.capacity)
+
+    def extend(self, x: np.ndarray, y: np.ndarray, radius: np.ndarray, time: int, source: np.ndarray):
+        """ Adds a whole batch of events made at the same `time` at once """
+        n = len(x)
+        # when there's more than fits, only the last ones would survive anyway
+        skip = max(n - self.capacity, 0)
+        rows = np.arange(self.total + skip, self.total + n) % self.capacity
+        self.x[rows] = np.asarray(x)[skip:]
+        self.y[rows] = np.asarray(y)[skip:]
+        self.radius[rows] = np.asarray(radius)[skip:]
+        self.time[rows] = time
+        self.source[rows] = np.asarray(source)[skip:]
+        self.total += n
+        self.first = max(self.first, self.total - self.capacity)
+
+    def expire(self, time: int):
+        """ Drops all events that are at least `lifetime` ticks old at `time` """
+        # events are added in order of time, so the old ones are all at the front
+        rows = self.rows(self.first)
+        self.first += int(np.count_nonzero(self.time[rows] <= time - self.lifetime))
+
+    def rows(self, since: int = 0) -> np.ndarray:
+        """ The rows of all events numbered `since` and up that are still in here, oldest first """
+        return np.arange(max(since, self.first), self.total) % self.capacity
+
+    def perceive(self, x: np.ndarray, y: np.ndarray, IDs: np.ndarray, since: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Works out which of the agents at (x, y) hear which of the events numbered `since` and up,
+        an agent hears an event when it's within the event's radius and it didn't make the noise itself
+        return: For every time an agent hears an event, the index of the agent and the row of the event
+        """
+        rows = self.rows(since)
+        if not len(rows) or not len(x):
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        dx = self.x[rows][None, :] - np.asarray(x)[:, None]
+        dy = self.y[rows][None, :] - np.asarray(y)[:, None]
+        heard = (dx**2 + dy**2 < self.radius[rows][None, :]**2) & \
+                (self.source[rows][None, :] != np.asarray(IDs)[:, None])
+        agents, events = np.nonzero(heard)
+        return agents, rows[events]
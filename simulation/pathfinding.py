@@ -1,7 +1,14 @@
 # based on code taken from: https://www.redblobgames.com/pathfinding/a-star/implementation.html
 
 from abc import ABCMeta, abstractmethod
+from enum import Enum
+import collections.abc
 import heapq
+import math
+import time
+from typing import Dict, List, Optional, Tuple, Iterable
+import numpy as np
+import vectormath as vmath
 
 
 class Graph(metaclass=ABCMeta):
@@ -96,3 +103,1002 @@ def a_star_search(graph, start, goal, heuristic):
                 came_from[next] = current
 
     return came_from, cost_so_far
+
+
+class Path(collections.abc.Sequence):
+    """
+    A path as a compact (n, 2) array of points,
+    they're only turned into `vmath.Vector2`s when they're accessed so it can be used just like a list of them
+    """
+
+    def __init__(self, points: np.ndarray):
+        self.points = points
+
+    @property
+    def tiles(self) -> np.ndarray:
+        """ The tiles the path goes through, as an (n, 2) array """
+        return np.floor(self.points).astype(int)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return Path(self.points[item])
+        x, y = self.points[item]
+        return vmath.Vector2(x, y)
+
+    def __eq__(self, other):
+        if isinstance(other, Path):
+            return np.array_equal(self.points, other.points)
+        if isinstance(other, collections.abc.Sequence):
+            return len(self) == len(other) and all(np.array_equal(a, b) for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f'Path({self.points.tolist()})'
+
+
+class GridAStar:
+    """
+    A* specialised for a grid of `width` by `height` tiles, with 8-way movement.
+    Tiles are flat indices (`x * height + y`) and the search state lives in preallocated arrays that are reused
+    between searches, a generation counter tells which entries belong to the current search.
+    Finds exactly the same paths as `a_star_search` with `MapView` as the graph.
+    """
+
+    # the moves in the order `MapView.neighbors` tries them: right, down, left, up, then the corners
+    MOVES = [(1, 0), (0, -1), (-1, 0), (0, 1), (-1, 1), (1, 1), (-1, -1), (1, -1)]
+
+    def __init__(self, width: int, height: int):
+        self.width, self.height = width, height
+        n = width * height
+
+        self._g = np.zeros(n)
+        self._parent = np.zeros(n, dtype=np.int64)
+        self._seen = np.zeros(n, dtype=np.int64)
+        # the g-score a tile was last expanded with
+        self._expanded_g = np.zeros(n)
+        self._expanded = np.zeros(n, dtype=np.int64)
+        self.generation = 0
+
+        # for every bit mask of allowed moves: the list of (index offset, cost) to try
+        self._steps = self.steps(height)
+
+    @classmethod
+    def steps(cls, height: int) -> List[List[Tuple[int, float]]]:
+        """ For every bit mask of allowed moves: the list of (index offset, cost) of those moves, in order """
+        table = []
+        for mask in range(256):
+            steps = []
+            for bit, (dx, dy) in enumerate(cls.MOVES):
+                if mask & (1 << bit):
+                    # same cost as `MapView.cost`
+                    steps.append((dx * height + dy, 1 * (2**0.5 if (dx + dy) % 2 == 0 else 1)))
+            table.append(steps)
+        return table
+
+    @classmethod
+    def moves(cls, passable: np.ndarray) -> np.ndarray:
+        """
+        Works out which moves are allowed from every tile, as a bit mask per tile (bit `i` is `MOVES[i]`),
+        moving diagonally is only allowed if both tiles next to the diagonal are passable too
+        """
+        padded = np.pad(passable, 1, mode='constant', constant_values=False)
+        width, height = passable.shape
+
+        def at(dx, dy):
+            return padded[1 + dx:1 + dx + width, 1 + dy:1 + dy + height]
+
+        right, down, left, up = at(1, 0), at(0, -1), at(-1, 0), at(0, 1)
+        allowed = [right, down, left, up,
+                   up & left & at(-1, 1), up & right & at(1, 1), down & left & at(-1, -1), down & right & at(1, -1)]
+
+        moves = np.zeros(passable.shape, dtype=np.uint8)
+        for bit, mask in enumerate(allowed):
+            moves |= mask.astype(np.uint8) << bit
+        return moves
+
+    def search(self, moves: np.ndarray, start: int, goal: int,
+               costs: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """
+        Finds a path from tile `start` to tile `goal`, `moves` are the allowed moves as returned by `moves`
+        `costs`: optional cost of every tile (see `CostLayers`), moving onto a tile costs the move times its cost
+        return: The flat indices of the tiles along the path, or `None` if there is none
+        """
+        self.generation += 1
+        generation = self.generation
+
+        # memoryviews are a lot faster than numpy arrays when reading single values
+        g, parent, seen = memoryview(self._g), memoryview(self._parent), memoryview(self._seen)
+        expanded_g, expanded = memoryview(self._expanded_g), memoryview(self._expanded)
+        allowed = memoryview(moves.reshape(-1))
+        steps = self._steps
+        height = self.height
+        goal_x, goal_y = divmod(goal, height)
+        # same as the heuristic of `MapView.find_path`
+        diagonal = 2**0.5 - 2 * 1
+        # with costs the heuristic is scaled by the cheapest tile, so it never overestimates
+        weights = None if costs is None else memoryview(np.ascontiguousarray(costs, dtype=float).reshape(-1))
+        scale = 1 if costs is None else float(costs.min())
+
+        g[start] = 0
+        parent[start] = -1
+        seen[start] = generation
+        frontier = [(0, 0, start)]
+        while frontier:
+            current = heapq.heappop(frontier)[2]
+            if current == goal:
+                break
+
+            # a tile only has to be expanded again if it was reached with a lower cost since the last time
+            cost = g[current]
+            if expanded[current] == generation and expanded_g[current] == cost:
+                continue
+            expanded[current] = generation
+            expanded_g[current] = cost
+
+            for step, step_cost in steps[allowed[current]]:
+                next = current + step
+                new_cost = cost + (step_cost if weights is None else step_cost * weights[next])
+                if seen[next] != generation or new_cost < g[next]:
+                    seen[next] = generation
+                    g[next] = new_cost
+                    parent[next] = current
+                    x, y = divmod(next, height)
+                    dx = abs(goal_x - x)
+                    dy = abs(goal_y - y)
+                    h = scale * ((dx + dy) + diagonal * (dx if dx < dy else dy))
+                    heapq.heappush(frontier, (new_cost + h, h, next))
+        else:
+            # ran out of tiles without reaching the goal
+            return None
+
+        # walk back from the goal
+        path = [goal]
+        while path[-1] != start:
+            path.append(parent[path[-1]])
+        path.reverse()
+        return np.array(path, dtype=np.int64)
+
+
+class DStarLite:
+    """
+    Incremental planner towards a fixed `goal` on a grid (D* Lite), it searches backwards from the goal
+    so the start is free to move between searches.
+    When tiles become impassable only the part of the search tree that depends on them is repaired,
+    instead of searching all over again.
+    Uses the same tiles, moves and costs as `GridAStar`, the paths are just as short but can take a different
+    route when there are several equally short ones.
+    """
+
+    def __init__(self, width: int, height: int, goal: int):
+        self.width, self.height = width, height
+        self.goal = goal
+
+        n = width * height
+        self.g = np.full(n, np.inf)
+        self.rhs = np.full(n, np.inf)
+        self.rhs[goal] = 0
+
+        # tiles that are in the queue, with their key
+        self._queue = []
+        self._keys = {}
+        # offset for the keys so they don't have to be recomputed when the start moves
+        self._km = 0.0
+        self._last_start: Optional[int] = None
+        # tiles whose outgoing moves have changed since the last search
+        self._changed = set()
+
+        self._steps = GridAStar.steps(height)
+        self._moves = [(bit, dx, dy, dx * height + dy, 1 * (2**0.5 if (dx + dy) % 2 == 0 else 1))
+                       for bit, (dx, dy) in enumerate(GridAStar.MOVES)]
+
+    def _heuristic(self, a: int, b: int) -> float:
+        ax, ay = divmod(a, self.height)
+        bx, by = divmod(b, self.height)
+        dx, dy = abs(ax - bx), abs(ay - by)
+        return (dx + dy) + (2**0.5 - 2) * (dx if dx < dy else dy)
+
+    def tiles_changed(self, tiles: Iterable[int]):
+        """ Lets the planner know that the moves out of `tiles` have changed """
+        self._changed.update(tiles)
+
+    def _search(self, start: int, moves):
+        """ Repairs the changed tiles and then (re)computes the costs until the one of the start is known """
+        # memoryviews and local variables, this is the hot loop
+        g, rhs = memoryview(self.g), memoryview(self.rhs)
+        queue, keys = self._queue, self._keys
+        steps, height, width, goal, km = self._steps, self.height, self.width, self.goal, self._km
+        directions = self._moves
+        start_x, start_y = divmod(start, height)
+        diagonal = 2**0.5 - 2
+        inf = np.inf
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        def key(tile):
+            m = g[tile] if g[tile] < rhs[tile] else rhs[tile]
+            x, y = divmod(tile, height)
+            dx, dy = abs(start_x - x), abs(start_y - y)
+            return m + ((dx + dy) + diagonal * (dx if dx < dy else dy)) + km, m
+
+        def update(tile):
+            if tile != goal:
+                best = inf
+                for step, cost in steps[moves[tile]]:
+                    if cost + g[tile + step] < best:
+                        best = cost + g[tile + step]
+                rhs[tile] = best
+            keys.pop(tile, None)
+            if g[tile] != rhs[tile]:
+                k = key(tile)
+                keys[tile] = k
+                heappush(queue, (k, tile))
+
+        def update_predecessors(tile):
+            # every tile from which `tile` can be reached in one move
+            x, y = divmod(tile, height)
+            for bit, dx, dy, step, cost in directions:
+                if 0 <= x - dx < width and 0 <= y - dy < height and moves[tile - step] & (1 << bit):
+                    update(tile - step)
+
+        for tile in self._changed:
+            update(tile)
+        self._changed = set()
+
+        while queue:
+            k, tile = queue[0]
+            if keys.get(tile) != k:
+                # outdated entry
+                heappop(queue)
+                continue
+            # g is summed move by move while the keys add the heuristic in one go, so keys that should be equal
+            # can be a rounding error apart, keep going for those too or their g might never get repaired
+            if not (k[0] < key(start)[0] + 1e-9 or rhs[start] != g[start]):
+                break
+
+            heappop(queue)
+            del keys[tile]
+            new_key = key(tile)
+            if k < new_key:
+                keys[tile] = new_key
+                heappush(queue, (new_key, tile))
+            elif g[tile] > rhs[tile]:
+                g[tile] = rhs[tile]
+                update_predecessors(tile)
+            else:
+                g[tile] = inf
+                update(tile)
+                update_predecessors(tile)
+
+    def path(self, moves: np.ndarray, start: int) -> Optional[np.ndarray]:
+        """
+        Finds a path from tile `start` to the goal, `moves` are the allowed moves as returned by `GridAStar.moves`
+        return: The flat indices of the tiles along the path, or `None` if there is none
+        """
+        moves = memoryview(moves.reshape(-1))
+        if self._last_start is None:
+            key = (self._heuristic(start, self.goal), 0.0)
+            self._keys[self.goal] = key
+            heapq.heappush(self._queue, (key, self.goal))
+        else:
+            self._km += self._heuristic(self._last_start, start)
+        self._last_start = start
+
+        # repair whatever changed, and search as far as needed
+        self._search(start, moves)
+
+        if self.g[start] == np.inf:
+            return None
+
+        # follow the cheapest moves down to the goal
+        path = [start]
+        g = memoryview(self.g)
+        while path[-1] != self.goal:
+            tile = path[-1]
+            best: Optional[int] = None
+            best_cost = np.inf
+            for step, cost in self._steps[moves[tile]]:
+                if cost + g[tile + step] < best_cost:
+                    best, best_cost = tile + step, cost + g[tile + step]
+            if best is None or len(path) > len(g):
+                return None
+            path.append(best)
+        return np.array(path, dtype=np.int64)
+
+
+class SearchBackend(Enum):
+    """ The different ways `MapView.find_path` can search for a path """
+    ASTAR = 1
+    JUMP_POINT = 2
+    HIERARCHICAL = 3
+    FLOW_FIELD = 4
+
+
+class JumpPointSearch:
+    """
+    Jump point search on the same grid as `GridAStar`: 8-way movement with uniform costs, where a diagonal move
+    is only allowed if both tiles next to it are passable too (so no cutting corners).
+    Instead of adding every neighbour to the open list it jumps along straight and diagonal lines until it finds
+    a tile where the path could turn, which skips all the symmetric paths A* would look at.
+    The paths are just as short as the ones from A*, but can take a different route when there are several.
+    """
+
+    def __init__(self, passable: np.ndarray):
+        self.width, self.height = passable.shape
+        # padded with impassable tiles so there's no need for bounds checks,
+        # tiles are numbered `(x + 1) * stride + (y + 1)`
+        self._stride = self.height + 2
+        self._passable = np.pad(passable, 1, mode='constant', constant_values=False).reshape(-1).tolist()
+
+    def tiles_changed(self, tiles: Iterable[Tuple[int, int]], passable: bool = False):
+        """ Lets the search know tiles (x, y) became impassable (or passable), so it doesn't have to be made again """
+        for x, y in tiles:
+            self._passable[(x + 1) * self._stride + y + 1] = passable
+
+    def _jump(self, i: int, dx: int, dy: int, goal: int) -> int:
+        """ Moves from tile `i` in direction (dx, dy) until it finds a jump point, returns -1 if there isn't one """
+        passable, stride = self._passable, self._stride
+        if dx == 0:
+            return self._jump_straight(i, dy, stride, goal)
+        if dy == 0:
+            return self._jump_straight(i, dx * stride, 1, goal)
+
+        step, x_step = dx * stride + dy, dx * stride
+        while True:
+            i += step
+            if not passable[i]:
+                return -1
+            if i == goal:
+                return i
+            # a jump point if there's one straight ahead in either direction
+            if self._jump_straight(i, x_step, 1, goal) >= 0 or self._jump_straight(i, dy, stride, goal) >= 0:
+                return i
+            # and we can only keep going if we're not cutting a corner
+            if not (passable[i + x_step] and passable[i + dy]):
+                return -1
+
+    def _jump_straight(self, i: int, step: int, side: int, goal: int) -> int:
+        passable = self._passable
+        while True:
+            i += step
+            if not passable[i]:
+                return -1
+            if i == goal:
+                return i
+            # a side opened up that couldn't be reached (diagonally) before
+            if (passable[i + side] and not passable[i - step + side]) or \
+                    (passable[i - side] and not passable[i - step - side]):
+                return i
+
+    def _directions(self, i: int, parent: int) -> List[Tuple[int, int]]:
+        """ The directions worth looking in from tile `i`, when we came from tile `parent` """
+        passable, stride = self._passable, self._stride
+
+        def free(dx, dy):
+            return passable[i + dx * stride + dy]
+
+        if parent < 0:
+            return [(dx, dy) for dx, dy in GridAStar.MOVES
+                    if free(dx, dy) and (dx == 0 or dy == 0 or (free(dx, 0) and free(0, dy)))]
+
+        (x, y), (px, py) = divmod(i, stride), divmod(parent, stride)
+        dx, dy = (x > px) - (x < px), (y > py) - (y < py)
+        directions = []
+        if dx != 0 and dy != 0:
+            # diagonal: keep going, or turn to one of the two straight directions
+            if free(0, dy):
+                directions.append((0, dy))
+            if free(dx, 0):
+                directions.append((dx, 0))
+            if free(0, dy) and free(dx, 0) and free(dx, dy):
+                directions.append((dx, dy))
+        else:
+            # straight: keep going, plus the sides which might have opened up
+            sx, sy = dy, dx
+            if free(dx, dy):
+                directions.append((dx, dy))
+                if free(sx, sy) and free(dx + sx, dy + sy):
+                    directions.append((dx + sx, dy + sy))
+                if free(-sx, -sy) and free(dx - sx, dy - sy):
+                    directions.append((dx - sx, dy - sy))
+            if free(sx, sy):
+                directions.append((sx, sy))
+            if free(-sx, -sy):
+                directions.append((-sx, -sy))
+        return directions
+
+    def search(self, start: Tuple[int, int], goal: Tuple[int, int]) -> Optional[List[Tuple[int, int]]]:
+        """
+        Finds a path from tile `start` to tile `goal`
+        return: Every tile along the path (not just the jump points), or `None` if there is none
+        """
+        stride = self._stride
+        start_i = (start[0] + 1) * stride + start[1] + 1
+        goal_i = (goal[0] + 1) * stride + goal[1] + 1
+        gx, gy = goal[0] + 1, goal[1] + 1
+
+        def octile(dx, dy):
+            dx, dy = abs(dx), abs(dy)
+            return (dx + dy) + (2**0.5 - 2) * (dx if dx < dy else dy)
+
+        g = {start_i: 0}
+        came_from = {start_i: -1}
+        closed = set()
+        frontier = [(0, 0, start_i)]
+        while frontier:
+            current = heapq.heappop(frontier)[2]
+            if current in closed:
+                continue
+            closed.add(current)
+            if current == goal_i:
+                break
+
+            x, y = divmod(current, stride)
+            for dx, dy in self._directions(current, came_from[current]):
+                jump_point = self._jump(current, dx, dy, goal_i)
+                if jump_point < 0 or jump_point in closed:
+                    continue
+                jx, jy = divmod(jump_point, stride)
+                new_cost = g[current] + octile(jx - x, jy - y)
+                if jump_point not in g or new_cost < g[jump_point]:
+                    g[jump_point] = new_cost
+                    came_from[jump_point] = current
+                    h = octile(gx - jx, gy - jy)
+                    heapq.heappush(frontier, (new_cost + h, h, jump_point))
+        else:
+            return None
+
+        # walk back through the jump points, filling in the tiles in between
+        path = [goal]
+        current = goal_i
+        while current != start_i:
+            x, y = path[-1]
+            px, py = divmod(came_from[current], stride)
+            px, py = px - 1, py - 1
+            dx, dy = (px > x) - (px < x), (py > y) - (py < y)
+            while (x, y) != (px, py):
+                x, y = x + dx, y + dy
+                path.append((x, y))
+            current = came_from[current]
+        path.reverse()
+        return path
+
+
+
+class HPAStar:
+    """
+    Hierarchical path finding (HPA*) on the same grid as `GridAStar`.
+    The map is split up in square clusters, and wherever two clusters share a stretch of passable tiles on their
+    border there's an entrance. The search first finds a path between entrances, using the distances between the
+    entrances of each cluster, and then fills in the tiles, so it only ever has to look at the clusters the path
+    goes through.
+    The distances within a cluster are only worked out when a search needs them, and are thrown away again
+    when tiles in or right next to the cluster change (see `tiles_changed`).
+    When the start and goal are in the same cluster or in clusters right next to each other (diagonals included),
+    the abstract path is the biggest part of the path and can be far off, so those are searched for exactly instead.
+    Further apart the paths aren't always as short as the ones from A*: every crossing between two clusters is
+    forced through an entrance, and the detours that causes add up to at most about one cluster's width per path
+    (8.6 tiles with the default cluster size on the 51x51 maps). So it's the shortest of these paths that are off
+    the most, at worst about 1.65 times as long as they could be, but on average they're only 4% longer.
+    """
+
+    # stretches of border at least this long get an entrance at both ends instead of one in the middle
+    LONG_ENTRANCE = 6
+
+    def __init__(self, passable: np.ndarray, moves: np.ndarray, cluster_size: int = 10):
+        """
+        `passable` and `moves` are the grid as used by `GridAStar`, they're not copied,
+        so any changes to them have to be passed on with `tiles_changed`
+        """
+        self.width, self.height = passable.shape
+        self.cluster_size = cluster_size
+        self.clusters = (-(-self.width // cluster_size), -(-self.height // cluster_size))
+        self._passable = passable
+        self._moves = moves
+
+        # (cluster, neighbouring cluster) -> the (tile, tile) pairs where a path crosses the border between them,
+        # the clusters are (x, y) and always in sorted order
+        self._entrances: Dict[Tuple[Tuple[int, int], Tuple[int, int]], List[Tuple[int, int]]] = {}
+        # cluster -> the entrance tiles on its side of the borders
+        self._nodes: Dict[Tuple[int, int], set] = {}
+        # entrance tile -> the entrance tiles in the neighbouring clusters it crosses over to
+        self._links: Dict[int, set] = {}
+        # cluster -> entrance tile -> (list of (other entrance, cost), `came_from` of the search from it)
+        self._edges: Dict[Tuple[int, int], Dict[int, Tuple[List[Tuple[int, float]], List[int]]]] = {}
+        # entrance tile -> (tile, cost) of everything that can be reached from it directly,
+        # only there for the clusters in `_edges`
+        self._adjacency: Dict[int, List[Tuple[int, float]]] = {}
+        # for the searches between nearby tiles (made when it's first needed)
+        self._exact: Optional[GridAStar] = None
+        # cluster -> its moves (see `_cluster_grid`)
+        self._grids: Dict[Tuple[int, int], Tuple] = {}
+        self._step_tables: Dict[int, List[List[Tuple[int, float]]]] = {}
+        # clusters whose entrances and distances have to be worked out again
+        self._dirty = {(cx, cy) for cx in range(self.clusters[0]) for cy in range(self.clusters[1])}
+
+    def _cluster(self, tile: int) -> Tuple[int, int]:
+        x, y = divmod(tile, self.height)
+        return x // self.cluster_size, y // self.cluster_size
+
+    def _bounds(self, cluster: Tuple[int, int]) -> Tuple[int, int, int, int]:
+        """ The tiles in the cluster, as x0, x1, y0, y1 (exclusive) """
+        size = self.cluster_size
+        return (cluster[0] * size, min((cluster[0] + 1) * size, self.width),
+                cluster[1] * size, min((cluster[1] + 1) * size, self.height))
+
+    def tiles_changed(self, tiles: Iterable[Tuple[int, int]]):
+        """ Lets the search know tiles (x, y) changed passability, only the clusters around them are redone """
+        size = self.cluster_size
+        for x, y in tiles:
+            # the moves from the tiles around it change as well
+            for cx in {max(x - 1, 0) // size, x // size, min(x + 1, self.width - 1) // size}:
+                for cy in {max(y - 1, 0) // size, y // size, min(y + 1, self.height - 1) // size}:
+                    self._dirty.add((cx, cy))
+
+    def _find_entrances(self, a: Tuple[int, int], b: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """ The (tile in `a`, tile in `b`) pairs where a path can cross from cluster `a` to the next cluster `b` """
+        x0, x1, y0, y1 = self._bounds(a)
+        height = self.height
+        if b[0] > a[0]:
+            # `b` is to the right
+            pairs = [((x1 - 1) * height + y, x1 * height + y) for y in range(y0, y1)]
+        else:
+            # `b` is above
+            pairs = [(x * height + y1 - 1, x * height + y1) for x in range(x0, x1)]
+
+        passable = self._passable.reshape(-1)
+        entrances = []
+        run = []
+        for pair in pairs + [None]:
+            if pair is not None and passable[pair[0]] and passable[pair[1]]:
+                run.append(pair)
+                continue
+            # end of a stretch of open border
+            if len(run) >= self.LONG_ENTRANCE:
+                entrances += [run[0], run[-1]]
+            elif run:
+                entrances.append(run[len(run) // 2])
+            run = []
+        return entrances
+
+    def _refresh(self):
+        """ Works out the entrances around the dirty clusters again """
+        if not self._dirty:
+            return
+
+        changed = set(self._dirty)
+        for a in self._dirty:
+            for b in [(a[0] - 1, a[1]), (a[0], a[1] - 1), (a[0] + 1, a[1]), (a[0], a[1] + 1)]:
+                if not (0 <= b[0] < self.clusters[0] and 0 <= b[1] < self.clusters[1]):
+                    continue
+                key = (a, b) if a < b else (b, a)
+                entrances = self._find_entrances(*key)
+                if self._entrances.get(key) != entrances:
+                    self._entrances[key] = entrances
+                    changed.update(key)
+        self._dirty = set()
+
+        # redo the entrances and links of every cluster with a border that changed
+        for cluster in changed:
+            for tile in self._nodes.pop(cluster, ()):
+                self._links.pop(tile, None)
+                self._adjacency.pop(tile, None)
+            self._edges.pop(cluster, None)
+            self._grids.pop(cluster, None)
+        for cluster in changed:
+            nodes = self._nodes[cluster] = set()
+            cx, cy = cluster
+            for key in [((cx - 1, cy), cluster), ((cx, cy - 1), cluster), (cluster, (cx + 1, cy)),
+                        (cluster, (cx, cy + 1))]:
+                mine = 0 if key[0] == cluster else 1
+                for pair in self._entrances.get(key, ()):
+                    nodes.add(pair[mine])
+                    self._links.setdefault(pair[mine], set()).add(pair[1 - mine])
+
+    def _cluster_grid(self, cluster: Tuple[int, int]) -> Tuple:
+        """
+        The moves within a cluster, leaving out the ones that go outside of it,
+        tiles in the cluster are numbered like the full grid, but starting from its corner
+        return: x0, y0, height of the cluster, moves per tile, the (index offset, cost) table for the moves
+        """
+        grid = self._grids.get(cluster)
+        if grid is None:
+            x0, x1, y0, y1 = self._bounds(cluster)
+            keep = np.full((x1 - x0, y1 - y0), 255, dtype=np.uint8)
+            for bit, (dx, dy) in enumerate(GridAStar.MOVES):
+                if dx:
+                    keep[-1 if dx > 0 else 0, :] &= ~np.uint8(1 << bit)
+                if dy:
+                    keep[:, -1 if dy > 0 else 0] &= ~np.uint8(1 << bit)
+            moves = (self._moves[x0:x1, y0:y1] & keep).reshape(-1).tolist()
+            height = y1 - y0
+            if height not in self._step_tables:
+                self._step_tables[height] = GridAStar.steps(height)
+            grid = self._grids[cluster] = (x0, y0, height, moves, self._step_tables[height])
+        return grid
+
+    def _search_cluster(self, cluster: Tuple[int, int], start: int) -> Tuple[List[float], List[int]]:
+        """
+        Dijkstra from tile `start` (numbered within the cluster) to every tile of the cluster, without leaving it
+        return: The cost to get to each tile, and the tile each one was reached from
+        """
+        _, _, _, moves, steps = self._cluster_grid(cluster)
+        cost_so_far = [math.inf] * len(moves)
+        came_from = [-1] * len(moves)
+        cost_so_far[start] = 0
+        frontier = [(0, start)]
+        while frontier:
+            cost, current = heapq.heappop(frontier)
+            if cost > cost_so_far[current]:
+                continue
+            for step, step_cost in steps[moves[current]]:
+                next = current + step
+                new_cost = cost + step_cost
+                if new_cost < cost_so_far[next]:
+                    cost_so_far[next] = new_cost
+                    came_from[next] = current
+                    heapq.heappush(frontier, (new_cost, next))
+        return cost_so_far, came_from
+
+    def _local(self, cluster: Tuple[int, int], tile: int) -> int:
+        """ Tile number within the cluster """
+        x0, y0, height = self._cluster_grid(cluster)[:3]
+        x, y = divmod(tile, self.height)
+        return (x - x0) * height + (y - y0)
+
+    def _cluster_edges(self, cluster: Tuple[int, int]) -> Dict[int, Tuple[List[Tuple[int, float]], List[int]]]:
+        """ The costs between the entrances of a cluster, worked out the first time they're needed """
+        edges = self._edges.get(cluster)
+        if edges is None:
+            edges = self._edges[cluster] = {}
+            nodes = [(tile, self._local(cluster, tile)) for tile in self._nodes[cluster]]
+            for tile, local in nodes:
+                cost_so_far, came_from = self._search_cluster(cluster, local)
+                costs = [(other, cost_so_far[other_local]) for other, other_local in nodes
+                         if other != tile and cost_so_far[other_local] < math.inf]
+                edges[tile] = (costs, came_from)
+                self._adjacency[tile] = costs + [(other, 1) for other in self._links.get(tile, ())]
+        return edges
+
+    def _fill_in(self, cluster: Tuple[int, int], came_from: List[int], tile: int) -> List[int]:
+        """ The tiles from the start of a search in the cluster to `tile`, using the `came_from` of the search """
+        x0, y0, height = self._cluster_grid(cluster)[:3]
+        tiles = []
+        local = self._local(cluster, tile)
+        while local >= 0:
+            x, y = divmod(local, height)
+            tiles.append((x0 + x) * self.height + y0 + y)
+            local = came_from[local]
+        tiles.reverse()
+        return tiles
+
+    def search(self, start: int, goal: int) -> Optional[List[int]]:
+        """
+        Finds a path from tile `start` to tile `goal` (flat indices, like `GridAStar.search`)
+        return: The tiles along the path, or `None` if there is none
+        """
+        start_cluster, goal_cluster = self._cluster(start), self._cluster(goal)
+        if abs(start_cluster[0] - goal_cluster[0]) <= 1 and abs(start_cluster[1] - goal_cluster[1]) <= 1:
+            # close enough for A* to be cheap, and the entrances would be most of the detour
+            if self._exact is None:
+                self._exact = GridAStar(self.width, self.height)
+            exact = self._exact.search(self._moves, start, goal)
+            return None if exact is None else exact.tolist()
+
+        self._refresh()
+        height = self.height
+        goal_x, goal_y = divmod(goal, height)
+        diagonal = 2**0.5 - 2 * 1
+
+        # hook the start and goal up to the entrances of their clusters
+        start_search = self._search_cluster(start_cluster, self._local(start_cluster, start))
+        start_edges = [(tile, start_search[0][self._local(start_cluster, tile)]) for tile in self._nodes[start_cluster]]
+        start_edges = [(tile, cost) for tile, cost in start_edges if cost < math.inf]
+        start_edges += [(other, 1) for other in self._links.get(start, ())]
+        # moves go both ways, so searching from the goal gives the cost to get to it as well
+        goal_search = self._search_cluster(goal_cluster, self._local(goal_cluster, goal))
+        to_goal = {tile: goal_search[0][self._local(goal_cluster, tile)] for tile in self._nodes[goal_cluster]}
+        to_goal = {tile: cost for tile, cost in to_goal.items() if cost < math.inf}
+
+        g: Dict[int, float] = {start: 0}
+        came_from = {start: -1}
+        closed = set()
+        frontier = [(0.0, 0.0, start)]
+        adjacency = self._adjacency
+        while frontier:
+            current = heapq.heappop(frontier)[2]
+            if current in closed:
+                continue
+            closed.add(current)
+            if current == goal:
+                break
+
+            if current == start:
+                neighbours = start_edges
+            else:
+                if current not in adjacency:
+                    self._cluster_edges(self._cluster(current))
+                neighbours = adjacency[current]
+            if current in to_goal:
+                neighbours = neighbours + [(goal, to_goal[current])]
+
+            cost_here = g[current]
+            for next, cost in neighbours:
+                new_cost = cost_here + cost
+                if next not in g or new_cost < g[next]:
+                    g[next] = new_cost
+                    came_from[next] = current
+                    x, y = divmod(next, height)
+                    dx = abs(goal_x - x)
+                    dy = abs(goal_y - y)
+                    h = (dx + dy) + diagonal * (dx if dx < dy else dy)
+                    heapq.heappush(frontier, (new_cost + h, h, next))
+        else:
+            return None
+
+        # walk back along the entrances
+        abstract = [goal]
+        while abstract[-1] != start:
+            abstract.append(came_from[abstract[-1]])
+        abstract.reverse()
+
+        # and fill in the tiles in between
+        path = [start]
+        for a, b in zip(abstract, abstract[1:]):
+            cluster = self._cluster(a)
+            if cluster != self._cluster(b):
+                # crossing over to the next cluster
+                path.append(b)
+            elif a == start:
+                path += self._fill_in(cluster, start_search[1], b)[1:]
+            elif b == goal:
+                # the search went from the goal, so this goes backwards
+                path += self._fill_in(cluster, goal_search[1], a)[-2::-1]
+            else:
+                path += self._fill_in(cluster, self._cluster_edges(cluster)[a][1], b)[1:]
+        return path
+
+
+class FlowField:
+    """
+    The distance from every tile to one goal tile, and which tile to go to next to get there,
+    on the same grid as `GridAStar`. Takes one search over the whole grid to make,
+    but after that any number of agents can look up the way to the goal from anywhere.
+    """
+
+    def __init__(self, moves: np.ndarray, goal: int):
+        """ `moves` are the allowed moves as returned by `GridAStar.moves`, `goal` is a flat index """
+        self.width, self.height = moves.shape
+        self.goal = goal
+        n = self.width * self.height
+        self.distance = np.full(n, math.inf)
+        # the next tile on the way to the goal, -1 if the goal can't be reached
+        self.next = np.full(n, -1, dtype=np.int64)
+
+        distance, next_tile = memoryview(self.distance), memoryview(self.next)
+        allowed = memoryview(moves.reshape(-1))
+        steps = GridAStar.steps(self.height)
+
+        # moves between passable tiles go both ways, so a search from the goal gives the way to it from everywhere
+        distance[goal] = 0
+        next_tile[goal] = goal
+        frontier = [(0, goal)]
+        while frontier:
+            cost, current = heapq.heappop(frontier)
+            if cost > distance[current]:
+                continue
+            for step, step_cost in steps[allowed[current]]:
+                tile = current + step
+                new_cost = cost + step_cost
+                if new_cost < distance[tile]:
+                    distance[tile] = new_cost
+                    next_tile[tile] = current
+                    heapq.heappush(frontier, (new_cost, tile))
+
+        # nothing can move onto an impassable tile, but an agent standing on one can still move off it
+        stuck = np.flatnonzero((self.distance == math.inf) & (moves.reshape(-1) != 0))
+        if len(stuck):
+            best = np.full(len(stuck), math.inf)
+            allowed = moves.reshape(-1)[stuck]
+            for bit, (dx, dy) in enumerate(GridAStar.MOVES):
+                can = (allowed & (1 << bit)) != 0
+                tiles = stuck[can] + dx * self.height + dy
+                cost = self.distance[tiles] + (2**0.5 if dx and dy else 1)
+                better = cost < best[can]
+                best[np.flatnonzero(can)[better]] = cost[better]
+                self.next[stuck[can][better]] = tiles[better]
+            self.distance[stuck] = best
+
+    def path(self, start: int) -> Optional[np.ndarray]:
+        """ The flat indices of the tiles from `start` to the goal, or `None` if the goal can't be reached """
+        if self.next[start] < 0:
+            return None
+        next_tile = self.next
+        path = [start]
+        while path[-1] != self.goal:
+            path.append(int(next_tile[path[-1]]))
+        return np.array(path, dtype=np.int64)
+
+
+class AnytimeAStar:
+    """
+    A* on the same grid as `GridAStar`, but it can be stopped after a number of expansions or amount of time
+    and picked up again later, so a hard search can be spread out over multiple ticks.
+    Until it's done, the best it has is the path to the tile closest to the goal that it's seen so far.
+    """
+
+    def __init__(self, moves: np.ndarray, start: int, goal: int):
+        """ `moves` are the allowed moves as returned by `GridAStar.moves`, they're read as the search goes """
+        self.height = moves.shape[1]
+        self.start, self.goal = start, goal
+        self._moves = moves
+        self._steps = GridAStar.steps(self.height)
+
+        self._g = {start: 0}
+        self._parent = {start: -1}
+        self._closed = set()
+        h = self._heuristic(start)
+        self._frontier = [(h, h, start)]
+        # the tile with the lowest heuristic seen so far, as (h, g, tile)
+        self._best = (h, 0, start)
+
+        self.done = False
+        self.found = False
+        # set when tiles the search has already been through changed, the search has to start over then
+        self.invalid = False
+        self.expansions = 0
+
+    def _heuristic(self, tile: int) -> float:
+        # same as the heuristic of `MapView.find_path`
+        x, y = divmod(tile, self.height)
+        goal_x, goal_y = divmod(self.goal, self.height)
+        dx, dy = abs(goal_x - x), abs(goal_y - y)
+        return (dx + dy) + (2**0.5 - 2 * 1) * (dx if dx < dy else dy)
+
+    def tiles_changed(self, tiles: Iterable[int]):
+        """ Lets the search know the moves from these tiles changed """
+        if not self.invalid and any(tile in self._g for tile in tiles):
+            self.invalid = True
+
+    def run(self, expansions: Optional[int] = None, seconds: Optional[float] = None) -> bool:
+        """
+        Continues the search for at most `expansions` tiles and/or `seconds` (no limit if neither is given)
+        return: Whether the search is done
+        """
+        if self.done:
+            return True
+        deadline = None if seconds is None else time.perf_counter() + seconds
+        limit = math.inf if expansions is None else self.expansions + expansions
+
+        allowed = memoryview(self._moves.reshape(-1))
+        steps = self._steps
+        g, parent, closed, frontier = self._g, self._parent, self._closed, self._frontier
+        heuristic = self._heuristic
+        while frontier:
+            if self.expansions >= limit or (deadline is not None and time.perf_counter() >= deadline):
+                return False
+            _, h, current = heapq.heappop(frontier)
+            if current in closed:
+                continue
+            closed.add(current)
+            self.expansions += 1
+            if (h, g[current]) < self._best[:2]:
+                self._best = (h, g[current], current)
+            if current == self.goal:
+                self.done = self.found = True
+                return True
+
+            cost = g[current]
+            for step, step_cost in steps[allowed[current]]:
+                next = current + step
+                new_cost = cost + step_cost
+                if next not in g or new_cost < g[next]:
+                    g[next] = new_cost
+                    parent[next] = current
+                    h = heuristic(next)
+                    heapq.heappush(frontier, (new_cost + h, h, next))
+
+        # ran out of tiles without reaching the goal
+        self.done = True
+        return True
+
+    def path(self) -> Optional[np.ndarray]:
+        """
+        The flat indices of the tiles from the start to the goal once it's been found,
+        until then the path to the tile that's closest to the goal, `None` if the search is done without a path
+        """
+        if self.done and not self.found:
+            return None
+        tile = self.goal if self.found else self._best[2]
+        path = []
+        while tile >= 0:
+            path.append(tile)
+            tile = self._parent[tile]
+        return np.array(path[::-1], dtype=np.int64)
+
+
+class CostLayers:
+    """
+    Stack of named cost layers for a grid of `width` by `height` tiles, added together into the cost of every tile.
+    The 'base' layer starts out at 1 everywhere and the others at 0, so a tile costs 1 until a layer says otherwise,
+    costs should stay at least a little above 0.
+    Layers can be updated a window at a time, only that part of the combined costs is worked out again.
+    Nothing is stored for the grid until a layer is actually added, while there are none every tile just costs 1.
+    """
+
+    def __init__(self, width: int, height: int):
+        self.size = (width, height)
+        # the layers that were added, 'base' only once it's been changed
+        self._layers: Dict[str, np.ndarray] = {}
+        self._costs: Optional[np.ndarray] = None
+        # bumped on every change, and whether every tile costs exactly 1 (for that revision)
+        self.revision = 0
+        self._uniform = (0, True)
+
+    def __contains__(self, name: str) -> bool:
+        return name == 'base' or name in self._layers
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """ A read-only view of a layer, use `set` or `update` to change it """
+        if name == 'base' and name not in self._layers:
+            return np.broadcast_to(1.0, self.size)
+        layer = self._layers[name].view()
+        layer.setflags(write=False)
+        return layer
+
+    @property
+    def costs(self) -> np.ndarray:
+        """ The combined cost of every tile (read-only while there aren't any layers) """
+        if self._costs is None:
+            return np.broadcast_to(1.0, self.size)
+        return self._costs
+
+    def _layer(self, name: str) -> np.ndarray:
+        if name not in self._layers:
+            self._layers[name] = np.ones(self.size) if name == 'base' else np.zeros(self.size)
+        return self._layers[name]
+
+    def set(self, name: str, values):
+        """ Replaces (or adds) a whole layer, `values` can be anything that broadcasts to the size of the grid """
+        self._layers[name] = np.broadcast_to(np.asarray(values, dtype=float), self.size).copy()
+        self._combine(0, 0, *self.size)
+
+    def update(self, name: str, x_lo: int, y_lo: int, values: np.ndarray):
+        """ Changes part of a layer, `values` is a window whose corner is at (x_lo, y_lo) """
+        x_hi, y_hi = x_lo + values.shape[0], y_lo + values.shape[1]
+        self._layer(name)[x_lo:x_hi, y_lo:y_hi] = values
+        self._combine(x_lo, y_lo, x_hi, y_hi)
+
+    def update_tiles(self, name: str, xs: np.ndarray, ys: np.ndarray, values):
+        """ Changes the tiles (`xs`, `ys`) of a layer to `values` """
+        layer = self._layer(name)
+        if len(xs):
+            layer[xs, ys] = values
+            self._combine(int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1)
+
+    def remove(self, name: str):
+        if name != 'base' and self._layers.pop(name, None) is not None:
+            self._combine(0, 0, *self.size)
+
+    def _combine(self, x_lo: int, y_lo: int, x_hi: int, y_hi: int):
+        self.revision += 1
+        if not self._layers:
+            self._costs = None
+            return
+        if self._costs is None:
+            # first layer, so all of it has to be worked out
+            self._costs = np.empty(self.size)
+            x_lo, y_lo, x_hi, y_hi = 0, 0, self.size[0], self.size[1]
+        window = (slice(x_lo, x_hi), slice(y_lo, y_hi))
+        # the base layer counts as 1 everywhere when it's not there
+        self._costs[window] = sum(layer[window] for layer in self._layers.values()) + (0 if 'base' in self._layers else 1)
+
+    @property
+    def uniform(self) -> bool:
+        """ Whether every tile costs exactly 1, in which case the costs don't have to be used at all """
+        if self._costs is None:
+            return True
+        if self._uniform[0] != self.revision:
+            self._uniform = (self.revision, bool((self._costs == 1).all()))
+        return self._uniform[1]
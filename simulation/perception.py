@@ -0,0 +1,239 @@
+from typing import Dict, List, Tuple
+import collections.abc
+import math
+import numpy as np
+
+from .spatial import SpatialHash
+
+
+class Perception:
+    """
+    Works out which agents can see each other.
+    Keeps everything about the agents that's needed for that in arrays, plus a spatial hash to find
+    the agents that are close enough, so the checks can be done for all of them at once.
+
+    An agent can see another agent if it's within its view range, the other agent's visibility range
+    and its view angle (or if it's within 1 tile), and the other agent hasn't been captured.
+    With `occlusion` on, any other agent also needs a clear line of sight between their tiles,
+    and agents in a tower can only see agents standing on a tile in the tower's viewshed.
+    """
+
+    def __init__(self, cell_size: float = 6.0):
+        self.hash = SpatialHash(cell_size)
+        self._agents: Dict['simulation.agent.AgentID', 'simulation.agent.Agent'] = {}
+        # agent ID -> row in the arrays, rows are in the same order as the agents
+        self._index: Dict['simulation.agent.AgentID', int] = {}
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.visibility_range = np.zeros(0)
+        self.captured = np.zeros(0, dtype=bool)
+
+        # one view per agent, reused for as long as the agent exists
+        self._views: Dict['simulation.agent.AgentID', 'simulation.vision.AgentView'] = {}
+        self._view_rows: List['simulation.vision.AgentView'] = []
+        # results that haven't been looked at yet
+        self._pending: List['SeenAgents'] = []
+
+        # line of sight between pairs of tiles (x0, y0, x, y), for this tick and the one before,
+        # anything that wasn't needed for a whole tick gets dropped
+        self._sightings: Dict[Tuple[int, int, int, int], bool] = {}
+        self._previous_sightings: Dict[Tuple[int, int, int, int], bool] = {}
+        self._revision = None
+
+    def rebuild(self, agents: Dict['simulation.agent.AgentID', 'simulation.agent.Agent']):
+        """ Copies over the state of all agents, should be done at the start of every tick """
+        # pending results can keep using the old arrays, we're not touching those anymore
+        self._expire(copy=False)
+
+        self._agents = agents
+        self._index = {ID: i for i, ID in enumerate(agents)}
+
+        # imported here, the vision module needs the agents and world, which need this module first
+        from .vision import AgentView
+        for ID, agent in agents.items():
+            if ID not in self._views or self._views[ID]._agent is not agent:
+                self._views[ID] = AgentView(agent, snapshot=True)
+        self._view_rows = [self._views[ID] for ID in agents]
+
+        n = len(agents)
+        self.x = np.empty(n)
+        self.y = np.empty(n)
+        self.visibility_range = np.empty(n)
+        self.captured = np.empty(n, dtype=bool)
+
+        self.hash.clear()
+        for ID in agents:
+            self.update(ID)
+
+        self._previous_sightings, self._sightings = self._sightings, {}
+
+    def update(self, ID: 'simulation.agent.AgentID'):
+        """ Copies over the state of a single agent, e.g. after it has moved """
+        self._expire(copy=True)
+
+        i = self._index[ID]
+        agent = self._agents[ID]
+        self.x[i] = agent.location.x
+        self.y[i] = agent.location.y
+        self.visibility_range[i] = agent.visibility_range
+        self.captured[i] = agent.is_captured
+        self.hash.insert(i, self.x[i], self.y[i])
+        self._views[ID]._refresh()
+
+    def _expire(self, copy: bool):
+        """ Gives the results that haven't been looked at yet their own copy of the current state """
+        if not self._pending:
+            return
+        state = (self.x, self.y, self.visibility_range, self.captured)
+        if copy:
+            state = tuple(column.copy() for column in state)
+        for seen in self._pending:
+            seen._state = state
+        self._pending = []
+
+    def perceive(self, ID: 'simulation.agent.AgentID', occlusion: bool = False) -> 'SeenAgents':
+        """
+        Returns views of all the agents that agent `ID` can see right now, in the same order as the agents,
+        they're only worked out once the result is actually used
+        `occlusion`: whether walls block the view
+        """
+        seen = SeenAgents(self, self._agents[ID], self._index[ID], occlusion)
+        self._pending.append(seen)
+        return seen
+
+    def _evaluate(self, seen: 'SeenAgents') -> List['simulation.vision.AgentView']:
+        if seen._state is None:
+            self._pending.remove(seen)
+            x_all, y_all, visibility_range, captured = self.x, self.y, self.visibility_range, self.captured
+        else:
+            x_all, y_all, visibility_range, captured = seen._state
+        x, y = seen.x, seen.y
+
+        # only agents that are close enough can be seen
+        if seen._state is None:
+            radius = max(min(seen.view_range, float(visibility_range.max(initial=0.0))), 1.0)
+            candidates = np.array(self.hash.query(x, y, radius), dtype=np.intp)
+        else:
+            # the hash has moved on, but it only ever skips agents that are too far away anyway
+            candidates = np.arange(len(x_all))
+        candidates = np.sort(candidates[(candidates != seen.index) & ~captured[candidates]])
+        if len(candidates) == 0:
+            return []
+
+        # same expressions as the scalar version, so the results are identical
+        dx = x_all[candidates] - x
+        dy = y_all[candidates] - y
+        distance = np.sqrt(dx**2 + dy**2)
+        angle_diff = np.abs((-np.degrees(np.arctan2(dy, dx)) + 90 - seen.heading + 180) % 360 - 180)
+
+        # redo the angle for anything that's right on the edge of the view cone with plain python,
+        # in case numpy's `arctan2` rounds differently
+        for k in np.flatnonzero(np.abs(angle_diff - seen.view_angle) < 1e-9):
+            angle_diff[k] = abs((-math.degrees(math.atan2(dy[k], dx[k])) + 90 - seen.heading + 180) % 360 - 180)
+
+        visible = (distance <= seen.view_range) & (distance <= visibility_range[candidates]) & \
+            (angle_diff <= seen.view_angle)
+
+        if seen.occlusion and visible.any():
+            if seen.in_tower:
+                # from a tower we can only see what's in the tower's viewshed
+                x0, y0 = int(x), int(y)
+                viewshed = seen.map.tower_viewshed(x0, y0,
+                                                   seen.tower_view_range * seen.map.get_vision_modifier(x0, y0))
+                for k in np.flatnonzero(visible):
+                    visible[k] = viewshed.sees(int(x_all[candidates[k]]), int(y_all[candidates[k]]))
+            else:
+                check = np.flatnonzero(visible)
+                visible[check] = self._line_of_sight(seen.map, int(x), int(y),
+                                                     x_all[candidates[check]], y_all[candidates[check]])
+
+        visible |= distance <= 1.0
+        return [seen.views[j] for j in candidates[visible]]
+
+    def _line_of_sight(self, map: 'simulation.vision.MapView', x0: int, y0: int,
+                       x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """ Whether the tiles of agents at `x`, `y` can be seen from tile (x0, y0), using the cache where possible """
+        # the cache is only valid as long as the map doesn't change
+        if self._revision != map._map.revision:
+            self._revision = map._map.revision
+            self._sightings, self._previous_sightings = {}, {}
+
+        # same rounding as `int(location.x)`
+        xs = x.astype(int)
+        ys = y.astype(int)
+
+        visible = np.zeros(len(xs), dtype=bool)
+        missing = []
+        for k, key in enumerate(zip([x0] * len(xs), [y0] * len(xs), xs.tolist(), ys.tolist())):
+            hit = self._sightings.get(key)
+            if hit is None:
+                hit = self._previous_sightings.get(key)
+                if hit is not None:
+                    self._sightings[key] = hit
+            if hit is None:
+                missing.append(k)
+            else:
+                visible[k] = hit
+
+        # work out the rest in one go
+        if missing:
+            missing = np.array(missing, dtype=np.intp)
+            visible[missing] = map._are_tiles_visible_from(x0, y0, xs[missing], ys[missing])
+            for k in missing.tolist():
+                self._sightings[x0, y0, int(xs[k]), int(ys[k])] = bool(visible[k])
+
+        return visible
+
+
+class SeenAgents(collections.abc.Sequence):
+    """
+    The agents that an agent can see, as a read-only list of `AgentView`s.
+    They're only worked out the first time the list is used,
+    but always as things were at the moment the agent looked around.
+    """
+
+    def __init__(self, perception: Perception, agent: 'simulation.agent.Agent', index: int, occlusion: bool):
+        self._perception = perception
+        self._views: List['simulation.vision.AgentView'] = None
+        # the arrays of the perception as they were, once they've changed
+        self._state: Tuple = None
+
+        # everything about the agent itself that's needed, as it is right now
+        self.index = index
+        self.occlusion = occlusion
+        self.views = perception._view_rows
+        self.map = agent.map
+        self.x, self.y = agent.location.x, agent.location.y
+        self.heading = agent.heading
+        self.view_range = agent.view_range
+        self.view_angle = agent.view_angle
+        self.in_tower = agent._in_tower
+        self.tower_view_range = agent.tower_view_range
+
+    def _get(self) -> List['simulation.vision.AgentView']:
+        if self._views is None:
+            self._views = self._perception._evaluate(self)
+            # don't need any of this anymore
+            self._perception = self._state = self.views = self.map = None
+        return self._views
+
+    def __getitem__(self, item):
+        return self._get()[item]
+
+    def __len__(self):
+        return len(self._get())
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __eq__(self, other):
+        return self._get() == list(other) if isinstance(other, collections.abc.Sequence) else NotImplemented
+
+    def __add__(self, other):
+        return self._get() + list(other)
+
+    def __radd__(self, other):
+        return list(other) + self._get()
+
+    def __repr__(self):
+        return repr(self._get())
@@ -0,0 +1,42 @@
+from typing import Dict, List, Tuple
+
+from .spatial import SpatialHash
+
+
+class CaptureRule:
+    """
+    Works out which intruders get captured: an intruder is captured when a guard is within `DISTANCE` of it
+    and the guard can see the intruder's tile from its own.
+    The guards are kept in a spatial hash, so only the guards right next to an intruder are looked at,
+    and the (much more expensive) line of sight is only checked for those.
+    """
+
+    DISTANCE = 0.5
+
+    def __init__(self, cell_size: float = 1.0):
+        self.hash = SpatialHash(cell_size)
+
+    def clear(self):
+        self.hash.clear()
+
+    def captures(self, guards: Dict['simulation.agent.AgentID', 'simulation.agent.GuardAgent'],
+                 intruders: Dict['simulation.agent.AgentID', 'simulation.agent.IntruderAgent']
+                 ) -> List[Tuple['simulation.agent.IntruderAgent', 'simulation.agent.GuardAgent']]:
+        """
+        return: Every intruder that's captured right now, along with the (first) guard capturing it
+        """
+        # guards only change cell every so often, so this mostly doesn't do anything
+        for ID, guard in guards.items():
+            self.hash.insert(ID, guard.location.x, guard.location.y)
+
+        captured = []
+        for intruder in intruders.values():
+            x, y = intruder.location.x, intruder.location.y
+            for ID in self.hash.query(x, y, self.DISTANCE):
+                guard = guards[ID]
+                if (x - guard.location.x)**2 + (y - guard.location.y)**2 > self.DISTANCE**2:
+                    continue
+                if guard.map._is_tile_visible_from(int(guard.location.x), int(guard.location.y), int(x), int(y)):
+                    captured.append((intruder, guard))
+                    break
+        return captured
@@ -0,0 +1,90 @@
+from typing import Dict, Optional
+import hashlib
+import concurrent.futures
+import numpy as np
+
+from .stencil import Stencil
+
+
+def _build_columns(walls: np.ndarray, offset: int, start: int, stop: int) -> np.ndarray:
+    """
+    Computes the line-of-sight bits for stencil entries `start` to `stop` (multiples of 8) for every tile,
+    returns them packed as an array of shape (width, height, (stop - start) // 8)
+    """
+    stencil = Stencil.get(offset)
+    width, height = walls.shape
+
+    # pad the walls so lines can run off the map, which counts as walls
+    padded = np.pad(walls, offset, mode='constant', constant_values=True)
+
+    visible = np.zeros((width, height, stop - start), dtype=bool)
+    for k in range(start, min(stop, stencil.size**2)):
+        blocked = np.zeros((width, height), dtype=bool)
+        for tile in stencil.lines[k]:
+            # padding index, so the rest of the line is empty
+            if tile == stencil.size**2:
+                break
+            x, y = divmod(int(tile), stencil.size)
+            blocked |= padded[x:x + width, y:y + height]
+        visible[:, :, k - start] = ~blocked
+
+    return np.packbits(visible, axis=2)
+
+
+class SightLines:
+    """
+    Precomputed line-of-sight table for the (static) walls of a map.
+    For every tile it stores a bitset of which tiles within `RANGE` tiles it can see,
+    using exactly the same lines as `MapView._is_tile_visible_from`.
+    """
+
+    RANGE = 18
+
+    # tables that have already been built, by hash of the walls
+    _cache: Dict[str, 'SightLines'] = {}
+
+    def __init__(self, walls: np.ndarray, workers: Optional[int] = None):
+        self.size = walls.shape
+        self.stencil = Stencil.get(self.RANGE)
+
+        # split the stencil up in chunks (of whole bytes) so we can build them in parallel
+        entries = self.stencil.size**2
+        chunk = 8 * 16
+        bounds = [(start, start + chunk) for start in range(0, entries, chunk)]
+        if workers is not None and workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_build_columns, walls, self.RANGE, start, stop) for start, stop in bounds]
+                columns = [future.result() for future in futures]
+        else:
+            columns = [_build_columns(walls, self.RANGE, start, stop) for start, stop in bounds]
+
+        # bits are indexed by (x, y, stencil index)
+        self.bits = np.concatenate(columns, axis=2)
+
+    @classmethod
+    def for_map(cls, map: 'simulation.environment.Map', workers: Optional[int] = None) -> 'SightLines':
+        """ Returns the table for the walls of `map`, building it only if we haven't seen these walls before """
+        key = hashlib.sha1(np.ascontiguousarray(map.walls, dtype=bool).tobytes() + repr(map.size).encode()).hexdigest()
+        if key not in cls._cache:
+            cls._cache[key] = SightLines(np.array(map.walls, dtype=bool), workers=workers)
+        return cls._cache[key]
+
+    def covers(self, x0: int, y0: int, x: int, y: int) -> bool:
+        """ Whether or not the table has an answer for this pair of tiles """
+        return 0 <= x0 < self.size[0] and 0 <= y0 < self.size[1] and \
+            abs(x - x0) <= self.RANGE and abs(y - y0) <= self.RANGE
+
+    def is_visible(self, x0: int, y0: int, x: int, y: int) -> bool:
+        """ Whether tile (x, y) can be seen from tile (x0, y0), both must be `covered` """
+        k = (x - x0 + self.RANGE) * self.stencil.size + (y - y0 + self.RANGE)
+        return bool(self.bits[x0, y0, k >> 3] & (0x80 >> (k & 7)))
+
+    def window(self, x0: int, y0: int, offset: int) -> np.ndarray:
+        """ Returns which tiles in the square window of size `2 * offset + 1` around (x0, y0) can be seen """
+        return self.windows(np.array([x0]), np.array([y0]), offset)[0]
+
+    def windows(self, x0: np.ndarray, y0: np.ndarray, offset: int) -> np.ndarray:
+        """ Same as `window`, but for a whole array of tiles at once """
+        size = self.stencil.size
+        visible = np.unpackbits(self.bits[x0, y0], axis=1)[:, :size**2].reshape(len(x0), size, size).view(bool)
+        return visible[:, self.RANGE - offset:self.RANGE + offset + 1, self.RANGE - offset:self.RANGE + offset + 1]
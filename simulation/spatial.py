@@ -0,0 +1,79 @@
+from typing import Dict, Hashable, List, Set, Tuple
+import math
+
+
+class SpatialHash:
+    """
+    Uniform grid of square cells that keeps track of which objects are roughly where,
+    used to quickly find everything that might be within some distance of a point
+    """
+
+    def __init__(self, cell_size: float = 6.0):
+        self.cell_size = cell_size
+        # cell coordinates -> keys of the objects in that cell
+        self._cells: Dict[Tuple[int, int], Set[Hashable]] = {}
+        # key -> cell it's currently in
+        self._where: Dict[Hashable, Tuple[int, int]] = {}
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._where
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def clear(self):
+        self._cells = {}
+        self._where = {}
+
+    def insert(self, key: Hashable, x: float, y: float):
+        """ Adds an object, or moves it if it's already in there """
+        cell = self._cell(x, y)
+        old = self._where.get(key)
+        if old == cell:
+            return
+        if old is not None:
+            self._discard(key, old)
+        self._cells.setdefault(cell, set()).add(key)
+        self._where[key] = cell
+
+    # moving is the same as inserting again
+    move = insert
+
+    def remove(self, key: Hashable):
+        cell = self._where.pop(key, None)
+        if cell is not None:
+            self._discard(key, cell)
+
+    def _discard(self, key: Hashable, cell: Tuple[int, int]):
+        keys = self._cells[cell]
+        keys.discard(key)
+        if not keys:
+            del self._cells[cell]
+
+    def query(self, x: float, y: float, radius: float) -> List[Hashable]:
+        """
+        Returns the keys of all objects in the cells that overlap the square around (x, y),
+        so everything within `radius` of it and then some (the caller does the exact check)
+        """
+        # a bit of margin so rounding errors can't make us miss anything
+        radius += 1e-6
+        x0, y0 = self._cell(x - radius, y - radius)
+        x1, y1 = self._cell(x + radius, y + radius)
+
+        keys = []
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self._cells):
+            # faster to go through the cells we have than all the ones in range
+            for (cx, cy), cell in self._cells.items():
+                if x0 <= cx <= x1 and y0 <= cy <= y1:
+                    keys.extend(cell)
+            return keys
+
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                cell = self._cells.get((cx, cy))
+                if cell:
+                    keys.extend(cell)
+        return keys
@@ -0,0 +1,81 @@
+from typing import Dict
+import math
+import numpy as np
+
+
+def bresenham(x0: int, y0: int, x1: int, y1: int):
+    # line code taken from:
+    # https://github.com/encukou/bresenham
+    dx = x1 - x0
+    dy = y1 - y0
+
+    xsign = 1 if dx > 0 else -1
+    ysign = 1 if dy > 0 else -1
+
+    dx = abs(dx)
+    dy = abs(dy)
+
+    if dx > dy:
+        xx, xy, yx, yy = xsign, 0, 0, ysign
+    else:
+        dx, dy = dy, dx
+        xx, xy, yx, yy = 0, ysign, xsign, 0
+
+    D = 2 * dy - dx
+    y = 0
+
+    for x in range(dx + 1):
+        yield x0 + x * xx + y * yx, y0 + x * xy + y * yy
+        if D >= 0:
+            y += 1
+            D -= 2 * dx
+        D += 2 * dy
+
+
+class Stencil:
+    """
+    Precomputed offsets, angles, distances and lines of sight for a square window around a viewer,
+    so the vision code can work on whole arrays instead of tile by tile.
+    Everything here only depends on the offset from the viewer, so one stencil is shared by every view.
+    """
+
+    _cache: Dict[int, 'Stencil'] = {}
+
+    def __init__(self, offset: int):
+        self.offset = offset
+        self.size = 2 * offset + 1
+
+        dx, dy = np.meshgrid(np.arange(-offset, offset + 1), np.arange(-offset, offset + 1), indexing='ij')
+        self.distance = dx**2 + dy**2
+        # angle from the tile towards the viewer, in degrees
+        # (uses `math.atan2` so the result is identical to the per-tile computation)
+        self.angle = np.array([[math.atan2(-y, -x) for y in range(-offset, offset + 1)]
+                               for x in range(-offset, offset + 1)]) * 180 / np.pi
+
+        # for every tile: the (flat) indices of the tiles a line of sight passes through before reaching it,
+        # padded with an index that points just past the end of the window
+        lines = []
+        for x, y in zip(dx.flat, dy.flat):
+            line = []
+            for x_line, y_line in bresenham(0, 0, int(x), int(y)):
+                if x_line == x and y_line == y:
+                    break
+                line.append((x_line + offset) * self.size + (y_line + offset))
+            lines.append(line)
+        self.lines = np.full((self.size**2, max(map(len, lines))), self.size**2, dtype=np.intp)
+        for i, line in enumerate(lines):
+            self.lines[i, :len(line)] = line
+
+    @classmethod
+    def get(cls, offset: int) -> 'Stencil':
+        if offset not in cls._cache:
+            cls._cache[offset] = Stencil(offset)
+        return cls._cache[offset]
+
+    def is_blocked(self, walls: np.ndarray, windows: np.ndarray, tiles: np.ndarray) -> np.ndarray:
+        """
+        Checks the line of sight to `tiles` (flat indices into the window) in each of `windows`,
+        `walls` is a stack of windows of walls, each centered on its viewer
+        """
+        blocking = np.concatenate([walls.reshape(len(walls), -1), np.zeros((len(walls), 1), dtype=bool)], axis=1)
+        return blocking[windows[:, None], self.lines[tiles]].any(axis=1)
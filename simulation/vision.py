@@ -1,9 +1,13 @@
-from typing import Tuple, List
+from typing import Tuple, List, Dict, Optional
+import collections
+from enum import Enum
 import math
 import numpy as np
 import vectormath as vmath
 
 from .util import Position
+from .fog import FogOfWar
+from .stencil import Stencil, bresenham
 from . import pathfinding
 import simulation.agent
 
@@ -12,10 +16,29 @@ class AgentView:
     """
     Implements a wrapper around an agent that only exposes things that can be
     known when another agent sees it
+
+    `snapshot`: remember the location, heading and captured flag after the first time they're read,
+                until `_refresh` is called (the `Perception` does that whenever the agent changes),
+                the location is then shared so it's read-only
     """
 
-    def __init__(self, agent):
+    def __init__(self, agent, snapshot: bool = False):
         self._agent = agent
+        self._snapshot = snapshot
+
+        # the type of an agent never changes
+        self._is_guard = isinstance(agent, simulation.agent.GuardAgent)
+        self._is_intruder = isinstance(agent, simulation.agent.IntruderAgent)
+
+        self._location: Position = None
+        self._heading: float = None
+        self._is_captured: bool = None
+
+    def _refresh(self):
+        """ Forgets the snapshot, so it's read again from the agent next time """
+        self._location = None
+        self._heading = None
+        self._is_captured = None
 
     @property
     def ID(self):
@@ -23,26 +46,367 @@ class AgentView:
 
     @property
     def location(self):
-        return Position(self._agent.location)
+        if not self._snapshot:
+            return Position(self._agent.location)
+        if self._location is None:
+            self._location = Position(self._agent.location)
+            self._location.setflags(write=False)
+        return self._location
 
     @property
     def heading(self):
-        return self._agent.heading
+        if not self._snapshot:
+            return self._agent.heading
+        if self._heading is None:
+            self._heading = self._agent.heading
+        return self._heading
 
     @property
     def is_guard(self):
-        return isinstance(self._agent, simulation.agent.GuardAgent)
+        return self._is_guard
 
     @property
     def is_intruder(self):
-        return isinstance(self._agent, simulation.agent.IntruderAgent)
+        return self._is_intruder
 
     @property
     def is_captured(self):
-        if isinstance(self._agent, simulation.agent.IntruderAgent):
+        if not self._is_intruder:
+            return False
+        if not self._snapshot:
             return self._agent.is_captured
+        if self._is_captured is None:
+            self._is_captured = self._agent.is_captured
+        return self._is_captured
+
+
+class VisionBackend(Enum):
+    """The different ways a `MapView` can work out which tiles are in line of sight"""
+    # a Bresenham ray to every tile (or the precomputed `SightLines` table for the map)
+    RAYCAST = 1
+    # symmetric shadowcasting, touches every tile in the view cone once
+    SHADOWCAST = 2
+
+
+# quadrants used for shadowcasting, as (bearing of the axis, transform from (row, col) to an (x, y) offset)
+# bearings are in degrees where 0 is up and 90 is right, same as agent headings
+_QUADRANTS = [
+    (0, lambda row, col: (col, row)),
+    (90, lambda row, col: (row, -col)),
+    (180, lambda row, col: (-col, -row)),
+    (-90, lambda row, col: (-row, col)),
+]
+
+
+def _cone_slopes(bearing: float, heading: float, view_angle: float):
+    """
+    Returns the part of the view cone that falls within the quadrant with the given axis as a pair of slopes,
+    each slope is a fraction (numerator, denominator), or `None` if they don't overlap
+    """
+    # widen the cone by the angle half a tile takes up right next to the viewer, so that every tile whose center
+    # is in the cone is seen exactly like it would be with a full 360 degree scan
+    # (otherwise walls on the edge of the cone would depend on which way the viewer is facing)
+    margin = math.degrees(math.atan(0.5)) + 1e-6
+    if view_angle + 2 * margin >= 360:
+        lo, hi = -45.0, 45.0
+    else:
+        center = (heading - bearing + 180) % 360 - 180
+        for center in (center, center - 360, center + 360):
+            lo, hi = max(center - view_angle / 2 - margin, -45.0), min(center + view_angle / 2 + margin, 45.0)
+            if lo <= hi:
+                break
         else:
+            return None
+
+    # round outwards
+    precision = 10**6
+    start = (math.floor(math.tan(math.radians(lo)) * precision), precision)
+    end = (math.ceil(math.tan(math.radians(hi)) * precision), precision)
+    return start, end
+
+
+def shadowcast(walls: np.ndarray, offset: int, heading: float, view_angle: float) -> np.ndarray:
+    """
+    Symmetric shadowcasting, based on: https://www.albertford.com/shadowcasting/
+    `walls` is the square window of size `2 * offset + 1` centered on the viewer,
+    returns which tiles in that window are in line of sight within the view cone
+    Slopes are kept as integer fractions so the rounding is exact.
+    """
+    # plain lists are a lot faster to index one by one
+    blocking = walls.tolist()
+    visible = [[False] * len(row) for row in blocking]
+    visible[offset][offset] = True
+
+    for bearing, transform in _QUADRANTS:
+        slopes = _cone_slopes(bearing, heading, view_angle)
+        if slopes is None:
+            continue
+
+        def scan(depth, start, end):
+            if depth > offset:
+                return
+            (start_num, start_den), (end_num, end_den) = start, end
+            # round ties up for the first column and down for the last one
+            min_col = (2 * depth * start_num + start_den) // (2 * start_den)
+            max_col = -((-(2 * depth * end_num - end_den)) // (2 * end_den))
+
+            prev_wall = None
+            for col in range(min_col, max_col + 1):
+                x, y = transform(depth, col)
+                wall = blocking[offset + x][offset + y]
+                # symmetric: the center of the tile is within the slopes
+                if wall or (col * start_den >= depth * start_num and col * end_den <= depth * end_num):
+                    visible[offset + x][offset + y] = True
+                if prev_wall and not wall:
+                    start = (2 * col - 1, 2 * depth)
+                    start_num, start_den = start
+                if prev_wall is False and wall:
+                    scan(depth + 1, start, (2 * col - 1, 2 * depth))
+                prev_wall = wall
+            if prev_wall is False:
+                scan(depth + 1, start, end)
+
+        scan(1, *slopes)
+
+    return np.array(visible, dtype=bool)
+
+
+def _los_method(view: 'MapView', x0: int, y0: int, offset: int) -> str:
+    """ Which way of working out line of sight to use for a view at (x0, y0) """
+    sightlines = view._map.sightlines
+    if view.backend == VisionBackend.SHADOWCAST:
+        return 'shadowcast'
+    elif sightlines is not None and offset <= sightlines.RANGE and view._map.in_bounds(x0, y0):
+        return 'sightlines'
+    return 'lines'
+
+
+def reveal_visible_batch(requests: List[Tuple['MapView', Tuple[int, int, float, float, float, bool]]]):
+    """
+    Does `MapView._reveal_visible` for a whole batch of views at once.
+    `requests` is a list of (view, (x0, y0, radius, view_angle, heading, in_tower)),
+    views that share the same window size and line-of-sight method are computed as one stack of arrays.
+    """
+    groups: Dict[Tuple[int, int, str], List] = {}
+    for view, request in requests:
+        x0, y0 = request[0], request[1]
+        vision_modifier = view._map.get_vision_modifier(x0, y0)
+        offset = int(math.ceil(18*vision_modifier))  # + 1
+        method = _los_method(view, x0, y0, offset)
+
+        # if only the heading changed since the last update we only have to look at the new part of the cone,
+        # everything in the old part has already been revealed
+        x0, y0, radius, view_angle, heading, in_tower = request
+        key = (x0, y0, radius, view_angle, in_tower, offset, view._map.revision, view.fog)
+        previous_heading = None
+        if view._last_reveal is not None and view._last_reveal[:-1] == key:
+            previous_heading = view._last_reveal[-1]
+        view._last_reveal = key + (heading,)
+
+        # agents in a tower just take a slice of what can be seen from there
+        if in_tower:
+            viewshed = TowerViewshed.get(view._map, x0, y0, radius, method)
+            visible = viewshed.slice(heading, view_angle)
+            if previous_heading is not None:
+                visible &= ~viewshed.slice(previous_heading, view_angle)
+            _reveal_window(view, x0, y0, offset, visible)
+            continue
+
+        groups.setdefault((id(view._map), offset, method), []).append((view, request, vision_modifier, previous_heading))
+
+    for (_, offset, method), group in groups.items():
+        visible = _visible_group(group[0][0]._map, group, offset, method)
+        for i, (view, request, vision_modifier, previous_heading) in enumerate(group):
+            _reveal_window(view, request[0], request[1], offset, visible[i])
+
+
+def _reveal_window(view: 'MapView', x0: int, y0: int, offset: int, visible: np.ndarray):
+    """ Copies the visible tiles of a window centered on (x0, y0) over to the fog-of-war of `view` """
+    if offset > 0:
+        # set neighbouring tiles as visible too
+        visible[offset - 1:offset + 2, offset - 1:offset + 2] = True
+    else:
+        view._reveal_window(x0 - 1, y0 - 1, np.ones((3, 3), dtype=bool))
+
+    # and copy it over to the fog-of-war
+    view._reveal_window(x0 - offset, y0 - offset, visible)
+
+
+def _map_windows(map: 'simulation.environment.Map', x_lo: np.ndarray, y_lo: np.ndarray, size: int):
+    """
+    Returns the walls, towers and in-bounds tiles of a stack of square windows of the map,
+    tiles outside of the map are treated as walls
+    """
+    xs = x_lo[:, None] + np.arange(size)
+    ys = y_lo[:, None] + np.arange(size)
+    inside = ((xs >= 0) & (xs < map.width))[:, :, None] & ((ys >= 0) & (ys < map.height))[:, None, :]
+    xs = np.clip(xs, 0, map.width - 1)[:, :, None]
+    ys = np.clip(ys, 0, map.height - 1)[:, None, :]
+
+    walls = np.asarray(map.walls, dtype=bool)[xs, ys] | ~inside
+    towers = np.asarray(map.tower_map, dtype=bool)[xs, ys] & inside
+    return walls, towers, inside
+
+
+def _visible_group(map: 'simulation.environment.Map', group: List, offset: int, method: str) -> np.ndarray:
+    """
+    Works out which tiles can be seen for a group of requests that share the same window size and method,
+    returns a stack of windows of size `2 * offset + 1` centered on the viewers
+    """
+    stencil = Stencil.get(offset)
+
+    x0 = np.array([request[0] for view, request, vision_modifier, previous_heading in group])
+    y0 = np.array([request[1] for view, request, vision_modifier, previous_heading in group])
+    x_lo, y_lo = x0 - offset, y0 - offset
+    walls, towers, inside = _map_windows(map, x_lo, y_lo, stencil.size)
+
+    # per view parameters, shaped so they broadcast over the windows
+    # (thresholds are computed exactly like the scalar version so the comparisons match bit for bit)
+    def column(values, dtype=float):
+        return np.array(list(values), dtype=dtype)[:, None, None]
+
+    radius = [request[2] for view, request, vision_modifier, previous_heading in group]
+    view_angle = column(request[3] / 2 for view, request, vision_modifier, previous_heading in group)
+    heading = column(request[4] for view, request, vision_modifier, previous_heading in group)
+    in_tower = column((request[5] for view, request, vision_modifier, previous_heading in group), dtype=bool)
+    max_distance = column(float((18*vision_modifier)**2) for view, request, vision_modifier, previous_heading in group)
+    wall_distance = column(float((10*vision_modifier)**2) for view, request, vision_modifier, previous_heading in group)
+    view_distance = column(float(r**2) for r in radius)
+
+    # angle check
+    angle = (stencil.angle + heading + 90 + 180) % 360 - 180
+    candidates = inside & ~((angle > view_angle) | (angle < -view_angle))
+
+    # only rotated since the last update: skip the part of the cone that was already revealed
+    rotated = [previous_heading is not None for view, request, vision_modifier, previous_heading in group]
+    if any(rotated):
+        previous_heading = column(previous_heading or 0.0 for view, request, vision_modifier, previous_heading in group)
+        angle = (stencil.angle + previous_heading + 90 + 180) % 360 - 180
+        candidates &= ~(column(rotated, dtype=bool) & ~((angle > view_angle) | (angle < -view_angle)))
+
+    # distance check
+    distance = stencil.distance
+    candidates &= ~(distance > max_distance)
+    # towers are always visible
+    tower_hits = candidates & towers & column((r > 0 for r in radius), dtype=bool)
+    candidates &= ~tower_hits
+    # outside of the view radius only walls can be seen, and only up to a point
+    far = candidates & (distance > view_distance)
+    far_walls = far & walls & ~(distance > wall_distance) & column((r != 0 for r in radius), dtype=bool)
+    near = candidates & ~far
+    # from inside a tower everything within the view radius is visible
+    direct_hits = near & in_tower
+    needs_check = far_walls | (near & ~in_tower)
+
+    # visibility check
+    visible = tower_hits | direct_hits
+    if method == 'shadowcast':
+        for i, (view, request, vision_modifier, previous_heading) in enumerate(group):
+            if needs_check[i].any():
+                visible[i] |= needs_check[i] & shadowcast(walls[i], offset, request[4], request[3])
+    elif method == 'sightlines':
+        visible |= needs_check & map.sightlines.windows(x0, y0, offset)
+    else:
+        windows, tiles = np.nonzero(needs_check.reshape(len(group), -1))
+        clear = ~stencil.is_blocked(walls, windows, tiles)
+        visible.reshape(len(group), -1)[windows[clear], tiles[clear]] = True
+
+    return visible
+
+
+class TowerViewshed:
+    """
+    Everything that can be seen from a tile in a tower, in every direction at once.
+    Towers don't move, so this only has to be worked out once per map,
+    the view at any one heading is then just an angular slice of it.
+    """
+
+    def __init__(self, map: 'simulation.environment.Map', x0: int, y0: int, radius: float, method: str = 'lines'):
+        self.x0, self.y0 = x0, y0
+        self.radius = radius
+        self.revision = map.revision
+
+        vision_modifier = map.get_vision_modifier(x0, y0)
+        self.offset = int(math.ceil(18*vision_modifier))
+        self.stencil = Stencil.get(self.offset)
+
+        # a full circle, the line-of-sight checks don't depend on the heading
+        request = (x0, y0, radius, 360.0, 0.0, True)
+        self.visible = _visible_group(map, [(None, request, vision_modifier, None)], self.offset, method)[0]
+
+        # visible tiles sorted by angle, so a slice only has to look at the tiles around the cone
+        tiles = np.flatnonzero(self.visible)
+        angles = self.stencil.angle.ravel()[tiles]
+        order = np.argsort(angles, kind='stable')
+        self._tiles = tiles[order]
+        self._angles = angles[order]
+
+    @classmethod
+    def get(cls, map: 'simulation.environment.Map', x0: int, y0: int, radius: float,
+            method: str = 'lines') -> 'TowerViewshed':
+        """ Returns the (cached) viewshed, it's only recomputed when the map has changed """
+        key = (x0, y0, radius, method)
+        viewshed = map.viewsheds.get(key)
+        if viewshed is None or viewshed.revision != map.revision:
+            viewshed = map.viewsheds[key] = TowerViewshed(map, x0, y0, radius, method)
+        return viewshed
+
+    def slice(self, heading: float, view_angle: float) -> np.ndarray:
+        """ Returns the part of the viewshed that's within the view cone, as a window centered on the tower """
+        visible = np.zeros(self.visible.shape, dtype=bool)
+        tiles, angles = self._tiles, self._angles
+
+        if view_angle < 360:
+            # rough cut using the sorted angles, with a bit of margin for rounding...
+            center = (-heading - 90 + 180) % 360 - 180
+            lo, hi = center - view_angle / 2 - 1e-6, center + view_angle / 2 + 1e-6
+            bounds = [(lo, hi)]
+            if lo < -180:
+                bounds = [(-180.0, hi), (lo + 360, 180.0)]
+            elif hi > 180:
+                bounds = [(-180.0, hi - 360), (lo, 180.0)]
+            cut = np.concatenate([np.arange(np.searchsorted(angles, a, side='left'), np.searchsorted(angles, b, side='right'))
+                                  for a, b in bounds])
+            tiles, angles = tiles[cut], angles[cut]
+
+            # ...followed by exactly the same check as `_visible_group`
+            angle = (angles + heading + 90 + 180) % 360 - 180
+            inside = ~((angle > view_angle / 2) | (angle < -view_angle / 2))
+            tiles = tiles[inside]
+
+        visible.ravel()[tiles] = True
+        return visible
+
+    def sees(self, x: int, y: int) -> bool:
+        """ Whether or not tile (x, y) can be seen from the tower when looking in its direction """
+        i, j = x - self.x0 + self.offset, y - self.y0 + self.offset
+        if not (0 <= i < self.stencil.size and 0 <= j < self.stencil.size):
             return False
+        # the tiles right next to the tower are always visible
+        return bool(self.visible[i, j]) or (abs(i - self.offset) <= 1 and abs(j - self.offset) <= 1)
+
+
+def tower_coverage(map: 'simulation.environment.Map', towers: List[Position] = None, radius: float = 15.0,
+                   method: str = 'lines') -> np.ndarray:
+    """
+    Returns how many towers can see each tile of the map (in any direction),
+    useful to see how well a set of towers (by default the ones on the map) covers it
+    """
+    towers = map.towers if towers is None else towers
+    coverage = np.zeros(map.size, dtype=int)
+    for tower in towers:
+        x0, y0 = int(tower[0]), int(tower[1])
+        viewshed = TowerViewshed.get(map, x0, y0, radius * map.get_vision_modifier(x0, y0), method)
+        visible = viewshed.visible.copy()
+        offset = viewshed.offset
+        visible[max(offset - 1, 0):offset + 2, max(offset - 1, 0):offset + 2] = True
+
+        # clip the window to the map
+        x_lo, y_lo = x0 - offset, y0 - offset
+        i0, j0 = max(-x_lo, 0), max(-y_lo, 0)
+        i1, j1 = min(visible.shape[0], map.width - x_lo), min(visible.shape[1], map.height - y_lo)
+        coverage[x_lo + i0:x_lo + i1, y_lo + j0:y_lo + j1] += visible[i0:i1, j0:j1]
+    return coverage
 
 
 class MapView(pathfinding.Graph):
@@ -50,12 +414,57 @@ class MapView(pathfinding.Graph):
     Basically implements a fog-of-war
     """
 
-    def __init__(self, map):
+    def __init__(self, map, backend: VisionBackend = VisionBackend.RAYCAST,
+                 path_backend: pathfinding.SearchBackend = pathfinding.SearchBackend.ASTAR,
+                 path_budget: int = None, path_time_budget: float = None):
         # private copy of the full map
         self._map = map
+        # how line of sight is worked out
+        self.backend = backend
+        # how `find_path` searches, unless it's told otherwise
+        self.path_backend = path_backend
+        # how many tiles and/or seconds an A* search in `find_path` gets per call,
+        # if there's a limit a search that runs out is picked up again the next time (see `is_path_pending`)
+        self.path_budget = path_budget
+        self.path_time_budget = path_time_budget
+        # parameters of the last call to `_reveal_visible`, to detect when only the heading changed
+        self._last_reveal: Tuple = None
 
         # fog-of-war map
-        self.fog = np.zeros((self._map.size[0], self._map.size[1]), dtype=np.bool)  # self._map.size?
+        self.fog = FogOfWar(self._map.size)
+
+        # for pathfinding: which tiles are passable and the allowed moves from each of them,
+        # only valid as long as the map and fog are still at the revisions in `_grid_key`
+        self._passable: np.ndarray = None
+        self._moves: np.ndarray = None
+        self._grid_key: Tuple = None
+        # bumped whenever tiles become impassable, unlike the fog's revision which changes with everything revealed
+        self.passability_revision = 0
+        # recent results of `find_path`, most recently used last (see `find_path` for the keys)
+        self._path_cache: 'collections.OrderedDict[Tuple, Optional[pathfinding.Path]]' = collections.OrderedDict()
+        self.path_cache_size = 256
+        self.path_cache_hits = 0
+        self.path_cache_misses = 0
+        self._search: pathfinding.GridAStar = None
+        # incremental planners for the last few goals, most recently used last
+        self._planners: 'collections.OrderedDict[int, pathfinding.DStarLite]' = collections.OrderedDict()
+        # extra costs for pathfinding on top of the distance, see `_costs`, only made once it's used
+        self._cost_layers: pathfinding.CostLayers = None
+        # extra cost of tiles that haven't been seen yet (as a cost layer), and the fog it was last set for
+        self.fog_penalty = 0.0
+        self._fog_layer: Tuple = None
+        # the search that's being spread out over multiple calls to `find_path`
+        self._request: pathfinding.AnytimeAStar = None
+        # clusters for hierarchical searches, made on the first one
+        self._hierarchy: pathfinding.HPAStar = None
+        # same for jump point searches
+        self._jump_points: pathfinding.JumpPointSearch = None
+        # flow fields over what this view knows about the walls, by goal tile, most recently used last
+        self._flow_fields: 'collections.OrderedDict[int, Tuple[int, pathfinding.FlowField]]' = \
+            collections.OrderedDict()
+        # tiles of the path that's being watched (see `track_path`), and whether a wall has turned up on them
+        self._tracked: set = None
+        self._tracked_blocked = False
 
     @property
     def size(self):
@@ -73,38 +482,15 @@ class MapView(pathfinding.Graph):
         return self._map.get_vision_modifier(x, y)
 
     def _reveal_all(self):
-        self.fog = np.ones((self._map.size[0], self._map.size[1]), dtype=np.bool)
+        self.fog.reveal_all()
 
     def _is_tile_visible_from(self, x0, y0, x, y):
-        # line code taken from:
-        # https://github.com/encukou/bresenham
-        def line(x0, y0, x1, y1):
-            dx = x1 - x0
-            dy = y1 - y0
+        # use the precomputed table if we have one
+        sightlines = self._map.sightlines
+        if sightlines is not None and sightlines.covers(x0, y0, x, y):
+            return sightlines.is_visible(x0, y0, x, y)
 
-            xsign = 1 if dx > 0 else -1
-            ysign = 1 if dy > 0 else -1
-
-            dx = abs(dx)
-            dy = abs(dy)
-
-            if dx > dy:
-                xx, xy, yx, yy = xsign, 0, 0, ysign
-            else:
-                dx, dy = dy, dx
-                xx, xy, yx, yy = 0, ysign, xsign, 0
-
-            D = 2 * dy - dx
-            y = 0
-
-            for x in range(dx + 1):
-                yield x0 + x * xx + y * yx, y0 + x * xy + y * yy
-                if D >= 0:
-                    y += 1
-                    D -= 2 * dx
-                D += 2 * dy
-
-        for x_line, y_line in line(x0, y0, x, y):
+        for x_line, y_line in bresenham(x0, y0, x, y):
             # reached the last tile, so it's visible
             if x == x_line and y == y_line:
                 return True
@@ -112,61 +498,111 @@ class MapView(pathfinding.Graph):
             if self._map.is_wall(x_line, y_line):
                 return False
 
+    def _are_tiles_visible_from(self, x0: int, y0: int, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """ Same as `_is_tile_visible_from`, but for a whole array of tiles at once """
+        offset = int(max(np.abs(xs - x0).max(initial=0), np.abs(ys - y0).max(initial=0)))
+        stencil = Stencil.get(offset)
+        walls, towers, inside = _map_windows(self._map, np.array([x0 - offset]), np.array([y0 - offset]), stencil.size)
+        tiles = (xs - x0 + offset) * stencil.size + (ys - y0 + offset)
+        return ~stencil.is_blocked(walls, np.zeros(len(tiles), dtype=np.intp), tiles)
+
     # see-through-walls version:    0.2 ms / call
     # same but without numpy:       0.4 ms / call
     # proper version:               0.6 ms / call
+    # stencil version:              0.05 ms / call
     def _reveal_visible(self, x0: int, y0: int, radius: float, view_angle: float, heading: float, in_tower: bool):
-        vision_modifier = self._map.get_vision_modifier(x0, y0)
-        offset = int(math.ceil(18*vision_modifier))  # + 1
-
-        for x in range(x0 - offset, x0 + offset + 1):
-            for y in range(y0 - offset, y0 + offset + 1):
-                # bounds check
-                if not self._map.in_bounds(x, y):
-                    continue
-
-                # angle check
-                angle = math.atan2(y0 - y, x0 - x) * 180 / np.pi
-                angle = (angle + heading + 90 + 180) % 360 - 180
-                if angle > view_angle / 2 or angle < -view_angle / 2:
-                    continue
-
-                # distance check
-                distance = (x - x0)**2 + (y - y0)**2
-                if distance > (18*vision_modifier)**2:
-                    continue
-                elif self._map.is_tower(x, y) and radius > 0:
-                    self.fog[x][y] = True
-                    continue
-                elif distance > radius**2:
-                    if distance > (10*vision_modifier)**2:
-                        continue
-                    elif not self._map.is_wall(x, y) or radius == 0:  # or not self._map.is_gate(x, y)
-                        continue
-                elif in_tower:
-                    self.fog[x][y] = True
-                    continue
-
-                # visibility check
-                if not self._is_tile_visible_from(x0, y0, x, y):  # and not in_tower:
-                    continue
-
-                # tile is visible!
-                self.fog[x][y] = True
-
-        # set neighbouring tiles as visible too
-        for x in range(x0 - 1, x0 + 2):
-            for y in range(y0 - 1, y0 + 2):
-                if self._map.in_bounds(x, y):
-                    self.fog[x][y] = True
+        reveal_visible_batch([(self, (x0, y0, radius, view_angle, heading, in_tower))])
+
+    def _reveal_window(self, x_lo: int, y_lo: int, visible: np.ndarray) -> np.ndarray:
+        in_sync = self._grid_key == (self._map.revision, self.fog, self.fog.revision)
+        layer_in_sync = self._fog_layer == (self.fog, self.fog.revision) and \
+            self._cost_layers is not None and 'fog' in self._cost_layers
+        newly = self.fog.reveal(x_lo, y_lo, visible)
+        if in_sync:
+            self._update_grid(x_lo, y_lo, newly)
+        if layer_in_sync:
+            xs, ys = np.nonzero(newly)
+            if len(xs):
+                self._cost_layers.update_tiles('fog', xs + x_lo, ys + y_lo, 0.0)
+            self._fog_layer = (self.fog, self.fog.revision)
+        return newly
+
+    def tower_viewshed(self, x0: int, y0: int, radius: float) -> TowerViewshed:
+        """ Everything that can be seen from (x0, y0) when standing in a tower, using this view's line of sight """
+        offset = int(math.ceil(18*self.get_vision_modifier(x0, y0)))
+        return TowerViewshed.get(self._map, x0, y0, radius, _los_method(self, x0, y0, offset))
 
     def is_revealed(self, x: int, y: int):
         if 0 <= x < self._map.size[0] and 0 <= y < self._map.size[1]:
-            return self.fog[x][y]
+            return self.fog.is_revealed(x, y)
         else:
             return True
 
     # vvvv pathfinding methods vvvv
+    def _grid(self) -> np.ndarray:
+        """ The allowed moves from every tile (see `GridAStar.moves`), for the current walls and fog """
+        key = (self._map.revision, self.fog, self.fog.revision)
+        if self._grid_key != key:
+            passable = ~(np.asarray(self._map.walls, dtype=bool) & self.fog.to_array())
+            if self._passable is None or not np.array_equal(passable, self._passable):
+                self._passability_changed()
+            self._passable = passable
+            self._moves = pathfinding.GridAStar.moves(self._passable)
+            self._grid_key = key
+            # no way of knowing what changed, so the planners have to start over
+            self._planners.clear()
+            self._request = None
+            self._hierarchy = None
+            self._jump_points = None
+            self._tracked_blocked = True
+        return self._moves
+
+    def _passability_changed(self):
+        self.passability_revision += 1
+        # none of the cached paths are any good anymore
+        self._path_cache.clear()
+
+    def _update_grid(self, x_lo: int, y_lo: int, newly: np.ndarray):
+        """ Updates the grid after the tiles in `newly` (a window whose corner is at (x_lo, y_lo)) were revealed """
+        xs, ys = np.nonzero(newly)
+        xs, ys = xs + x_lo, ys + y_lo
+        # only walls become impassable once they're revealed
+        walls = np.asarray(self._map.walls, dtype=bool)[xs, ys]
+        xs, ys = xs[walls], ys[walls]
+        if len(xs):
+            self._passable[xs, ys] = False
+            self._passability_changed()
+
+            # only the moves from the tiles around the new walls change
+            width, height = self.size
+            x0, x1 = max(xs.min() - 1, 0), min(xs.max() + 2, width)
+            y0, y1 = max(ys.min() - 1, 0), min(ys.max() + 2, height)
+            cx0, cx1 = max(x0 - 1, 0), min(x1 + 1, width)
+            cy0, cy1 = max(y0 - 1, 0), min(y1 + 1, height)
+            moves = pathfinding.GridAStar.moves(self._passable[cx0:cx1, cy0:cy1])
+            self._moves[x0:x1, y0:y1] = moves[x0 - cx0:x1 - cx0, y0 - cy0:y1 - cy0]
+
+            # see if any of the new walls are in the way of the path we're watching
+            if self._tracked is not None and not self._tracked_blocked:
+                self._tracked_blocked = any(x * height + y in self._tracked for x, y in zip(xs.tolist(), ys.tolist()))
+
+            # and let the planners and the pending search know which tiles have different moves now
+            if self._planners or self._request is not None:
+                changed = set()
+                for x, y in zip(xs.tolist(), ys.tolist()):
+                    changed.update(nx * height + ny for nx in range(max(x - 1, 0), min(x + 2, width))
+                                   for ny in range(max(y - 1, 0), min(y + 2, height)))
+                for planner in self._planners.values():
+                    planner.tiles_changed(changed)
+                if self._request is not None:
+                    self._request.tiles_changed(changed)
+            if self._hierarchy is not None:
+                self._hierarchy.tiles_changed(zip(xs.tolist(), ys.tolist()))
+            if self._jump_points is not None:
+                self._jump_points.tiles_changed(zip(xs.tolist(), ys.tolist()))
+
+        self._grid_key = (self._map.revision, self.fog, self.fog.revision)
+
     def is_passable(self, node):
         if not self._map.in_bounds(*node):
             return False
@@ -212,13 +648,194 @@ class MapView(pathfinding.Graph):
         else:
             multiplier = 1
 
-        # double cost for "invisible" tiles
-        if self.is_revealed(*to_node):
-            return 1 * multiplier
-        else:
-            return 1 * multiplier
+        # anything extra comes from the cost layers (see `_costs`)
+        if self._cost_layers is None:
+            return multiplier
+        return multiplier * self._cost_layers.costs[x2, y2]
 
-    def find_path(self, from_node: Tuple[float, float], to_node: Tuple[float, float]) -> List[Tuple[float, float]]:
+    @property
+    def cost_layers(self) -> 'pathfinding.CostLayers':
+        """ The cost layers used for pathfinding, they're only made the first time they're needed """
+        if self._cost_layers is None:
+            self._cost_layers = pathfinding.CostLayers(*self._map.size)
+        return self._cost_layers
+
+    def _costs(self) -> Optional[np.ndarray]:
+        """
+        The cost of moving onto every tile, from all cost layers combined, or `None` if they're all the same.
+        Along with any layers that were added to `cost_layers`, there's a 'fog' layer while `fog_penalty` is set,
+        which is kept up to date with the fog
+        """
+        if self.fog_penalty:
+            if self._fog_layer != (self.fog, self.fog.revision) or 'fog' not in self.cost_layers:
+                self.cost_layers.set('fog', self.fog_penalty * ~self.fog.to_array())
+                self._fog_layer = (self.fog, self.fog.revision)
+        elif self._cost_layers is not None and 'fog' in self._cost_layers:
+            self._cost_layers.remove('fog')
+            self._fog_layer = None
+        if self._cost_layers is None or self._cost_layers.uniform:
+            return None
+        return self._cost_layers.costs
+
+    def track_path(self, path: 'pathfinding.Path'):
+        """
+        Starts watching `path` (as returned by `find_path`), from now on `is_path_blocked` tells whether a wall
+        has been revealed on one of its tiles or next to one of its diagonal moves
+        """
+        # make sure the grid is up to date, so we hear about every wall that's revealed from now on
+        self._grid()
+        self._tracked_blocked = False
+        if path is None:
+            self._tracked = None
+            return
+
+        tiles = path.tiles
+        tracked = set((tiles[:, 0] * self.height + tiles[:, 1]).tolist())
+        # diagonal moves also need both tiles next to them to be free
+        for (x0, y0), (x1, y1) in zip(tiles[:-1].tolist(), tiles[1:].tolist()):
+            if x0 != x1 and y0 != y1:
+                tracked.add(x1 * self.height + y0)
+                tracked.add(x0 * self.height + y1)
+        self._tracked = tracked
+
+    def is_path_blocked(self) -> bool:
+        """ Whether the path given to `track_path` might no longer be walkable (it's still the shortest if it is) """
+        if self._tracked is None or self._grid_key != (self._map.revision, self.fog, self.fog.revision):
+            # not watching anything, or things changed without us seeing what
+            return True
+        return self._tracked_blocked
+
+    def is_path_pending(self) -> bool:
+        """ Whether the last path from `find_path` is only part of the way, because the search ran out of budget """
+        return self._request is not None
+
+    def is_on_path(self, location: Tuple[float, float], path: 'pathfinding.Path') -> bool:
+        """ Whether `location` is on the first tile of `path`, or one (allowed) move away from it """
+        x, y = int(location[0]), int(location[1])
+        if not path or not self._map.in_bounds(x, y):
+            return False
+        dx, dy = int(path.tiles[0, 0]) - x, int(path.tiles[0, 1]) - y
+        if dx == 0 and dy == 0:
+            return True
+        if (dx, dy) not in pathfinding.GridAStar.MOVES:
+            return False
+        return bool(self._grid()[x, y] & (1 << pathfinding.GridAStar.MOVES.index((dx, dy))))
+
+    # planners to keep around for `find_path(incremental=True)`, and flow fields for `flow_field(fog=True)`
+    PLANNERS = 4
+
+    def flow_field(self, target: Tuple[float, float], fog: bool = False) -> pathfinding.FlowField:
+        """
+        The distance to the tile of `target` from every tile and the way to get there, worked out once and cached
+        `fog`: whether to only avoid the walls this view knows about, otherwise it uses the full map
+               and the field is shared by all agents on the map
+        """
+        x, y = int(target[0]), int(target[1])
+        goal = x * self.height + y
+        if not fog:
+            revision, field = self._map.flow_fields.get((x, y), (None, None))
+            if revision != self._map.revision:
+                passable = ~np.asarray(self._map.walls, dtype=bool)
+                field = pathfinding.FlowField(pathfinding.GridAStar.moves(passable), goal)
+                self._map.flow_fields[x, y] = (self._map.revision, field)
+            return field
+
+        moves = self._grid()
+        revision, field = self._flow_fields.pop(goal, (None, None))
+        if revision != self.passability_revision:
+            field = pathfinding.FlowField(moves, goal)
+        self._flow_fields[goal] = (self.passability_revision, field)
+        while len(self._flow_fields) > self.PLANNERS:
+            self._flow_fields.popitem(last=False)
+        return field
+
+    def next_waypoint(self, location: Tuple[float, float], target: Tuple[float, float],
+                      fog: bool = False) -> Optional[vmath.Vector2]:
+        """
+        The center of the next tile to go to from `location` to get to `target` (see `flow_field`),
+        `None` if it can't be reached
+        """
+        x, y = int(location[0]), int(location[1])
+        if not self._map.in_bounds(x, y):
+            return None
+        next_tile = int(self.flow_field(target, fog).next[x * self.height + y])
+        if next_tile < 0:
+            return None
+        x, y = divmod(next_tile, self.height)
+        return vmath.Vector2(x + 0.5, y + 0.5)
+
+    def distance(self, a: Tuple[float, float], b: Tuple[float, float]) -> float:
+        """
+        Walking distance between the tiles of `a` and `b` over the full map (ignoring fog), `inf` if there's no way,
+        looked up in the map's distance table if it has one, otherwise it's searched for
+        """
+        x0, y0, x, y = int(a[0]), int(a[1]), int(b[0]), int(b[1])
+        table = self._map.distances
+        if table is not None and table.covers(x0, y0) and table.covers(x, y):
+            return table.distance(x0, y0, x, y)
+        if not (self._map.in_bounds(x0, y0) and self._map.in_bounds(x, y)):
+            return math.inf
+        if (x0, y0) == (x, y):
+            return 0.0
+
+        if self._search is None:
+            self._search = pathfinding.GridAStar(*self.size)
+        moves = pathfinding.GridAStar.moves(~np.asarray(self._map.walls, dtype=bool))
+        path = self._search.search(moves, x0 * self.height + y0, x * self.height + y)
+        if path is None:
+            return math.inf
+        xs, ys = np.divmod(path, self.height)
+        diagonal = (np.diff(xs) != 0) & (np.diff(ys) != 0)
+        return float(np.count_nonzero(~diagonal) + 2**0.5 * np.count_nonzero(diagonal))
+
+    def path_key(self, from_node: Tuple[float, float], to_node: Tuple[float, float],
+                 incremental: bool = False, backend: Optional[pathfinding.SearchBackend] = None) -> Optional[Tuple]:
+        """
+        Everything the result of `find_path` with the same arguments depends on, as long as the key stays the same
+        it will give the same path. `None` for searches that can give different results every time
+        (the incremental planners and searches that are spread out)
+        """
+        if incremental or self.path_budget is not None or self.path_time_budget is not None:
+            return None
+        self._grid()
+        costs = self._costs()
+        return ((int(from_node[0]), int(from_node[1])), (int(to_node[0]), int(to_node[1])), self.passability_revision,
+                backend or self.path_backend, None if costs is None else self.cost_layers.revision)
+
+    def find_path(self, from_node: Tuple[float, float], to_node: Tuple[float, float],
+                  incremental: bool = False,
+                  backend: Optional[pathfinding.SearchBackend] = None) -> Optional['pathfinding.Path']:
+        """
+        `backend`: how to search for the path, defaults to `path_backend`,
+                   with a `path_budget` or `path_time_budget` A* might only return the best part of the path so far,
+                   and when the `cost_layers` aren't all 1 it's always A*, as that's the only search that uses them
+        `incremental`: use a planner that's kept around for this goal and only repairs its search when walls are
+                       revealed, much faster when planning towards the same goal over and over
+                       (the path is just as short, but might take a different route than the normal search)
+        Paths between the same tiles are reused until a tile becomes impassable (see `passability_revision`),
+        the returned paths are shared so they can't be changed.
+        """
+        key = self.path_key(from_node, to_node, incremental, backend)
+        if key is None:
+            return self._find_path(from_node, to_node, incremental, backend)
+
+        if key in self._path_cache:
+            self.path_cache_hits += 1
+            self._path_cache.move_to_end(key)
+            return self._path_cache[key]
+
+        self.path_cache_misses += 1
+        path = self._find_path(from_node, to_node, incremental, backend)
+        if path is not None:
+            path.points.setflags(write=False)
+        self._path_cache[key] = path
+        while len(self._path_cache) > self.path_cache_size:
+            self._path_cache.popitem(last=False)
+        return path
+
+    def _find_path(self, from_node: Tuple[float, float], to_node: Tuple[float, float],
+                   incremental: bool,
+                   backend: Optional[pathfinding.SearchBackend]) -> Optional['pathfinding.Path']:
         def heuristic(from_node, to_node):
             (x0, y0) = from_node
             (x1, y1) = to_node
@@ -233,9 +850,9 @@ class MapView(pathfinding.Graph):
         to_node = (int(to_node[0]), int(to_node[1]))
 
         def pathify(path):
-            if not path:
+            if path is None or len(path) == 0:
                 return None
-            return list(map(lambda node: vmath.Vector2(node[0] + 0.5, node[1] + 0.5), path))
+            return pathfinding.Path(np.array(path, dtype=float) + 0.5)
 
         # already at target location
         if from_node == to_node:
@@ -256,11 +873,55 @@ class MapView(pathfinding.Graph):
                 # else we just return no path and skip the A* search
                 return pathify(None)
 
-        came_from, cost_so_far = pathfinding.a_star_search(self, from_node, to_node, heuristic)
-        path = pathfinding.reconstruct_path(came_from, from_node, to_node)
+        costs = self._costs()
+        if not self._map.in_bounds(*from_node):
+            # the grid search only knows about tiles on the map
+            came_from, cost_so_far = pathfinding.a_star_search(self, from_node, to_node, heuristic)
+            path = pathfinding.reconstruct_path(came_from, from_node, to_node)
+            return pathify(path)
+
+        moves = self._grid()
+        start, goal = from_node[0] * self.height + from_node[1], to_node[0] * self.height + to_node[1]
+        if costs is not None:
+            # only plain A* knows about costs
+            if self._search is None:
+                self._search = pathfinding.GridAStar(*self.size)
+            path = self._search.search(moves, start, goal, costs)
+        elif incremental:
+            planner = self._planners.pop(goal, None) or pathfinding.DStarLite(self.width, self.height, goal)
+            self._planners[goal] = planner
+            while len(self._planners) > self.PLANNERS:
+                self._planners.popitem(last=False)
+            path = planner.path(moves, start)
+        elif (backend or self.path_backend) == pathfinding.SearchBackend.JUMP_POINT:
+            if self._jump_points is None:
+                self._jump_points = pathfinding.JumpPointSearch(self._passable)
+            path = self._jump_points.search(from_node, to_node)
+            return pathify(path)
+        elif (backend or self.path_backend) == pathfinding.SearchBackend.FLOW_FIELD:
+            path = self.flow_field(to_node, fog=True).path(start)
+        elif (backend or self.path_backend) == pathfinding.SearchBackend.HIERARCHICAL:
+            if self._hierarchy is None:
+                self._hierarchy = pathfinding.HPAStar(self._passable, self._moves)
+            path = self._hierarchy.search(start, goal)
+        elif self.path_budget is not None or self.path_time_budget is not None:
+            # carry on with the search from last time, unless it's for somewhere else or walls turned up in it
+            request = self._request
+            if request is None or request.goal != goal or request.invalid:
+                request = self._request = pathfinding.AnytimeAStar(moves, start, goal)
+            request.run(self.path_budget, self.path_time_budget)
+            path = request.path()
+            if request.done:
+                self._request = None
+                # we might have moved along the partial paths since the search started
+                if path is not None and start in path:
+                    path = path[np.flatnonzero(path == start)[0]:]
+        else:
+            if self._search is None:
+                self._search = pathfinding.GridAStar(*self.size)
+            path = self._search.search(moves, start, goal)
         # map the path from tile coordinates to agent coordinates
-
-        return pathify(path)
+        return pathify(None if path is None else np.stack(np.divmod(path, self.height), axis=1))
 
     # vvvv copy methods from map.Map vvvv
 
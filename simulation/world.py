@@ -8,7 +8,14 @@ import json_tricks as jt
 
 import simulation.logger
 import simulation.vision
+import simulation.pathfinding
 from .environment import Map
+from .sightlines import SightLines
+from .distances import DistanceTable
+from .collision import WallField, AgentSeparation
+from .perception import Perception
+from .rules import CaptureRule
+from .noise import NoiseBuffer
 from .agent import Agent, AgentID, GuardAgent, IntruderAgent
 from .util import Position
 
@@ -22,6 +29,14 @@ class World:
     TICK_RATE = 20
     # time elapsed for each call to `on_tick`
     TIME_PER_TICK = 1.0 / TICK_RATE
+    # how many seconds noise events are kept around for (and drawn)
+    NOISE_LIFETIME = 2.0
+    # agents moving faster than NOISE_SPEEDS[i - 1] (up to and including NOISE_SPEEDS[i]) make noise with radius
+    # NOISE_RADII[i]
+    NOISE_SPEEDS = np.array([0, 0.5, 1, 2])
+    NOISE_RADII = np.array([0, 1 / 2, 3 / 2, 5 / 2, 10 / 2])
+    # and the environment makes noise with this radius
+    AMBIENT_NOISE_RADIUS = 5 / 2
 
     # for generating agent ID's
     next_agent_ID: AgentID = 1
@@ -29,14 +44,40 @@ class World:
     def __init__(self, map: Map):
         self.map: Map = map
         self.agents: Dict[AgentID, Agent] = dict()
-
-        self.noises: List['NoiseEvent'] = []
-        # to keep track of past noise events
-        self.old_noises: List['NoiseEvent'] = []
+        # the same agents by role, kept up to date by `add_agent` and `clear_agents`
+        self._guards: Dict[AgentID, GuardAgent] = dict()
+        self._intruders: Dict[AgentID, IntruderAgent] = dict()
+        # intruders that haven't been captured yet
+        self._uncaptured: Dict[AgentID, IntruderAgent] = dict()
+        # finds the guards close enough to capture an intruder
+        self.capture_rule = CaptureRule()
+
+        # the noise events of the last few seconds
+        self.noises = NoiseBuffer(lifetime=int(round(self.NOISE_LIFETIME * self.TICK_RATE)))
+        # the events before this number have already been heard (or not) by the agents
+        self._noises_heard = 0
+
+        # for all the random decisions the world makes itself, seeded from `random` so seeding that is enough
+        self.rng = np.random.default_rng(random.getrandbits(64))
 
         # to keep track of how many ticks have passed:
         self.time_ticks = 0
 
+        # how agents work out what they can see
+        self.vision_backend = simulation.vision.VisionBackend.RAYCAST
+        # and how they search for paths
+        self.path_backend = simulation.pathfinding.SearchBackend.ASTAR
+        # limits on how many tiles and/or seconds a search gets per tick, so long searches are spread out
+        self.path_budget = None
+        self.path_time_budget = None
+        # works out which agents can see each other
+        self.perception = Perception()
+        # whether or not walls stop agents from seeing each other
+        self.sighting_occlusion = False
+        # whether or not agents bump into each other (walls always stop them)
+        self.agent_collision = False
+        self.separation = AgentSeparation()
+
         # bit hacky, but eh
         # reset agent ID counter
         World.next_agent_ID = 1
@@ -67,12 +108,22 @@ class World:
             self.save_agents(name)
 
     @classmethod
-    def load_map(cls, name) -> 'World':
+    def load_map(cls, name, sightlines=False, distances=False, workers=None) -> 'World':
+        """
+        `sightlines`: precompute the line-of-sight table for the map, optionally using `workers` processes
+        `distances`: load the table of walking distances between all tiles, building it first if it's not on disk yet,
+                     maps that are too big for one (see `DistanceTable.MAX_TILES`) don't get one,
+                     their distances are searched for when needed instead
+        """
         filename = f'saves/{name}.map.json'
         with open(filename, mode='r') as file:
             data = jt.load(file)
 
         m = Map.from_dict(data['map'])
+        if sightlines:
+            m.sightlines = SightLines.for_map(m, workers=workers)
+        if distances:
+            m.distances = DistanceTable.for_map(m, workers=workers)
         return World(m)
 
     def load_agents(self, name) -> None:
@@ -89,140 +140,122 @@ class World:
             self.add_agent(agent_class)
 
     @classmethod
-    def from_file(cls, name, load_agents=True) -> 'World':
-        world = cls.load_map(name)
+    def from_file(cls, name, load_agents=True, sightlines=False, distances=False, workers=None) -> 'World':
+        world = cls.load_map(name, sightlines=sightlines, distances=distances, workers=workers)
         if load_agents:
             world.load_agents(name)
         return world
     
     def clear_agents(self):
         self.agents: Dict[AgentID, Agent] = dict()
-        
+        self._guards = dict()
+        self._intruders = dict()
+        self._uncaptured = dict()
+        self.capture_rule.clear()
+
     def add_agent(self, agent_type):
         agent = agent_type()
         self.agents[agent.ID] = agent
+        if isinstance(agent, GuardAgent):
+            self._guards[agent.ID] = agent
+        if isinstance(agent, IntruderAgent):
+            self._intruders[agent.ID] = agent
+            if not agent.is_captured:
+                self._uncaptured[agent.ID] = agent
 
     def add_noise(self, noise: 'NoiseEvent'):
         noise.time = self.time_ticks
-        self.noises.append(noise)
+        source = noise.source.ID if noise.source is not None else 0
+        self.noises.add(noise.location.x, noise.location.y, noise.radius, noise.time, source)
+
+    def _perceive_noises(self) -> Dict[AgentID, List['PerceivedNoise']]:
+        """
+        Works out which agents hear the noises made since the last time this was called, all at once
+        return: The noises heard by every agent that heard any
+        """
+        IDs = list(self.agents)
+        agents, rows = self.noises.perceive(self.perception.x, self.perception.y, np.array(IDs, dtype=np.int64),
+                                            since=self._noises_heard)
+        self._noises_heard = self.noises.total
+
+        perceived = {}
+        for i, row in zip(agents.tolist(), rows.tolist()):
+            source = self.agents.get(int(self.noises.source[row]))
+            noise = NoiseEvent(Position(self.noises.x[row], self.noises.y[row]), source, self.noises.radius[row])
+            noise.time = int(self.noises.time[row])
+            perceived.setdefault(IDs[i], []).append(PerceivedNoise(noise, self.agents[IDs[i]]))
+        return perceived
 
     @property
-    def guards(self):
-        return {ID: agent for ID, agent in self.agents.items() if isinstance(agent, GuardAgent)}
+    def guards(self) -> Dict[AgentID, GuardAgent]:
+        return self._guards
 
     @property
-    def intruders(self):
-        return {ID: agent for ID, agent in self.agents.items() if isinstance(agent, IntruderAgent)}
+    def intruders(self) -> Dict[AgentID, IntruderAgent]:
+        return self._intruders
 
     def transmit_message(self, message):
         self.agents[message.target]._message_queue_in.append(message)
 
     def _collision_check(self):
-        def collision_point(x, y):
-            x, y = int(math.floor(x)), int(math.floor(y))
-            if self.map.is_wall(x, y):
-                return vmath.Vector2(x, y) + (0.5, 0.5)
-            else:
-                return None
-
-        def circle_collision(x, y, r=0.5):
-            x, y = int(math.floor(x)), int(math.floor(y))
-            if self.map.is_wall(x, y):
-                center = vmath.Vector2(x, y) + (0.5, 0.5)
-                if (agent.location - center).length < (r + width / 2):
-                    return center + (agent.location - center).as_length(r + width / 2)
-
-        for ID, agent in self.agents.items():
-            # do a quick bounds check first so they stay on the map
-            if agent.location.x < 0:
-                agent.location.x = 0
-            if agent.location.y < 0:
-                agent.location.y = 0
-            if agent.location.x >= self.map.width:
-                agent.location.x = self.map.width - 0.01
-            if agent.location.y >= self.map.height:
-                agent.location.y = self.map.height - 0.01
-
-            # get some values we'll need
-            width = agent._width
-            x = agent.location.x
-            y = agent.location.y
-
-            # offset vector for collision resolution
-            push = vmath.Vector2(0, 0)
-
-            # left
-            collision = collision_point(x - width / 2, y)
-            if collision is not None:
-                push.x += collision.x + (0.5 + width / 2) - agent.location.x
-                agent._has_collided |= True
-            # right
-            collision = collision_point(x + width / 2, y)
-            if collision is not None:
-                push.x += collision.x - (0.5 + width / 2) - agent.location.x
-                agent._has_collided |= True
-            # bottom
-            collision = collision_point(x, y - width / 2)
-            if collision is not None:
-                push.y += collision.y + (0.5 + width / 2) - agent.location.y
-                agent._has_collided |= True
-            # top
-            collision = collision_point(x, y + width / 2)
-            if collision is not None:
-                push.y += collision.y - (0.5 + width / 2) - agent.location.y
-                agent._has_collided |= True
-
-            # and apply resolution vector
-            agent.location += push
-
-            collision = circle_collision(x - width / 2, y - width / 2)
-            if collision is not None:
-                agent.location.x = collision.x
-                agent.location.y = collision.y
-                agent._has_collided |= True
-
-            collision = circle_collision(x - width / 2, y + width / 2)
-            if collision is not None:
-                agent.location.x = collision.x
-                agent.location.y = collision.y
-                agent._has_collided |= True
-
-            collision = circle_collision(x + width / 2, y - width / 2)
-            if collision is not None:
-                agent.location.x = collision.x
-                agent.location.y = collision.y
-                agent._has_collided |= True
-
-            collision = circle_collision(x + width / 2, y + width / 2)
-            if collision is not None:
-                agent.location.x = collision.x
-                agent.location.y = collision.y
-                agent._has_collided |= True
+        """
+        Keeps the agents on the map and pushes them out of any walls they've walked into, all at once.
+        Uses the signed distance field of the walls, so agents are pushed straight away from the closest wall
+        until they're half their width away from it. Walls are treated as the squares they are,
+        also at their corners, and any overlap is resolved in a single push per agent (or a few in a corner).
+
+        With `agent_collision` on, agents on the same team are pushed apart first as well.
+        Guards and intruders can still overlap, otherwise guards could never get close enough to capture,
+        and captured agents and agents in a tower don't bump into anything.
+        """
+        if not self.agents:
+            return
+        agents = list(self.agents.values())
+        x = np.array([agent.location.x for agent in agents])
+        y = np.array([agent.location.y for agent in agents])
+        radius = np.array([agent._width / 2 for agent in agents])
+
+        # do a quick bounds check first so they stay on the map
+        x = np.where(x < 0, 0, np.where(x >= self.map.width, self.map.width - 0.01, x))
+        y = np.where(y < 0, 0, np.where(y >= self.map.height, self.map.height - 0.01, y))
+
+        collided = np.zeros(len(agents), dtype=bool)
+        if self.agent_collision:
+            groups = np.array([-1 if agent.is_captured or agent._in_tower else
+                               0 if isinstance(agent, GuardAgent) else 1 for agent in agents])
+            x, y, collided = self.separation.resolve(x, y, radius, groups)
+
+        # walls go last, they're the one thing agents can never end up in
+        x, y, hit_wall = WallField.for_map(self.map).resolve(x, y, radius)
+        collided |= hit_wall
+        for agent, new_x, new_y, hit in zip(agents, x.tolist(), y.tolist(), collided.tolist()):
+            agent.location.x = new_x
+            agent.location.y = new_y
+            agent._has_collided |= hit
 
     def _capture_check(self) -> bool:
         """
         return: Whether or not all the intruders have been captured
         """
-        # see if any intruders will be captured now
-        for ID_intruder, intruder in self.intruders.items():
-            for ID_guard, guard in self.guards.items():
-                guard_x, guard_y = int(guard.location.x), int(guard.location.y)
-                intruder_x, intruder_y = int(intruder.location.x), int(intruder.location.y)
+        # see if any intruders will be captured now, only guards right next to an intruder can capture it,
+        # this includes intruders that were captured already so they're held in place while a guard is there
+        for intruder, guard in self.capture_rule.captures(self._guards, self._intruders):
+            intruder.on_captured()
 
-                if (intruder.location - guard.location).length <= 0.5 and \
-                        guard.map._is_tile_visible_from(guard_x, guard_y, intruder_x, intruder_y):
-                    intruder.on_captured()
-
-        # check if all intruders are captured
-        return all((intruder.is_captured for ID, intruder in self.intruders.items()))
+        # check if all intruders are captured, only the ones that weren't yet can have changed
+        self._uncaptured = {ID: intruder for ID, intruder in self._uncaptured.items() if not intruder.is_captured}
+        return not self._uncaptured
 
     def _target_check(self) -> bool:
         """
         return: Whether or not all of the intruders have reached the target
         """
+        reached = False
         # see if any intruders will reach the target now
-        for ID_intruder, intruder in self.intruders.items():
-            if (intruder.location - intruder.target).length < 2: 
+        for ID_intruder, intruder in self._intruders.items():
+            target = intruder.target
+            dx, dy = intruder.location.x - target.x, intruder.location.y - target.y
+            if dx * dx + dy * dy < 2 * 2:
                 if intruder.ticks_in_target == 0.0:
                     if (intruder.ticks_since_target * self.TIME_PER_TICK) >= 3.0 or \
                             intruder.times_visited_target == 0.0:
@@ -232,13 +265,12 @@ class World:
 
                 intruder.ticks_in_target += 1.0
 
-            else:
-                if intruder.ticks_in_target > 0.0:
-                    intruder.ticks_since_target += 1.0
-                    intruder.ticks_in_target = 0.0
+            elif intruder.ticks_in_target > 0.0:
+                intruder.ticks_since_target += 1.0
+                intruder.ticks_in_target = 0.0
 
-                elif intruder.ticks_since_target > 0.0:
-                    intruder.ticks_since_target += 1.0
+            elif intruder.ticks_since_target > 0.0:
+                intruder.ticks_since_target += 1.0
 
             # win type 1: the intruder has been in the target area for 3 seconds
             if (intruder.ticks_in_target * self.TIME_PER_TICK) >= 3.0:
@@ -248,8 +280,10 @@ class World:
             elif intruder.times_visited_target >= 2.0:
                 intruder.on_reached_target()
 
-        # check if any intruders has reached the target
-        return any((intruder.reached_target for ID, intruder in self.intruders.items()))
+            # check if any intruders has reached the target
+            reached |= intruder.reached_target
+
+        return reached
 
     def setup(self):
         patrolling_areas = self.create_patrolling_areas()
@@ -295,38 +329,36 @@ class World:
         Execute one tick / frame
         return: Whether or not the simulation is finished
         """
-        # reset noise list
-        self.old_noises.extend(self.noises)
-        self.noises = []
-        # emit random noise
-        self.emit_random_noise()
+        # forget about old noise
+        self.noises.expire(self.time_ticks)
+
+        # update the vision of every agent that needs it in one go
+        vision_requests = {}
+        for ID, agent in self.agents.items():
+            agent._update_tower_interaction()
+            vision_requests[ID] = agent._vision_request(force=(self.time_ticks == 0))
+        simulation.vision.reveal_visible_batch([(self.agents[ID].map, request)
+                                                for ID, request in vision_requests.items() if request is not None])
 
         # find all events for every agent and then run the agent code
+        self.perception.rebuild(self.agents)
+        # everyone hears the noises made since last tick at the same time
+        noises = self._perceive_noises()
         for ID, agent in self.agents.items():
             # check if we can see any other agents
-            visible_agents = []
-            for other_ID, other_agent in self.agents.items():
-                if other_ID == ID:
-                    continue
-                d = other_agent.location - agent.location
-                angle_diff = abs((-math.degrees(math.atan2(d.y, d.x)) + 90 - agent.heading + 180) % 360 - 180)
-
-#                if (d.length < other_agent.visibility_range and
-                if ((d.length <= agent.view_range and d.length <= other_agent.visibility_range and
-                   angle_diff <= agent.view_angle) or d.length <= 1.0) and not other_agent.is_captured:
-                    # create a new `AgentView` event
-                    visible_agents.append(simulation.vision.AgentView(other_agent))
-
-            perceived_noises = []
-            for noise in self.noises:
-                distance = (noise.location - agent.location).length
-                if distance < noise.radius and noise.source != agent:
-                    perceived_noises.append(PerceivedNoise(noise, agent))
+            visible_agents = self.perception.perceive(ID, occlusion=self.sighting_occlusion)
+
+            perceived_noises = noises.get(ID, [])
             if perceived_noises:
                 agent.log("perceived noises at", [noise.perceived_angle for noise in perceived_noises])
 
             # and run the agent code
-            agent.tick(seen_agents=visible_agents, noises=perceived_noises)
+            agent.tick(seen_agents=visible_agents, noises=perceived_noises,
+                       vision_updated=vision_requests[ID] is not None)
+            # the agent might have moved, so the next agents have to see where it is now
+            self.perception.update(ID)
+        # the agents and the environment make some noise, heard next tick
+        self.emit_noise()
         self._collision_check()
 
         all_captured = self._capture_check()
@@ -353,20 +385,41 @@ class World:
         # keep going...
         return False
 
-    def emit_random_noise(self):
+    def emit_noise(self):
+        """
+        Every agent, and the environment at a random tile, has the same chance of making a noise every tick.
+        The decisions for all of them are drawn at once, and the noise an agent makes is louder
+        the faster it's moving (see `NOISE_SPEEDS`)
+        """
         # Rate parameter for one 25m^2 is 0.1 per minute -> divide by 60 to get the events per second
         # Scale up the rate parameter to map size 6*(map_size/25)*2=64 (amount of 25m^2 squares in the map)
         # I know, that the map size should be dynamic
         event_rate = 0.1
         random_events_per_second = (event_rate / 60) * (self.map.size[0] * self.map.size[1] / 25)
         chance_to_emit = random_events_per_second * self.TIME_PER_TICK
-        if random.uniform(0, 1) < chance_to_emit:
-            # emit an event here
-            x = random.randint(0, self.map.size[0] - 1)
-            y = random.randint(0, self.map.size[1] - 1)
 
-            noise_event = NoiseEvent(Position(x, y))
-            self.add_noise(noise_event)
+        agents = list(self.agents.values())
+        # the last one is the environment
+        emit = self.rng.random(len(agents) + 1) < chance_to_emit
+        if not emit.any():
+            return
+
+        if emit[-1]:
+            # emit an event here
+            x = self.rng.integers(0, self.map.size[0])
+            y = self.rng.integers(0, self.map.size[1])
+            self.noises.add(x, y, self.AMBIENT_NOISE_RADIUS, self.time_ticks)
+
+        emitting = [agent for agent, e in zip(agents, emit[:-1].tolist()) if e]
+        if emitting:
+            speed = np.array([agent.move_speed for agent in emitting], dtype=float)
+            radius = self.NOISE_RADII[np.searchsorted(self.NOISE_SPEEDS, speed, side='left')]
+            # standing still doesn't make a sound anyone could hear
+            loud = radius > 0
+            self.noises.extend(np.array([agent.location.x for agent in emitting])[loud],
+                               np.array([agent.location.y for agent in emitting])[loud],
+                               radius[loud], self.time_ticks,
+                               np.array([agent.ID for agent in emitting], dtype=np.int64)[loud])
 
 
 class MarkerType(Enum):
@@ -409,13 +462,20 @@ class PerceivedNoise:
     def __init__(self, noise: NoiseEvent, observer: Agent):
         self._noise = noise
         self._observer = observer
+        self._perceived_angle = None
 
     @property
     def perceived_angle(self):
         """
         Calculates the perceived angle towards the noise from the perspective of the `target_pos`
-        This also adds the uncertainty as described in the booklet
+        This also adds the uncertainty as described in the booklet, it's only worked out once
+        so the angle doesn't change every time it's looked at
         """
+        if self._perceived_angle is None:
+            self._perceived_angle = self._angle()
+        return self._perceived_angle
+
+    def _angle(self):
 
         diff = self._noise.location - self._observer.location
         if diff.length > 1e-5:
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from simulation.collision import WallField, AgentSeparation
+from simulation.environment import Map
+
+
+def block_map():
+    # a 6x6 block of walls in the middle of an open 12x12 map
+    walls = np.zeros((12, 12), dtype=bool)
+    walls[3:9, 3:9] = True
+    return walls
+
+
+def test_distance_is_signed_and_finite_everywhere():
+    field = WallField(block_map())
+    xs, ys = np.meshgrid(np.linspace(0, 12, 49), np.linspace(0, 12, 49))
+    distance = field.distance_at(xs.reshape(-1), ys.reshape(-1))
+    assert np.isfinite(distance).all()
+    assert field.distance_at(np.array([6.0]), np.array([6.0]))[0] == pytest.approx(-3)
+    assert field.distance_at(np.array([1.0]), np.array([6.0]))[0] == pytest.approx(1)
+
+
+def test_agent_deep_inside_a_wall_block_is_pushed_out():
+    field = WallField(block_map())
+    x, y, collided = field.resolve(np.array([6.0, 5.5]), np.array([6.0, 4.0]), 0.45)
+    assert collided.all()
+    assert (field.distance_at(x, y) >= 0.45 - 1e-6).all()
+
+
+def test_agent_overlapping_a_wall_ends_up_touching_it():
+    field = WallField(block_map())
+    x, y, collided = field.resolve(np.array([2.8]), np.array([6.0]), 0.45)
+    assert collided[0]
+    assert (x[0], y[0]) == pytest.approx((2.55, 6.0))
+
+
+def test_agent_in_the_open_is_left_alone():
+    field = WallField(block_map())
+    x, y, collided = field.resolve(np.array([1.5]), np.array([1.5]), 0.45)
+    assert not collided[0]
+    assert (x[0], y[0]) == (1.5, 1.5)
+
+
+def test_outside_the_map_counts_as_wall():
+    field = WallField(np.zeros((5, 5), dtype=bool))
+    x, y, collided = field.resolve(np.array([0.1]), np.array([2.5]), 0.45)
+    assert collided[0]
+    assert x[0] == pytest.approx(0.45)
+
+
+
+def distance_to_walls(walls, x, y):
+    """ Distance from (x, y) to the closest wall square, looking at every wall and the edges of the map """
+    width, height = walls.shape
+    distance = min(x, y, width - x, height - y)
+    for wx, wy in np.argwhere(walls):
+        distance = min(distance, np.hypot(x - np.clip(x, wx, wx + 1), y - np.clip(y, wy, wy + 1)))
+    return distance
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_distance_near_walls_matches_every_wall(seed):
+    rng = np.random.default_rng(seed)
+    walls = rng.random((15, 12)) < 0.2
+    field = WallField(walls)
+    x, y = rng.uniform(0, 15, 200), rng.uniform(0, 12, 200)
+    open_ = ~walls[x.astype(int), y.astype(int)]
+    x, y = x[open_], y[open_]
+    distance = field.distance_at(x, y)
+    for i in range(len(x)):
+        expected = distance_to_walls(walls, x[i], y[i])
+        # only walls within range are looked at
+        if expected <= WallField.RANGE:
+            assert distance[i] == pytest.approx(expected), (x[i], y[i])
+        else:
+            assert distance[i] > WallField.RANGE
+
+
+def test_field_is_made_again_when_the_map_changes():
+    m = Map((10, 10))
+    field = WallField.for_map(m)
+    assert WallField.for_map(m) is field
+    m.set_wall(5, 5)
+    assert WallField.for_map(m) is not field
+    assert WallField.for_map(m).distance_at(5.5, 5.5)[0] < 0
+
+
+def pairs_one_by_one(x, y, radius, groups):
+    """ Every pair of agents in the same group that overlap, looking at all the pairs """
+    return {(i, j) for i in range(len(x)) for j in range(i + 1, len(x))
+            if groups[i] >= 0 and groups[i] == groups[j] and np.hypot(x[i] - x[j], y[i] - y[j]) < radius[i] + radius[j]}
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_separation_finds_every_overlapping_pair(seed):
+    rng = np.random.default_rng(seed)
+    x, y = rng.uniform(0, 10, 60), rng.uniform(0, 10, 60)
+    radius, groups = rng.uniform(0.2, 0.6, 60), rng.integers(-1, 2, 60)
+    first, second = AgentSeparation().pairs(x, y, radius, groups)
+    found = {(min(i, j), max(i, j)) for i, j in zip(first, second)}
+    assert len(found) == len(first)
+    assert pairs_one_by_one(x, y, radius, groups) <= found
+
+
+def test_separation_pushes_overlapping_agents_apart():
+    x, y, collided = AgentSeparation().resolve(np.array([1.0, 1.5, 5.0]), np.array([2.0, 2.0, 5.0]),
+                                               0.45, np.array([0, 0, 0]))
+    assert list(collided) == [True, True, False]
+    assert (x[0], x[1], x[2]) == pytest.approx((0.8, 1.7, 5.0))
+    assert list(y) == [2.0, 2.0, 5.0]
+
+
+def test_separation_only_within_a_group():
+    x, y, collided = AgentSeparation().resolve(np.array([1.0, 1.2, 1.4]), np.array([1.0, 1.0, 1.0]),
+                                               0.45, np.array([0, 1, -1]))
+    assert not collided.any()
+    assert list(x) == [1.0, 1.2, 1.4]
+
+
+def test_agents_on_top_of_each_other_are_pushed_apart_along_x():
+    x, y, collided = AgentSeparation().resolve(np.array([3.0, 3.0]), np.array([3.0, 3.0]), 0.5, np.array([0, 0]))
+    assert collided.all()
+    assert (x[0], x[1]) == pytest.approx((2.5, 3.5))
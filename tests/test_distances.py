@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from simulation.distances import DistanceTable
+from simulation.environment import Map
+from simulation.pathfinding import FlowField, GridAStar
+
+
+def random_map(seed, size=(20, 15)):
+    rng = np.random.default_rng(seed)
+    m = Map(size)
+    m.walls = rng.random(size) < 0.3
+    return m, rng
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_table_matches_flow_fields(seed, tmp_path):
+    m, rng = random_map(seed)
+    table = DistanceTable.for_map(m, directory=str(tmp_path))
+    moves = GridAStar.moves(~m.walls)
+    height = m.height
+
+    for gx, gy in table.tiles[rng.choice(len(table.tiles), 5)]:
+        field = FlowField(moves, gx * height + gy)
+        for x, y in table.tiles:
+            expected = field.distance[x * height + y]
+            if expected == np.inf:
+                assert table.distance(x, y, gx, gy) == np.inf
+                assert table.next_tile(x, y, gx, gy) is None
+                continue
+            # distances are stored in steps of 1 / SCALE
+            assert table.distance(x, y, gx, gy) == pytest.approx(expected, abs=0.5 / DistanceTable.SCALE)
+
+            # following the next tiles gets to the goal along a shortest path
+            walked, (px, py) = 0.0, (x, y)
+            while (px, py) != (gx, gy):
+                nx, ny = table.next_tile(px, py, gx, gy)
+                assert moves[px, py] & (1 << GridAStar.MOVES.index((nx - px, ny - py)))
+                walked += 2**0.5 if nx != px and ny != py else 1
+                px, py = nx, ny
+            assert walked == pytest.approx(expected)
+
+
+def test_table_is_loaded_from_disk_the_second_time(tmp_path, monkeypatch):
+    m, rng = random_map(3)
+    table = DistanceTable.for_map(m, directory=str(tmp_path))
+    assert DistanceTable.for_map(m, directory=str(tmp_path)) is table
+
+    monkeypatch.setattr(DistanceTable, '_cache', {})
+    monkeypatch.setattr(DistanceTable, '_build', lambda *args: pytest.fail('table was built again'))
+    loaded = DistanceTable.for_map(m, directory=str(tmp_path))
+    assert loaded is not table
+    assert (np.asarray(loaded._distance) == np.asarray(table._distance)).all()
+    assert (np.asarray(loaded._next) == np.asarray(table._next)).all()
+
+
+def test_no_table_for_maps_with_too_many_tiles(tmp_path, monkeypatch):
+    m, rng = random_map(4)
+    monkeypatch.setattr(DistanceTable, 'MAX_TILES', np.count_nonzero(~m.walls) - 1)
+    assert DistanceTable.for_map(m, directory=str(tmp_path)) is None
+
+
+def test_only_passable_tiles_are_covered(tmp_path):
+    m, rng = random_map(5)
+    table = DistanceTable.for_map(m, directory=str(tmp_path))
+    x, y = np.argwhere(m.walls)[0]
+    assert not table.covers(x, y)
+    assert not table.covers(-1, 0)
+    assert table.covers(*table.tiles[0])
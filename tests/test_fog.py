@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from simulation.fog import FogOfWar
+
+
+def random_fog(rng, size, windows=6):
+    """ A fog with a few random windows revealed, along with the same thing as a plain array """
+    fog = FogOfWar(size)
+    dense = np.zeros(size, dtype=bool)
+    for _ in range(windows):
+        x_lo, y_lo = rng.integers(-10, size[0]), rng.integers(-10, size[1])
+        visible = rng.random((rng.integers(1, 40), rng.integers(1, 40))) < 0.5
+        newly = fog.reveal(x_lo, y_lo, visible)
+
+        # the part of the window that's on the map
+        x0, y0 = max(x_lo, 0), max(y_lo, 0)
+        x1, y1 = min(x_lo + visible.shape[0], size[0]), min(y_lo + visible.shape[1], size[1])
+        if x0 >= x1 or y0 >= y1:
+            assert not newly.any()
+            continue
+        inside = visible[x0 - x_lo:x1 - x_lo, y0 - y_lo:y1 - y_lo]
+        assert (newly[x0 - x_lo:x1 - x_lo, y0 - y_lo:y1 - y_lo] == (inside & ~dense[x0:x1, y0:y1])).all()
+        dense[x0:x1, y0:y1] |= inside
+    return fog, dense
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_packed_chunks_match_a_plain_array(seed):
+    rng = np.random.default_rng(seed)
+    # not a multiple of the chunk size, so the last chunks are only partly on the map
+    size = (70, 45)
+    fog, dense = random_fog(rng, size)
+
+    assert (fog.to_array() == dense).all()
+    assert fog.count() == np.count_nonzero(dense)
+    for x, y in rng.integers(0, size, (200, 2)):
+        assert fog[x, y] == dense[x, y]
+        assert fog[x][y] == dense[x, y]
+    assert fog[-1, -1] == dense[-1, -1]
+    # only chunks with something revealed in them are stored
+    assert fog.nbytes == len(fog._chunks) * FogOfWar.CHUNK**2 // 8
+
+
+def test_revealing_a_tile_again_does_not_change_the_revision():
+    fog = FogOfWar((40, 40))
+    fog[35, 3] = True
+    revision = fog.revision
+    assert not fog.reveal(35, 3, np.ones((1, 1), dtype=bool)).any()
+    assert fog.revision == revision
+    assert list(fog._chunks) == [(1, 0)]
+
+
+def test_out_of_bounds_index_raises():
+    fog = FogOfWar((10, 10))
+    with pytest.raises(IndexError):
+        fog[10, 0]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_union_and_intersection_match_a_plain_array(seed):
+    rng = np.random.default_rng(seed)
+    size = (70, 45)
+    fogs, arrays = map(list, zip(*[random_fog(rng, size) for _ in range(3)]))
+
+    assert ((fogs[0] | fogs[1]).to_array() == (arrays[0] | arrays[1])).all()
+    assert ((fogs[0] & fogs[1]).to_array() == (arrays[0] & arrays[1])).all()
+    assert (FogOfWar.union(fogs).to_array() == np.logical_or.reduce(arrays)).all()
+    assert (FogOfWar.intersection(fogs).to_array() == np.logical_and.reduce(arrays)).all()
+    # none of that changes the fogs it was made from
+    for fog, dense in zip(fogs, arrays):
+        assert (fog.to_array() == dense).all()
+
+    revision = fogs[0].revision
+    fogs[0] |= fogs[1]
+    assert (fogs[0].to_array() == (arrays[0] | arrays[1])).all()
+    assert fogs[0].revision > revision
@@ -0,0 +1,131 @@
+import numpy as np
+import pytest
+import vectormath as vmath
+
+from simulation.environment import Map
+from simulation.noise import NoiseBuffer
+from simulation.world import World
+
+
+def events(buffer, since=0):
+    """ The events still in the buffer as (x, y, radius, time, source), oldest first """
+    rows = buffer.rows(since)
+    return list(zip(buffer.x[rows].tolist(), buffer.y[rows].tolist(), buffer.radius[rows].tolist(),
+                    buffer.time[rows].tolist(), buffer.source[rows].tolist()))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_buffer_keeps_the_events_of_the_last_ticks(seed):
+    rng = np.random.default_rng(seed)
+    buffer = NoiseBuffer(lifetime=5, capacity=16)
+    added = []
+    for time in range(40):
+        buffer.expire(time)
+        for _ in range(rng.integers(0, 4)):
+            event = (float(rng.uniform(0, 20)), float(rng.uniform(0, 20)), 2.5, time, int(rng.integers(0, 5)))
+            buffer.add(*event)
+            added.append(event)
+
+        # the ones that didn't expire, as far as they still fit
+        expected = [event for event in added if event[3] > time - 5][-16:]
+        assert events(buffer) == expected
+        assert len(buffer) == len(expected)
+        assert buffer.total == len(added)
+
+
+def test_rows_since_only_has_the_newer_events():
+    buffer = NoiseBuffer(lifetime=5, capacity=4)
+    for i in range(6):
+        buffer.add(i, 0, 1, 0)
+    # the first two were dropped to make room
+    assert [x for x, *_ in events(buffer, since=0)] == [2, 3, 4, 5]
+    assert [x for x, *_ in events(buffer, since=4)] == [4, 5]
+    assert len(buffer.rows(since=6)) == 0
+
+    buffer.clear()
+    assert len(buffer) == 0 and buffer.total == 6
+
+
+def hears_one_by_one(buffer, x, y, IDs, since):
+    return [(i, row) for i in range(len(x)) for row in buffer.rows(since)
+            if (buffer.x[row] - x[i])**2 + (buffer.y[row] - y[i])**2 < buffer.radius[row]**2 and
+            buffer.source[row] != IDs[i]]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_perceive_matches_one_by_one(seed):
+    rng = np.random.default_rng(seed)
+    buffer = NoiseBuffer(lifetime=40, capacity=32)
+    for time in range(40):
+        buffer.add(*rng.uniform(0, 20, 2), rng.choice([0.5, 2.5, 5.0]), time, int(rng.integers(0, 10)))
+    x, y, IDs = rng.uniform(0, 20, 10), rng.uniform(0, 20, 10), np.arange(10)
+
+    for since in (0, 20, 35):
+        agents, rows = buffer.perceive(x, y, IDs, since)
+        assert sorted(zip(agents.tolist(), rows.tolist())) == sorted(hears_one_by_one(buffer, x, y, IDs, since))
+
+
+def test_agents_do_not_hear_themselves():
+    buffer = NoiseBuffer(lifetime=5)
+    buffer.add(1.0, 1.0, 2.5, 0, source=3)
+    agents, rows = buffer.perceive(np.array([1.0, 1.5]), np.array([1.0, 1.0]), np.array([3, 4]))
+    assert agents.tolist() == [1]
+
+
+@pytest.mark.parametrize('n', [0, 3, 10, 25])
+def test_extend_matches_adding_one_by_one(n):
+    rng = np.random.default_rng(n)
+    one_by_one, batched = NoiseBuffer(lifetime=5, capacity=8), NoiseBuffer(lifetime=5, capacity=8)
+    for time in range(3):
+        x, y, radius, source = rng.uniform(0, 20, n), rng.uniform(0, 20, n), rng.uniform(0, 5, n), rng.integers(0, 9, n)
+        for i in range(n):
+            one_by_one.add(x[i], y[i], radius[i], time, source[i])
+        batched.extend(x, y, radius, time, source)
+        assert events(batched) == events(one_by_one)
+        assert batched.total == one_by_one.total
+
+
+class FakeAgent:
+    """ Just what the world reads from an agent to make noise """
+
+    def __init__(self, ID, move_speed):
+        self.ID = ID
+        self.move_speed = move_speed
+        self.location = vmath.Vector2(ID, 2 * ID)
+
+
+class Always:
+    """ A random number generator that always has everyone make noise """
+
+    def random(self, n):
+        return np.zeros(n)
+
+    def integers(self, low, high):
+        return low
+
+
+def radius_for(move_speed):
+    """ How `Agent.make_noise` used to work out how loud an agent is """
+    radius = 0
+    if move_speed > 0:
+        radius = 1 / 2
+    if move_speed > 0.5:
+        radius = 3 / 2
+    if move_speed > 1:
+        radius = 5 / 2
+    if move_speed > 2:
+        radius = 10 / 2
+    return radius
+
+
+def test_agents_make_noise_as_loud_as_they_move():
+    world = World(Map((20, 20)))
+    speeds = [0.0, 0.3, 0.5, 0.7, 1.0, 1.4, 2.0, 3.0]
+    world.agents = {ID: FakeAgent(ID, speed) for ID, speed in enumerate(speeds, 1)}
+    world.rng = Always()
+    world.emit_noise()
+
+    # the environment's noise first, standing still doesn't make any
+    expected = [(0.0, 0.0, World.AMBIENT_NOISE_RADIUS, 0, 0)] + \
+               [(float(ID), 2.0 * ID, radius_for(speed), 0, ID) for ID, speed in enumerate(speeds, 1) if speed > 0]
+    assert events(world.noises) == expected
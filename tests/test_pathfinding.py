@@ -0,0 +1,289 @@
+import heapq
+import numpy as np
+import pytest
+
+from simulation.pathfinding import GridAStar, DStarLite, JumpPointSearch, HPAStar, FlowField, AnytimeAStar, \
+    CostLayers
+
+
+def path_cost(path, height):
+    xs, ys = np.divmod(path, height)
+    steps = np.abs(np.diff(xs)) + np.abs(np.diff(ys))
+    return float(np.where(steps == 2, 2**0.5, 1).sum())
+
+
+@pytest.mark.parametrize('seed', [3, 98, 114, 115, 180] + list(range(20)))
+def test_incremental_paths_stay_shortest_when_walls_are_revealed(seed):
+    rng = np.random.default_rng(seed)
+    width = height = 30
+    walls = rng.random((width, height)) < 0.3
+    start, goal = 0, width * height - 1
+    walls[0, 0] = walls[-1, -1] = False
+
+    known = np.zeros((width, height), dtype=bool)
+    planner = DStarLite(width, height, goal)
+    planner.path(GridAStar.moves(~known), start)
+    for batch in np.array_split(rng.permutation(np.argwhere(walls)), 5):
+        before = GridAStar.moves(~known)
+        known[batch[:, 0], batch[:, 1]] = True
+        moves = GridAStar.moves(~known)
+        planner.tiles_changed(np.nonzero((before != moves).reshape(-1))[0].tolist())
+
+        incremental = planner.path(moves, start)
+        expected = GridAStar(width, height).search(moves, start, goal)
+        if expected is None:
+            assert incremental is None
+        else:
+            assert incremental is not None
+            assert path_cost(incremental, height) == pytest.approx(path_cost(expected, height))
+
+
+def shortest_cost(moves, start, goal, costs=None):
+    """ Plain Dijkstra over `moves`, as a reference for the searches, moving onto a tile costs the move times `costs` """
+    height = moves.shape[1]
+    distance = {start: 0.0}
+    queue = [(0.0, start)]
+    while queue:
+        d, tile = heapq.heappop(queue)
+        if tile == goal:
+            return d
+        if d > distance[tile]:
+            continue
+        x, y = divmod(tile, height)
+        for bit, (dx, dy) in enumerate(GridAStar.MOVES):
+            if moves[x, y] & (1 << bit):
+                other = (x + dx) * height + y + dy
+                cost = d + (2**0.5 if dx and dy else 1) * (1 if costs is None else costs[x + dx, y + dy])
+                if cost < distance.get(other, np.inf):
+                    distance[other] = cost
+                    heapq.heappush(queue, (cost, other))
+    return np.inf
+
+
+def is_walkable(path, moves):
+    """ Whether every step of the path is an allowed move """
+    height = moves.shape[1]
+    for a, b in zip(path[:-1], path[1:]):
+        (x0, y0), (x1, y1) = divmod(int(a), height), divmod(int(b), height)
+        move = (x1 - x0, y1 - y0)
+        if move not in GridAStar.MOVES or not moves[x0, y0] & (1 << GridAStar.MOVES.index(move)):
+            return False
+    return True
+
+
+def random_grid(seed, width=30, height=30, density=0.3):
+    rng = np.random.default_rng(seed)
+    walls = rng.random((width, height)) < density
+    return walls, GridAStar.moves(~walls), rng
+
+
+def random_pairs(rng, walls, n=20):
+    tiles = np.flatnonzero(~walls.reshape(-1))
+    return [(int(a), int(b)) for a, b in rng.choice(tiles, (n, 2))]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_grid_astar_finds_shortest_paths(seed):
+    walls, moves, rng = random_grid(seed)
+    search = GridAStar(*walls.shape)
+    for start, goal in random_pairs(rng, walls):
+        path = search.search(moves, start, goal)
+        expected = shortest_cost(moves, start, goal)
+        if expected == np.inf:
+            assert path is None
+        else:
+            assert path[0] == start and path[-1] == goal
+            assert is_walkable(path, moves)
+            assert path_cost(path, walls.shape[1]) == pytest.approx(expected)
+
+
+def test_grid_astar_does_not_cut_corners():
+    walls = np.zeros((3, 3), dtype=bool)
+    walls[1, 0] = walls[0, 1] = True
+    moves = GridAStar.moves(~walls)
+    path = GridAStar(3, 3).search(moves, 0, 4)
+    assert path is None
+
+
+def flat(path, height):
+    return np.array([x * height + y for x, y in path])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_jump_point_search_finds_shortest_paths(seed):
+    walls, moves, rng = random_grid(seed)
+    height = walls.shape[1]
+    search = JumpPointSearch(~walls)
+    for start, goal in random_pairs(rng, walls):
+        path = search.search(divmod(start, height), divmod(goal, height))
+        expected = shortest_cost(moves, start, goal)
+        if expected == np.inf:
+            assert path is None
+        else:
+            path = flat(path, height)
+            assert path[0] == start and path[-1] == goal
+            assert is_walkable(path, moves)
+            assert path_cost(path, height) == pytest.approx(expected)
+
+
+def test_jump_point_search_follows_new_walls():
+    walls, moves, rng = random_grid(0, density=0.15)
+    height = walls.shape[1]
+    known = np.zeros(walls.shape, dtype=bool)
+    search = JumpPointSearch(~known)
+    for batch in np.array_split(rng.permutation(np.argwhere(walls)), 4):
+        known[batch[:, 0], batch[:, 1]] = True
+        search.tiles_changed(map(tuple, batch))
+        moves = GridAStar.moves(~known)
+        for start, goal in random_pairs(rng, known, n=10):
+            path = search.search(divmod(start, height), divmod(goal, height))
+            expected = shortest_cost(moves, start, goal)
+            assert (path is None) == (expected == np.inf)
+            if path is not None:
+                assert is_walkable(flat(path, height), moves)
+                assert path_cost(flat(path, height), height) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_hierarchical_paths_are_walkable_and_close_to_shortest(seed):
+    walls, moves, rng = random_grid(seed, 50, 50, density=0.2)
+    height = walls.shape[1]
+    search = HPAStar(~walls, moves, cluster_size=10)
+    for start, goal in random_pairs(rng, walls, n=30):
+        path = search.search(start, goal)
+        expected = shortest_cost(moves, start, goal)
+        assert (path is None) == (expected == np.inf)
+        if path is None:
+            continue
+        assert path[0] == start and path[-1] == goal
+        assert is_walkable(path, moves)
+
+        (sx, sy), (gx, gy) = search._cluster(start), search._cluster(goal)
+        if abs(sx - gx) <= 1 and abs(sy - gy) <= 1:
+            # nearby tiles get an exact search
+            assert path_cost(path, height) == pytest.approx(expected)
+        else:
+            # the detours through the entrances add up to about a cluster's width at most
+            assert expected - 1e-9 <= path_cost(path, height) <= expected + search.cluster_size
+
+
+def test_hierarchical_search_follows_new_walls():
+    walls, moves, rng = random_grid(1, 50, 50, density=0.2)
+    known = np.zeros(walls.shape, dtype=bool)
+    passable, moves = ~known, GridAStar.moves(~known)
+    search = HPAStar(passable, moves, cluster_size=10)
+    for batch in np.array_split(rng.permutation(np.argwhere(walls)), 4):
+        # the search works on these arrays, so they're changed in place
+        known[batch[:, 0], batch[:, 1]] = True
+        passable[:] = ~known
+        moves[:] = GridAStar.moves(passable)
+        search.tiles_changed(map(tuple, batch))
+        for start, goal in random_pairs(rng, known, n=5):
+            path = search.search(start, goal)
+            assert (path is None) == (shortest_cost(moves, start, goal) == np.inf)
+            if path is not None:
+                assert is_walkable(path, moves)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_flow_field_matches_shortest_paths(seed):
+    walls, moves, rng = random_grid(seed)
+    height = walls.shape[1]
+    for goal, _ in random_pairs(rng, walls, n=2):
+        field = FlowField(moves, goal)
+        for start, _ in random_pairs(rng, walls):
+            expected = shortest_cost(moves, start, goal)
+            assert field.distance[start] == pytest.approx(expected)
+            path = field.path(start)
+            if expected == np.inf:
+                assert path is None
+            else:
+                assert path[0] == start and path[-1] == goal
+                assert is_walkable(path, moves)
+                assert path_cost(path, height) == pytest.approx(expected)
+
+
+def test_flow_field_leads_off_a_wall():
+    walls = np.zeros((5, 5), dtype=bool)
+    walls[2, 2] = True
+    field = FlowField(GridAStar.moves(~walls), 0)
+    # the wall itself can't be reached, but an agent standing on it still knows where to go
+    assert field.next[2 * 5 + 2] == 1 * 5 + 1
+    assert field.distance[2 * 5 + 2] == pytest.approx(2 * 2**0.5)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_anytime_search_spread_out_finds_shortest_paths(seed):
+    walls, moves, rng = random_grid(seed)
+    height = walls.shape[1]
+    for start, goal in random_pairs(rng, walls, n=10):
+        search = AnytimeAStar(moves, start, goal)
+        while not search.run(expansions=20):
+            # until it's done, the best so far is a walkable start of a path
+            partial = search.path()
+            assert partial[0] == start and is_walkable(partial, moves)
+        expected = shortest_cost(moves, start, goal)
+        path = search.path()
+        if expected == np.inf:
+            assert not search.found and path is None
+        else:
+            assert search.found and path[-1] == goal
+            assert is_walkable(path, moves)
+            assert path_cost(path, height) == pytest.approx(expected)
+
+
+def test_anytime_search_knows_when_walls_turn_up_where_it_searched():
+    walls = np.zeros((20, 20), dtype=bool)
+    search = AnytimeAStar(GridAStar.moves(~walls), 0, 20 * 20 - 1)
+    search.run(expansions=10)
+    search.tiles_changed([20 * 20 - 2])
+    assert not search.invalid
+    search.tiles_changed([0])
+    assert search.invalid
+
+
+def weighted_cost(path, height, costs):
+    xs, ys = np.divmod(path, height)
+    steps = np.abs(np.diff(xs)) + np.abs(np.diff(ys))
+    return float((np.where(steps == 2, 2**0.5, 1) * costs[xs[1:], ys[1:]]).sum())
+
+
+def test_cost_layers_add_up():
+    rng = np.random.default_rng(0)
+    layers = CostLayers(20, 15)
+    expected = {'base': np.ones((20, 15))}
+    assert layers.uniform and layers._costs is None
+
+    layers.set('mud', rng.random((20, 15)))
+    expected['mud'] = layers['mud'].copy()
+    layers.update('base', 3, 4, np.full((5, 2), 2.0))
+    expected['base'][3:8, 4:6] = 2.0
+    xs, ys = rng.integers(0, 15, (2, 10))
+    layers.update_tiles('danger', xs, ys, 5.0)
+    expected['danger'] = np.zeros((20, 15))
+    expected['danger'][xs, ys] = 5.0
+    assert np.allclose(layers.costs, sum(expected.values()))
+    assert not layers.uniform
+
+    layers.remove('mud')
+    layers.remove('danger')
+    del expected['mud'], expected['danger']
+    assert np.allclose(layers.costs, sum(expected.values()))
+    layers.update('base', 3, 4, np.ones((5, 2)))
+    assert layers.uniform
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_grid_astar_with_costs_finds_cheapest_paths(seed):
+    walls, moves, rng = random_grid(seed)
+    height = walls.shape[1]
+    costs = 1 + 4 * rng.random(walls.shape)
+    search = GridAStar(*walls.shape)
+    for start, goal in random_pairs(rng, walls, n=10):
+        path = search.search(moves, start, goal, costs)
+        expected = shortest_cost(moves, start, goal, costs)
+        if expected == np.inf:
+            assert path is None
+        else:
+            assert is_walkable(path, moves)
+            assert weighted_cost(path, height, costs) == pytest.approx(expected)
@@ -0,0 +1,178 @@
+import math
+import numpy as np
+import pytest
+import vectormath as vmath
+
+from simulation.perception import Perception
+# the views of the agents come from the vision module, which can only be loaded along with the world
+import simulation.world  # noqa: F401
+from simulation.environment import Map
+from simulation.stencil import bresenham
+from simulation.vision import MapView
+
+
+class FakeAgent:
+    """ Just what the perception reads from an agent """
+
+    def __init__(self, ID, rng, size=40):
+        self.ID = ID
+        self.location = vmath.Vector2(*rng.uniform(0, size, 2))
+        self.heading = float(rng.uniform(-180, 180))
+        self.view_range = float(rng.choice([6.0, 20.0]))
+        self.view_angle = 45.0
+        self.visibility_range = float(rng.choice([3.0, 10.0, 30.0]))
+        self.is_captured = bool(rng.random() < 0.1)
+        self.map = None
+        self._in_tower = False
+        self.tower_view_range = 15.0
+
+
+def random_agents(seed, n=40):
+    rng = np.random.default_rng(seed)
+    return {ID: FakeAgent(ID, rng) for ID in range(1, n + 1)}
+
+
+def seen_one_by_one(agents, agent):
+    """ How `World.tick` used to work out what an agent can see, one other agent at a time """
+    seen = []
+    for other in agents.values():
+        if other is agent:
+            continue
+        d = other.location - agent.location
+        angle_diff = abs((-math.degrees(math.atan2(d.y, d.x)) + 90 - agent.heading + 180) % 360 - 180)
+        if ((d.length <= agent.view_range and d.length <= other.visibility_range and
+             angle_diff <= agent.view_angle) or d.length <= 1.0) and not other.is_captured:
+            seen.append(other.ID)
+    return seen
+
+
+def test_perceive_matches_one_by_one():
+    for seed in range(5):
+        agents = random_agents(seed)
+        perception = Perception()
+        perception.rebuild(agents)
+        for ID, agent in agents.items():
+            assert [view.ID for view in perception.perceive(ID)] == seen_one_by_one(agents, agent)
+
+
+def test_perceive_follows_agents_that_moved():
+    agents = random_agents(5)
+    perception = Perception()
+    perception.rebuild(agents)
+    rng = np.random.default_rng(5)
+    for ID, agent in agents.items():
+        agent.location = vmath.Vector2(*rng.uniform(0, 40, 2))
+        perception.update(ID)
+    for ID, agent in agents.items():
+        assert [view.ID for view in perception.perceive(ID)] == seen_one_by_one(agents, agent)
+
+
+def is_visible(m, x0, y0, x, y):
+    for x_line, y_line in bresenham(x0, y0, x, y):
+        if (x_line, y_line) == (x, y):
+            return True
+        if m.is_wall(x_line, y_line):
+            return False
+
+
+def occluded_map(seed):
+    rng = np.random.default_rng(seed)
+    m = Map((40, 40))
+    m.walls = rng.random((40, 40)) < 0.15
+    return m
+
+
+def test_occlusion_matches_one_by_one():
+    for seed in range(5):
+        m = occluded_map(seed)
+        agents = random_agents(seed)
+        for agent in agents.values():
+            agent.map = MapView(m)
+        perception = Perception()
+        perception.rebuild(agents)
+        for ID, agent in agents.items():
+            x0, y0 = int(agent.location.x), int(agent.location.y)
+            expected = [other for other in seen_one_by_one(agents, agent)
+                        if (agents[other].location - agent.location).length <= 1.0 or
+                        is_visible(m, x0, y0, int(agents[other].location.x), int(agents[other].location.y))]
+            assert [view.ID for view in perception.perceive(ID, occlusion=True)] == expected
+
+
+def test_occlusion_notices_new_walls():
+    m = Map((20, 20))
+    agents = random_agents(0, n=2)
+    agents[1].location, agents[1].heading = vmath.Vector2(2.5, 5.5), 90.0
+    agents[2].location, agents[2].visibility_range = vmath.Vector2(8.5, 5.5), 30.0
+    for agent in agents.values():
+        agent.map = MapView(m)
+        agent.view_range = 20.0
+    perception = Perception()
+
+    perception.rebuild(agents)
+    assert [view.ID for view in perception.perceive(1, occlusion=True)] == [2]
+    m.set_wall(5, 5)
+    perception.rebuild(agents)
+    assert [view.ID for view in perception.perceive(1, occlusion=True)] == []
+
+
+def test_from_a_tower_only_the_viewshed_is_seen():
+    m = occluded_map(6)
+    agents = random_agents(6)
+    watcher = agents[1]
+    watcher.map, watcher._in_tower, watcher.view_range, watcher.view_angle = MapView(m), True, 60.0, 180.0
+    perception = Perception()
+    perception.rebuild(agents)
+
+    x0, y0 = int(watcher.location.x), int(watcher.location.y)
+    viewshed = watcher.map.tower_viewshed(x0, y0, watcher.tower_view_range * m.get_vision_modifier(x0, y0))
+    expected = [other for other in seen_one_by_one(agents, watcher)
+                if (agents[other].location - watcher.location).length <= 1.0 or
+                viewshed.sees(int(agents[other].location.x), int(agents[other].location.y))]
+    assert [view.ID for view in perception.perceive(1, occlusion=True)] == expected
+
+
+def test_results_are_as_things_were_when_the_agent_looked():
+    agents = random_agents(7)
+    perception = Perception()
+    perception.rebuild(agents)
+    expected = {ID: seen_one_by_one(agents, agent) for ID, agent in agents.items()}
+    # nothing is worked out yet, everyone moves first
+    results = {ID: perception.perceive(ID) for ID in agents}
+    rng = np.random.default_rng(7)
+    for ID, agent in agents.items():
+        agent.location = vmath.Vector2(*rng.uniform(0, 40, 2))
+        perception.update(ID)
+
+    for ID, seen in results.items():
+        assert [view.ID for view in seen] == expected[ID]
+
+
+def test_results_act_like_a_list_of_views():
+    agents = random_agents(8)
+    perception = Perception()
+    perception.rebuild(agents)
+    ID = max(agents, key=lambda ID: len(seen_one_by_one(agents, agents[ID])))
+    seen = perception.perceive(ID)
+
+    views = list(seen)
+    assert len(seen) == len(views) > 0
+    assert seen[0] is views[0] and seen[-1] is views[-1]
+    assert seen == views
+    assert seen + [] == views and [] + seen == views
+    assert (views[0].location == agents[views[0].ID].location).all()
+    # the location is shared between everyone looking at the agent, so it can't be changed
+    with pytest.raises(ValueError):
+        views[0].location.x = 0
+
+
+def test_views_are_reused_between_ticks():
+    agents = random_agents(9)
+    perception = Perception()
+    perception.rebuild(agents)
+    ID = max(agents, key=lambda ID: len(seen_one_by_one(agents, agents[ID])))
+    before = list(perception.perceive(ID))
+
+    perception.rebuild(agents)
+    after = list(perception.perceive(ID))
+    assert after == before
+    assert all(a is b for a, b in zip(after, before))
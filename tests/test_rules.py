@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import vectormath as vmath
+
+from simulation.rules import CaptureRule
+# the views of the agents come from the vision module, which can only be loaded along with the world
+import simulation.world  # noqa: F401
+from simulation.environment import Map
+from simulation.vision import MapView
+
+
+class FakeAgent:
+    """ Just what the capture rule reads from an agent """
+
+    def __init__(self, ID, x, y, m=None):
+        self.ID = ID
+        self.location = vmath.Vector2(x, y)
+        self.map = None if m is None else MapView(m)
+
+
+def random_agents(seed, m, n, first_ID=1, guards=False):
+    rng = np.random.default_rng(seed)
+    return {ID: FakeAgent(ID, *rng.uniform(0, 8, 2), m if guards else None) for ID in range(first_ID, first_ID + n)}
+
+
+def captures_one_by_one(guards, intruders):
+    """ Every intruder along with the first guard close enough that can see it, looking at all the guards """
+    captured = []
+    for intruder in intruders.values():
+        for guard in guards.values():
+            if (intruder.location - guard.location).length <= CaptureRule.DISTANCE and \
+                    guard.map._is_tile_visible_from(int(guard.location.x), int(guard.location.y),
+                                                    int(intruder.location.x), int(intruder.location.y)):
+                captured.append(intruder.ID)
+                break
+    return captured
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_captures_match_looking_at_every_guard(seed):
+    m = Map((8, 8))
+    m.walls = np.random.default_rng(seed).random((8, 8)) < 0.3
+    guards = random_agents(seed, m, 40, guards=True)
+    intruders = random_agents(seed + 100, m, 40, first_ID=100)
+    rule = CaptureRule()
+
+    captured = rule.captures(guards, intruders)
+    assert [intruder.ID for intruder, guard in captured] == captures_one_by_one(guards, intruders)
+    for intruder, guard in captured:
+        assert (intruder.location - guard.location).length <= CaptureRule.DISTANCE
+
+    # the guards move around, the rule keeps up with that
+    rng = np.random.default_rng(seed)
+    for guard in guards.values():
+        guard.location = vmath.Vector2(*rng.uniform(0, 8, 2))
+    assert [intruder.ID for intruder, guard in rule.captures(guards, intruders)] == \
+        captures_one_by_one(guards, intruders)
+
+
+def test_only_guards_that_can_see_the_intruder_capture_it(monkeypatch):
+    m = Map((8, 8))
+    guards = {1: FakeAgent(1, 3.9, 3.5, m), 2: FakeAgent(2, 4.3, 3.6, m), 3: FakeAgent(3, 6.5, 6.5, m)}
+    intruders = {4: FakeAgent(4, 4.1, 3.5)}
+    assert [(intruder.ID, guard.ID in (1, 2)) for intruder, guard in CaptureRule().captures(guards, intruders)] == \
+        [(4, True)]
+
+    # a wall is never in the way that close, so the first guard is just made blind
+    monkeypatch.setattr(guards[1].map, '_is_tile_visible_from', lambda *args: False)
+    assert [(intruder.ID, guard.ID) for intruder, guard in CaptureRule().captures(guards, intruders)] == [(4, 2)]
+    monkeypatch.setattr(guards[2].map, '_is_tile_visible_from', lambda *args: False)
+    assert CaptureRule().captures(guards, intruders) == []
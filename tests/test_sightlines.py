@@ -0,0 +1,45 @@
+import numpy as np
+
+from simulation.sightlines import SightLines
+from simulation.stencil import bresenham
+
+
+def is_visible(walls, x0, y0, x, y):
+    for x_line, y_line in bresenham(x0, y0, x, y):
+        if (x_line, y_line) == (x, y):
+            return True
+        if not (0 <= x_line < walls.shape[0] and 0 <= y_line < walls.shape[1]) or walls[x_line, y_line]:
+            return False
+
+
+def test_table_matches_bresenham():
+    rng = np.random.default_rng(0)
+    walls = rng.random((30, 25)) < 0.25
+    table = SightLines(walls)
+
+    for x0, y0 in rng.integers(0, walls.shape, (20, 2)):
+        for dx, dy in rng.integers(-SightLines.RANGE, SightLines.RANGE + 1, (40, 2)):
+            x, y = x0 + dx, y0 + dy
+            assert table.covers(x0, y0, x, y)
+            assert table.is_visible(x0, y0, x, y) == is_visible(walls, x0, y0, x, y), (x0, y0, x, y)
+
+
+def test_windows_match_bresenham():
+    rng = np.random.default_rng(1)
+    walls = rng.random((30, 25)) < 0.25
+    table = SightLines(walls)
+
+    offset = 6
+    x0, y0 = rng.integers(0, walls.shape, (5, 2)).T
+    windows = table.windows(x0, y0, offset)
+    for i in range(len(x0)):
+        expected = [[is_visible(walls, x0[i], y0[i], x0[i] + dx, y0[i] + dy) for dy in range(-offset, offset + 1)]
+                    for dx in range(-offset, offset + 1)]
+        assert (windows[i] == np.array(expected)).all()
+        assert (table.window(x0[i], y0[i], offset) == windows[i]).all()
+
+
+def test_table_only_covers_tiles_in_range():
+    table = SightLines(np.zeros((10, 10), dtype=bool))
+    assert not table.covers(0, 0, SightLines.RANGE + 1, 0)
+    assert not table.covers(-1, 0, 0, 0)
@@ -0,0 +1,293 @@
+import math
+import numpy as np
+import pytest
+
+# the world has to be imported before the vision module, they import each other
+import simulation.world  # noqa: F401
+from simulation.environment import Map
+from simulation.sightlines import SightLines
+from simulation.stencil import Stencil, bresenham
+from simulation.vision import MapView, TowerViewshed, VisionBackend, reveal_visible_batch, shadowcast
+
+
+def random_map(seed, size=(40, 40)):
+    """ An open map with random walls, a couple of towers and a patch where vision is halved """
+    rng = np.random.default_rng(seed)
+    m = Map(size)
+    m.walls = rng.random(size) < 0.2
+    m.vision_modifier = np.ones(size, dtype=np.float32)
+    m.vision_modifier[:10, :10] = 0.5
+    for x, y in rng.integers(0, size, (3, 2)):
+        m.walls[x, y] = False
+        m.add_tower(int(x), int(y))
+    return m
+
+
+def random_requests(seed, m, n=30):
+    """ Random (x0, y0, radius, view_angle, heading, in_tower) to reveal from """
+    rng = np.random.default_rng(seed)
+    return [(int(rng.integers(0, m.width)), int(rng.integers(0, m.height)), float(rng.choice([0, 4.5, 7.5, 20])),
+             float(rng.choice([45, 90, 360])), float(rng.uniform(-180, 180)), False) for _ in range(n)]
+
+
+def is_visible(m, x0, y0, x, y):
+    for x_line, y_line in bresenham(x0, y0, x, y):
+        if (x_line, y_line) == (x, y):
+            return True
+        if m.is_wall(x_line, y_line):
+            return False
+
+
+def reveal_tile_by_tile(m, x0, y0, radius, view_angle, heading, in_tower):
+    """ What `MapView._reveal_visible` used to do, one tile at a time """
+    fog = np.zeros(m.size, dtype=bool)
+    vision_modifier = m.get_vision_modifier(x0, y0)
+    offset = int(math.ceil(18*vision_modifier))
+    for x in range(x0 - offset, x0 + offset + 1):
+        for y in range(y0 - offset, y0 + offset + 1):
+            if not m.in_bounds(x, y):
+                continue
+            angle = math.atan2(y0 - y, x0 - x) * 180 / np.pi
+            angle = (angle + heading + 90 + 180) % 360 - 180
+            if angle > view_angle / 2 or angle < -view_angle / 2:
+                continue
+            distance = (x - x0)**2 + (y - y0)**2
+            if distance > (18*vision_modifier)**2:
+                continue
+            elif m.is_tower(x, y) and radius > 0:
+                fog[x, y] = True
+                continue
+            elif distance > radius**2:
+                if distance > (10*vision_modifier)**2 or not m.is_wall(x, y) or radius == 0:
+                    continue
+            elif in_tower:
+                fog[x, y] = True
+                continue
+            if is_visible(m, x0, y0, x, y):
+                fog[x, y] = True
+    fog[max(x0 - 1, 0):x0 + 2, max(y0 - 1, 0):y0 + 2] = True
+    return fog
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_stencil_reveal_matches_tile_by_tile(seed):
+    m = random_map(seed)
+    for request in random_requests(seed, m):
+        view = MapView(m)
+        view._reveal_visible(*request)
+        assert (view.fog.to_array() == reveal_tile_by_tile(m, *request)).all(), request
+
+
+def test_reveal_with_sightlines_table_matches_tile_by_tile():
+    m = random_map(3)
+    m.sightlines = SightLines.for_map(m)
+    for request in random_requests(3, m):
+        view = MapView(m)
+        view._reveal_visible(*request)
+        assert (view.fog.to_array() == reveal_tile_by_tile(m, *request)).all(), request
+
+
+def shadowcast_at(walls, x0, y0, offset, heading=0.0, view_angle=360.0):
+    """ `shadowcast` for a viewer at (x0, y0) of the full map, with everything off the map counting as wall """
+    padded = np.pad(walls, offset, constant_values=True)
+    return shadowcast(padded[x0:x0 + 2 * offset + 1, y0:y0 + 2 * offset + 1], offset, heading, view_angle)
+
+
+def test_shadowcast_sees_everything_on_an_open_map():
+    assert shadowcast(np.zeros((15, 15), dtype=bool), 7, 0.0, 360.0).all()
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_shadowcast_is_symmetric(seed):
+    rng = np.random.default_rng(seed)
+    walls = rng.random((25, 25)) < 0.25
+    offset = 8
+    for x0, y0 in np.argwhere(~walls)[rng.choice(np.count_nonzero(~walls), 10)]:
+        visible = shadowcast_at(walls, x0, y0, offset)
+        for i, j in np.argwhere(visible):
+            x, y = x0 + i - offset, y0 + j - offset
+            if 0 <= x < walls.shape[0] and 0 <= y < walls.shape[1] and not walls[x, y]:
+                assert shadowcast_at(walls, x, y, offset)[x0 - x + offset, y0 - y + offset], (x0, y0, x, y)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_shadowcast_cone_matches_full_circle(seed):
+    rng = np.random.default_rng(seed)
+    walls = rng.random((25, 25)) < 0.25
+    offset = 8
+    stencil = Stencil.get(offset)
+    for _ in range(10):
+        x0, y0 = rng.integers(0, 25, 2)
+        heading, view_angle = rng.uniform(-180, 180), rng.choice([45.0, 90.0, 200.0])
+        # tiles whose center is in the cone, same check as the vision code
+        angle = (stencil.angle + heading + 90 + 180) % 360 - 180
+        cone = ~((angle > view_angle / 2) | (angle < -view_angle / 2))
+        full = shadowcast_at(walls, x0, y0, offset)
+        assert (shadowcast_at(walls, x0, y0, offset, heading, view_angle)[cone] == full[cone]).all()
+
+
+def test_batch_reveal_matches_one_view_at_a_time():
+    m = random_map(4)
+    requests = random_requests(4, m, n=12)
+    backends = [VisionBackend.RAYCAST, VisionBackend.SHADOWCAST] * 6
+    views = [MapView(m, backend=backend) for backend in backends]
+    reveal_visible_batch(list(zip(views, requests)))
+
+    for view, backend, request in zip(views, backends, requests):
+        single = MapView(m, backend=backend)
+        single._reveal_visible(*request)
+        assert (view.fog.to_array() == single.fog.to_array()).all(), request
+
+
+@pytest.mark.parametrize('backend', [VisionBackend.RAYCAST, VisionBackend.SHADOWCAST])
+def test_turning_on_the_spot_reveals_the_same_as_looking_fresh(backend):
+    m = random_map(5)
+    rng = np.random.default_rng(5)
+    for x0, y0, radius, view_angle, heading, in_tower in random_requests(5, m, n=5):
+        view = MapView(m, backend=backend)
+        expected = np.zeros(m.size, dtype=bool)
+        for heading in heading + np.cumsum(rng.uniform(-60, 60, 6)):
+            view._reveal_visible(x0, y0, radius, view_angle, heading, in_tower)
+            fresh = MapView(m, backend=backend)
+            fresh._reveal_visible(x0, y0, radius, view_angle, heading, in_tower)
+            expected |= fresh.fog.to_array()
+            assert (view.fog.to_array() == expected).all()
+
+
+def test_reveal_from_a_tower_matches_tile_by_tile():
+    m = random_map(6)
+    rng = np.random.default_rng(6)
+    for tower in m.towers:
+        x0, y0 = int(tower[0]), int(tower[1])
+        for heading, view_angle in zip(rng.uniform(-180, 180, 4), [30.0, 90.0, 180.0, 360.0]):
+            request = (x0, y0, 15.0, view_angle, heading, True)
+            view = MapView(m)
+            view._reveal_visible(*request)
+            assert (view.fog.to_array() == reveal_tile_by_tile(m, *request)).all(), request
+
+
+def test_tower_viewshed_is_made_again_when_the_walls_change():
+    m = random_map(7)
+    x0, y0 = int(m.towers[0][0]), int(m.towers[0][1])
+    viewshed = TowerViewshed.get(m, x0, y0, 15.0)
+    assert TowerViewshed.get(m, x0, y0, 15.0) is viewshed
+
+    m.set_wall((x0 + 12) % m.width, y0)
+    assert TowerViewshed.get(m, x0, y0, 15.0) is not viewshed
+
+
+def corridor_map():
+    """ An open map with two walls nobody has seen yet, one right on the straight line from (1, 10) to (18, 10) """
+    m = Map((20, 20))
+    m.walls[10, 10] = m.walls[10, 3] = True
+    return m
+
+
+def reveal(view, x, y):
+    view._reveal_window(x, y, np.ones((1, 1), dtype=bool))
+
+
+def test_path_key_only_changes_when_a_wall_is_revealed():
+    view = MapView(corridor_map())
+    start, goal = (1.5, 10.5), (18.5, 10.5)
+    key = view.path_key(start, goal)
+    path = view.find_path(start, goal)
+
+    reveal(view, 5, 5)
+    assert view.path_key(start, goal) == key
+    assert view.find_path(start, goal) is path
+
+    reveal(view, 10, 3)
+    assert view.path_key(start, goal) != key
+    assert view.path_key(start, goal, incremental=True) is None
+
+
+def test_tracked_path_is_only_blocked_by_walls_in_its_way():
+    view = MapView(corridor_map())
+    path = view.find_path((1.5, 10.5), (18.5, 10.5))
+    view.track_path(path)
+    assert not view.is_path_blocked()
+
+    reveal(view, 5, 5)
+    reveal(view, 10, 3)
+    assert not view.is_path_blocked()
+    reveal(view, 10, 10)
+    assert view.is_path_blocked()
+
+    # a new path around the wall is fine again
+    view.track_path(view.find_path((1.5, 10.5), (18.5, 10.5)))
+    assert not view.is_path_blocked()
+
+
+def test_flow_fields_are_shared_until_the_map_changes():
+    m = corridor_map()
+    view, other = MapView(m), MapView(m)
+    field = view.flow_field((18.5, 10.5))
+    assert other.flow_field((18.5, 10.7)) is field
+    # next to the goal there's only one best way to go
+    assert tuple(view.next_waypoint((16.5, 10.5), (18.5, 10.5))) == (17.5, 10.5)
+
+    # with fog each view has its own, which doesn't know about the wall at (10, 10) yet
+    assert view.flow_field((18.5, 10.5), fog=True).distance[9 * 20 + 10] == 9
+    m.set_wall(17, 10)
+    assert view.flow_field((18.5, 10.5)) is not field
+    assert view.next_waypoint((1.5, 10.5), (-5, 0)) is None
+
+
+def test_find_path_with_a_budget_carries_on_where_it_left_off():
+    m = random_map(8)
+    m.walls[1, 1] = m.walls[38, 38] = False
+    view = MapView(m, path_budget=30)
+    full = MapView(m).find_path((1.5, 1.5), (38.5, 38.5))
+
+    calls = 1
+    path = view.find_path((1.5, 1.5), (38.5, 38.5))
+    while view.is_path_pending():
+        # the partial paths all start where we are
+        assert tuple(path.tiles[0]) == (1, 1)
+        path = view.find_path((1.5, 1.5), (38.5, 38.5))
+        calls += 1
+    assert calls > 1
+    assert len(path) == len(full) and tuple(path.tiles[-1]) == (38, 38)
+
+
+def test_fog_penalty_keeps_paths_to_known_ground():
+    view = MapView(Map((20, 20)))
+    view._reveal_window(0, 7, np.ones((20, 2), dtype=bool))
+    start, goal = (1.5, 10.5), (18.5, 10.5)
+    assert all(tile[1] == 10 for tile in view.find_path(start, goal).tiles)
+
+    view.fog_penalty = 10.0
+    path = view.find_path(start, goal)
+    unknown = [tile for tile in path.tiles.tolist() if not view.is_revealed(*tile)]
+    # only the way to the corridor and back out of it
+    assert len(unknown) <= 6
+
+    # layers added by hand count as well
+    view.fog_penalty = 0.0
+    view.cost_layers.update('base', 0, 7, np.full((10, 2), 50.0))
+    path = view.find_path((5.5, 10.5), (5.5, 4.5))
+    assert not any(x < 10 and 7 <= y <= 8 for x, y in path.tiles.tolist())
+
+
+def test_path_cache_keeps_the_most_recently_used_paths():
+    view = MapView(Map((20, 20)))
+    view.path_cache_size = 2
+    first = view.find_path((1.5, 1.5), (18.5, 18.5))
+    with pytest.raises(ValueError):
+        first.points[0, 0] = 0
+    second = view.find_path((1.5, 18.5), (18.5, 1.5))
+    assert view.find_path((1.5, 1.5), (18.5, 18.5)) is first
+    assert (view.path_cache_hits, view.path_cache_misses) == (1, 2)
+
+    # the second path was used longest ago, so it makes room for the third
+    view.find_path((5.5, 5.5), (15.5, 5.5))
+    assert len(view._path_cache) == 2
+    assert view.find_path((1.5, 1.5), (18.5, 18.5)) is first
+    assert view.find_path((1.5, 18.5), (18.5, 1.5)) is not second
+    assert (view.path_cache_hits, view.path_cache_misses) == (2, 4)
+
+    # a wall nobody knew about clears the cache
+    view._map.walls[10, 10] = True
+    reveal(view, 10, 10)
+    assert not view._path_cache